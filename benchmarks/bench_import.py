@@ -0,0 +1,21 @@
+"""
+Cold import time, every run starts a new interpreter. Compare against
+`import.python` which is the bare interpreter startup.
+"""
+import subprocess
+import sys
+
+from benchmarks.runner import benchmark
+
+
+def register(name, statement):
+    @benchmark('import.%s' % name, number=10)
+    def setup():
+        command = [sys.executable, '-c', statement]
+        return lambda: subprocess.check_call(command)
+
+
+register('python', 'pass')
+register('nativeview', 'import nativeview')
+register('nativeview.datetime',
+         'import nativeview; nativeview.DateTime().serialize(0)')
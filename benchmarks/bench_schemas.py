@@ -0,0 +1,253 @@
+"""
+Instantiation, serialization, validation, metadata and sync of the
+representative schemas.
+"""
+import hashlib
+import json
+
+from nativeview import DICT, JSON, LRUCache, ir
+from nativeview.metadata import determine_metadata
+
+from benchmarks.runner import benchmark
+from benchmarks import schemas as s
+
+
+CASES = [
+    # name, schema class, native object, valid data, invalid data
+    ('flat', s.FlatSchema, s.flat_native, s.flat_data, s.flat_invalid_data),
+    ('wide', s.WideSchema, s.wide_data, s.wide_data, s.wide_invalid_data),
+    ('deep', s.DeepSchema, s.deep_data, s.deep_data, s.deep_invalid_data),
+    ('sequence', s.Report, s.report_native, s.report_data,
+     s.report_invalid_data),
+]
+
+
+def _validate(schema_cls, data):
+    # Instantiation is measured separately.
+    schema = schema_cls()
+
+    def func():
+        schema.bind(data=data)
+        schema.is_valid()
+    return func
+
+
+def register(name, schema_cls, native, valid, invalid):
+    number = 10 if name == 'sequence' else 1000
+
+    @benchmark('instantiate.%s' % name, number=1000)
+    def instantiate():
+        return schema_cls
+
+    @benchmark('ir.loads.%s' % name, number=1000)
+    def ir_loads():
+        data = ir.dumps(schema_cls)
+        return lambda: ir.loads(data)
+
+    @benchmark('serialize.%s' % name, number=number)
+    def serialize():
+        schema, value = schema_cls(), native()
+        return lambda: schema.serialize(value)
+
+    @benchmark('serialize.%s.dumps' % name, number=number)
+    def serialize_dumps():
+        schema, value = schema_cls(), native()
+        return lambda: json.dumps(schema.serialize(value))
+
+    @benchmark('serialize.%s.dict' % name, number=number)
+    def serialize_dict():
+        schema, value = schema_cls(), native()
+        return lambda: schema.serialize(value, format=DICT)
+
+    @benchmark('serialize.%s.json' % name, number=number)
+    def serialize_json():
+        schema, value = schema_cls(), native()
+        return lambda: schema.serialize(value, format=JSON)
+
+    @benchmark('serialize.%s.trusted' % name, number=number)
+    def serialize_trusted():
+        schema, value = schema_cls(), native()
+        return lambda: schema.serialize(value, trusted=True)
+
+    @benchmark('serialize.%s.json.trusted' % name, number=number)
+    def serialize_json_trusted():
+        schema, value = schema_cls(), native()
+        return lambda: schema.serialize(value, format=JSON, trusted=True)
+
+    @benchmark('is_valid.%s.valid' % name, number=number)
+    def is_valid():
+        return _validate(schema_cls, valid())
+
+    @benchmark('is_valid.%s.invalid' % name, number=number)
+    def is_valid_invalid():
+        return _validate(schema_cls, invalid())
+
+    @benchmark('is_valid.%s.loads' % name, number=number)
+    def is_valid_loads():
+        schema, text = schema_cls(), json.dumps(valid())
+
+        def func():
+            schema.bind(data=json.loads(text))
+            schema.is_valid()
+        return func
+
+    @benchmark('validate_json.%s' % name, number=number)
+    def validate_json():
+        schema, text = schema_cls(), json.dumps(valid())
+        return lambda: schema.validate_json(text)
+
+    @benchmark('etag.%s' % name, number=number)
+    def etag():
+        schema, value = schema_cls(), native()
+        return lambda: schema.etag(value)
+
+    @benchmark('etag.%s.dumps' % name, number=number)
+    def etag_dumps():
+        # Hashing the response body, as views did before.
+        schema, value = schema_cls(), native()
+        return lambda: hashlib.sha1(
+            json.dumps(schema.serialize(value))).hexdigest()
+
+    @benchmark('metadata.%s' % name, number=1000)
+    def metadata():
+        schema = schema_cls()
+        return lambda: determine_metadata(schema)
+
+
+for case in CASES:
+    register(*case)
+
+
+@benchmark('sync.flat', number=1000)
+def sync_flat():
+    schema = s.FlatObjectSchema(data=s.flat_data(1))
+    schema.is_valid()
+    instance = s.Record(**s.flat_native(0))
+    return lambda: schema.sync(instance)
+
+
+@benchmark('sync.wide', number=1000)
+def sync_wide():
+    schema = s.WideObjectSchema(data=s.wide_data(1))
+    schema.is_valid()
+    instance = s.Record(**s.wide_data(0))
+    return lambda: schema.sync(instance)
+
+
+@benchmark('serialize.flat.cached', number=1000)
+def serialize_cached():
+    class CachedFlatSchema(s.FlatObjectSchema):
+        cache_backend = LRUCache()
+
+    schema = CachedFlatSchema()
+    value = s.Record(version=1, **s.flat_native(1))
+    return lambda: schema.serialize(value)
+
+
+@benchmark('etag.flat.cached', number=1000)
+def etag_cached():
+    class CachedFlatSchema(s.FlatObjectSchema):
+        cache_backend = LRUCache()
+
+    schema = CachedFlatSchema()
+    value = s.Record(version=1, **s.flat_native(1))
+    return lambda: schema.etag(value)
+
+
+@benchmark('context.deep', number=10000)
+def context_deep():
+    schema = s.DeepSchema(context={'user': 'admin'})
+    unit = schema
+    while unit.children:
+        unit = unit.children.values()[-1]
+    return lambda: unit.context
+
+
+@benchmark('get_unit.deep', number=10000)
+def get_unit_deep():
+    schema = s.DeepSchema()
+    path = []
+    unit = schema
+    while unit.children:
+        name, unit = unit.children.items()[-1]
+        path.append(name)
+    path = '.'.join(path)
+    return lambda: schema.get_unit(path)
+
+
+@benchmark('is_valid.events', number=10)
+def is_valid_events():
+    return _validate(s.EventStream, s.events_data())
+
+
+@benchmark('serialize.events.json', number=10)
+def serialize_events_json():
+    schema, value = s.EventStream(), s.events_data()
+    return lambda: schema.serialize(value, format=JSON)
+
+
+@benchmark('is_valid.tree', number=10)
+def is_valid_tree():
+    return _validate(s.NodeSchema, s.tree_data())
+
+
+@benchmark('serialize.tree.json', number=10)
+def serialize_tree_json():
+    schema, value = s.NodeSchema(), s.tree_data()
+    return lambda: schema.serialize(value, format=JSON)
+
+
+@benchmark('is_valid.map', number=10)
+def is_valid_map():
+    return _validate(s.StockSchema, s.stock_data())
+
+
+@benchmark('serialize.map', number=10)
+def serialize_map():
+    schema, value = s.StockSchema(), s.stock_data()
+    return lambda: schema.serialize(value)
+
+
+def _rows(items=s.ITEMS * 10):
+    return [s.Record(**s.flat_native(i)) for i in range(items)]
+
+
+@benchmark('columns.rows', number=10)
+def columns_rows():
+    schema, value = s.RowSequence(), _rows()
+    return lambda: schema.serialize_columns(value)
+
+
+@benchmark('columns.rows.dicts', number=10)
+def columns_rows_dicts():
+    # Pivoting serialized mappings, as consumers did before.
+    schema, value = s.RowSequence(), _rows()
+    names = list(schema.children['row'].children)
+
+    def func():
+        rows = schema.serialize(value, format=DICT)
+        return dict((name, [row.get(name) for row in rows])
+                    for name in names)
+    return func
+
+
+@benchmark('serialize.rows.role', number=10)
+def serialize_rows_role():
+    schema = s.RoleRowSequence(context={'role': 'user'})
+    value = _rows()
+    return lambda: schema.serialize(value, format=DICT)
+
+
+@benchmark('serialize.rows.role.filter', number=10)
+def serialize_rows_role_filter():
+    # Dropping hidden fields from serialized mappings, as views did before.
+    schema, value = s.RowSequence(), _rows()
+    hidden = ('email', 'score', 'birthday')
+
+    def func():
+        rows = schema.serialize(value, format=DICT)
+        for row in rows:
+            for name in hidden:
+                row.pop(name, None)
+        return rows
+    return func
@@ -0,0 +1,68 @@
+"""
+CSV export and import of flat rows, compared with serializing rows into
+mappings for `csv.DictWriter` and validating mappings of `csv.DictReader`.
+"""
+import csv
+import io
+
+from nativeview import tabular
+
+from benchmarks.runner import benchmark
+from benchmarks import schemas as s
+
+
+ROWS = 20000
+
+
+def objects():
+    return [s.flat_native(i) for i in range(ROWS)]
+
+
+def csv_data():
+    f = io.BytesIO()
+    tabular.dump(s.FlatSchema, objects(), f)
+    return f.getvalue()
+
+
+@benchmark('tabular.dump', number=1)
+def dump():
+    values = objects()
+
+    def func():
+        tabular.dump(s.FlatSchema, values, io.BytesIO())
+    return func
+
+
+@benchmark('tabular.dump.dictwriter', number=1)
+def dump_dictwriter():
+    values = objects()
+    schema = s.FlatSchema()
+
+    def func():
+        writer = csv.DictWriter(io.BytesIO(), tabular.columns(schema))
+        writer.writeheader()
+        for value in values:
+            writer.writerow(schema.serialize(value))
+    return func
+
+
+@benchmark('tabular.load', number=1)
+def load():
+    data = csv_data()
+
+    def func():
+        for row in tabular.load(s.FlatSchema, io.BytesIO(data)):
+            pass
+    return func
+
+
+@benchmark('tabular.load.dictreader', number=1)
+def load_dictreader():
+    data = csv_data()
+    schema = s.FlatSchema()
+
+    def func():
+        for row in csv.DictReader(io.BytesIO(data)):
+            schema.bind(data=row)
+            schema.is_valid()
+    return func
@@ -0,0 +1,214 @@
+"""
+Validation of sparse and error-heavy payloads.
+"""
+from nativeview import (
+    SchemaUnit, MappingSchema, SequenceSchema, Sequence, ValidationSnapshot)
+from nativeview import Integer, Float, String, Boolean, DateTime
+from nativeview.validators import Choices, Range, Length
+from nativeview.preparers import (
+    preparer_chain, Strip, NormalizeWhitespace, Lower, EmptyToNone)
+from nativeview.synthetic import PayloadGenerator
+
+from benchmarks.runner import benchmark
+
+
+FIELDS = 30
+ROWS = 200
+COUNTRIES = ['de', 'fr', 'it', 'es', 'pl', 'nl', 'be', 'at', 'ch', 'se']
+
+
+def make_row_schema():
+    attrs = {}
+    for i in range(FIELDS):
+        type_ = (Integer, Float, String, Boolean)[i % 4]
+        attrs['field_%d' % i] = SchemaUnit(type_(), required=False)
+    return type('Row', (MappingSchema,), attrs)
+
+
+Row = make_row_schema()
+
+
+class Rows(SequenceSchema):
+    row = Row()
+
+
+def sparse_payload():
+    return [{'field_0': i, 'field_1': 1.5} for i in range(ROWS)]
+
+
+def invalid_payload():
+    row = dict(('field_%d' % i, 'broken') for i in range(FIELDS)
+               if i % 4 in (0, 1, 3))
+    return [dict(row) for i in range(ROWS)]
+
+
+def dense_payload():
+    values = (1, 1.5, 'text', True)
+    row = dict(('field_%d' % i, values[i % 4]) for i in range(FIELDS))
+    return [dict(row) for i in range(ROWS)]
+
+
+def register(name, payload):
+    @benchmark('validation.%s' % name, number=20)
+    def setup():
+        data = payload()
+        schema = Rows()
+
+        def func():
+            schema.bind(data=data)
+            schema.is_valid()
+        return func
+
+
+register('sparse', sparse_payload)
+register('invalid', invalid_payload)
+register('dense', dense_payload)
+
+
+def make_form_schema(preparer):
+    attrs = dict(('field_%d' % i, SchemaUnit(String(), preparer=preparer))
+                 for i in range(FIELDS))
+    return type('Form', (MappingSchema,), attrs)
+
+
+def nested_preparer(data):
+    # The way preparers used to be chained, one closure per step.
+    steps = [
+        lambda data: data.strip(),
+        lambda data: ' '.join(data.split()),
+        lambda data: data.lower(),
+        lambda data: data or None,
+    ]
+    for step in steps:
+        if isinstance(data, basestring):
+            data = step(data)
+    return data
+
+
+def register_preparers(name, preparer):
+    @benchmark('preparers.%s' % name, number=200)
+    def setup():
+        data = dict(('field_%d' % i, '  Some   Text %d ' % i)
+                    for i in range(FIELDS))
+        schema = make_form_schema(preparer)()
+
+        def func():
+            schema.bind(data=data)
+            schema.is_valid()
+        return func
+
+
+register_preparers('closures', nested_preparer)
+register_preparers('fused', preparer_chain(
+    Strip(), NormalizeWhitespace(), Lower(), EmptyToNone()))
+
+
+class ImportRow(MappingSchema):
+    country = SchemaUnit(String(), validator=Choices(COUNTRIES))
+    status = SchemaUnit(String(), validator=Choices(['new', 'done']))
+    created = SchemaUnit(DateTime())
+    amount = SchemaUnit(Integer(), validator=Range(min=0))
+
+
+class ImportRows(SequenceSchema):
+    row = ImportRow()
+
+
+def import_payload():
+    return [{'country': COUNTRIES[i % 10],
+             'status': ('new', 'done')[i % 2],
+             'created': '2014-11-%02dT10:00:00+00:00' % (i % 28 + 1),
+             'amount': i % 100}
+            for i in range(ROWS * 10)]
+
+
+def register_import(name, memo):
+    @benchmark('validation.bulk.%s' % name, number=5)
+    def setup():
+        data = import_payload()
+        schema = ImportRows()
+
+        def func():
+            schema.bind(data=data)
+            schema.is_valid(memo=memo)
+        return func
+
+
+register_import('plain', None)
+register_import('memo', True)
+
+
+OVERSIZED_ROWS = ROWS * 500
+
+
+class Amounts(SequenceSchema):
+    amount = SchemaUnit(Integer())
+
+
+def register_oversized(name, schema):
+    @benchmark('validation.oversized.%s' % name, number=5)
+    def setup():
+        data = range(OVERSIZED_ROWS)
+
+        def func():
+            schema.bind(data=data)
+            assert not schema.is_valid()
+        return func
+
+
+# Length runs after every item is validated, max_items before.
+register_oversized('length', Amounts(validator=Length(max=ROWS)))
+register_oversized('max_items', Amounts(Sequence(max_items=ROWS)))
+register_oversized('max_nodes', Amounts(max_nodes=ROWS))
+
+
+class ImportDocument(MappingSchema):
+    title = SchemaUnit(String())
+    rows = ImportRows()
+
+
+def register_autosave(name, incremental, changed=False):
+    # Every save of the document changes one row.
+    @benchmark('validation.autosave.%s' % name, number=20)
+    def setup():
+        rows = import_payload()
+        schema = ImportDocument()
+        snapshot = ValidationSnapshot() if incremental else None
+        schema.bind(data={'title': 'Import', 'rows': list(rows)})
+        schema.is_valid(snapshot=snapshot)
+        saves = iter(xrange(10 ** 9))
+
+        def func():
+            save = next(saves)
+            num = save % len(rows)
+            rows[num] = dict(rows[num], amount=100 + save)
+            schema.bind(data={'title': 'Import', 'rows': list(rows)})
+            if changed:
+                schema.is_valid(snapshot=snapshot, changed=[
+                    ('rows', num)])
+            else:
+                schema.is_valid(snapshot=snapshot)
+        return func
+
+
+register_autosave('full', False)
+register_autosave('snapshot', True)
+register_autosave('snapshot.changed', True, changed=True)
+
+
+def register_synthetic(name, invalid_rate):
+    # Payloads of import documents as a load test would post them.
+    @benchmark('synthetic.%s' % name, number=5)
+    def setup():
+        generator = PayloadGenerator(ImportDocument, items=(ROWS, ROWS))
+        nums = iter(xrange(10 ** 9))
+
+        def func():
+            for payload in generator.payloads(
+                    10, invalid_rate, start=next(nums) * 10):
+                pass
+        return func
+
+
+register_synthetic('valid', 0.0)
+register_synthetic('invalid', 1.0)
@@ -0,0 +1,117 @@
+"""
+Runs registered benchmarks and compares results against a saved baseline.
+
+    python -m benchmarks [-o results.json] [-c baseline.json] [-k name]
+"""
+import argparse
+import json
+import platform
+import sys
+import timeit
+from collections import OrderedDict
+
+
+MODULES = [
+    'benchmarks.bench_schemas',
+    'benchmarks.bench_validation',
+    'benchmarks.bench_tabular',
+    'benchmarks.bench_import',
+]
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name, number=100):
+    """
+    Registers a benchmark. The decorated function prepares data and
+    returns a callable without arguments, which is timed.
+    """
+    def decorator(setup):
+        BENCHMARKS[name] = (setup, number)
+        return setup
+    return decorator
+
+
+def load():
+    for module in MODULES:
+        __import__(module)
+    return BENCHMARKS
+
+
+def run(name, setup, number, repeat=5, scale=1.0):
+    func = setup()
+    number = max(1, int(number * scale))
+    timings = [t / number for t in
+               timeit.Timer(func).repeat(repeat=repeat, number=number)]
+    return OrderedDict([
+        ('best', min(timings)),
+        ('mean', sum(timings) / len(timings)),
+        ('number', number),
+        ('repeat', repeat),
+    ])
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns a list of `(name, baseline, current, ratio)` for benchmarks
+    which got slower than `threshold` allows.
+    """
+    regressions = []
+    for name, result in results.iteritems():
+        if name not in baseline:
+            continue
+        old, new = baseline[name]['best'], result['best']
+        ratio = new / old if old else float('inf')
+        if ratio > 1 + threshold:
+            regressions.append((name, old, new, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('-k', '--filter', default='',
+                        help='Run only benchmarks containing this string.')
+    parser.add_argument('-o', '--output',
+                        help='Write results as JSON to this file.')
+    parser.add_argument('-c', '--compare',
+                        help='Compare against results saved with --output.')
+    parser.add_argument('-t', '--threshold', type=float, default=0.1,
+                        help='Allowed slowdown ratio, 0.1 means 10%%.')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('-s', '--scale', type=float, default=1.0,
+                        help='Multiplier for the number of iterations.')
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    results = OrderedDict()
+    for name, (setup, number) in load().iteritems():
+        if args.filter not in name:
+            continue
+        results[name] = result = run(
+            name, setup, number, repeat=args.repeat, scale=args.scale)
+        line = '%-40s %12.2f us' % (name, result['best'] * 1e6)
+        if name in baseline:
+            line += '  %+7.1f%%' % (
+                (result['best'] / baseline[name]['best'] - 1) * 100)
+        print line
+        sys.stdout.flush()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(OrderedDict([
+                ('python', platform.python_version()),
+                ('implementation', platform.python_implementation()),
+                ('platform', platform.platform()),
+                ('results', results),
+            ]), f, indent=2)
+
+    regressions = compare(results, baseline, args.threshold)
+    for name, old, new, ratio in regressions:
+        print 'REGRESSION %s: %.2f us -> %.2f us (x%.2f)' % (
+            name, old * 1e6, new * 1e6, ratio)
+
+    return 1 if regressions else 0
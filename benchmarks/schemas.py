@@ -0,0 +1,261 @@
+"""
+Representative schemas and payloads used by the benchmarks.
+"""
+import datetime
+
+from nativeview import (
+    SchemaUnit, MappingSchema, ObjectMappingSchema, SequenceSchema,
+    OneOfSchema, Ref, DictSchema,
+    Integer, Float, String, Boolean, DateTime, Date)
+from nativeview.validators import Range, Length
+
+
+class Record(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+# Flat
+
+class FlatSchema(MappingSchema):
+    id = SchemaUnit(Integer(), validator=Range(min=0))
+    name = SchemaUnit(String(), validator=Length(max=100))
+    email = SchemaUnit(String(), required=False)
+    score = SchemaUnit(Float())
+    active = SchemaUnit(Boolean())
+    created = SchemaUnit(DateTime())
+    birthday = SchemaUnit(Date(), required=False, allow_none=True)
+
+
+class FlatObjectSchema(ObjectMappingSchema):
+    id = SchemaUnit(Integer(), validator=Range(min=0))
+    name = SchemaUnit(String(), validator=Length(max=100))
+    email = SchemaUnit(String(), required=False)
+    score = SchemaUnit(Float())
+    active = SchemaUnit(Boolean())
+    created = SchemaUnit(DateTime())
+    birthday = SchemaUnit(Date(), required=False, allow_none=True)
+
+
+def flat_native(i=0):
+    return {
+        'id': i,
+        'name': 'Name %d' % i,
+        'email': 'user%d@example.com' % i,
+        'score': i * 0.5,
+        'active': bool(i % 2),
+        'created': datetime.datetime(2014, 11, 24, 21, 46, 10),
+        'birthday': datetime.date(1990, 1, 1),
+    }
+
+
+def flat_data(i=0):
+    return {
+        'id': i,
+        'name': 'Name %d' % i,
+        'email': 'user%d@example.com' % i,
+        'score': i * 0.5,
+        'active': bool(i % 2),
+        'created': '2014-11-24T21:46:10+00:00',
+        'birthday': '1990-01-01',
+    }
+
+
+def flat_invalid_data(i=0):
+    return {
+        'id': -1,
+        'name': 'x' * 101,
+        'score': 'broken',
+        'active': 'maybe',
+        'created': 'yesterday',
+    }
+
+
+# Wide
+
+WIDE_FIELDS = 100
+WIDE_TYPES = (Integer, Float, String, Boolean)
+
+
+def _wide_attrs():
+    attrs = dict(('field_%d' % i, SchemaUnit(WIDE_TYPES[i % 4]()))
+                 for i in range(WIDE_FIELDS))
+    # Keeps generated classes importable, e.g. for pickling.
+    attrs['__module__'] = __name__
+    return attrs
+
+
+WideSchema = type('WideSchema', (MappingSchema,), _wide_attrs())
+WideObjectSchema = type('WideObjectSchema', (ObjectMappingSchema,),
+                        _wide_attrs())
+
+
+def wide_data(i=0):
+    values = (i, i * 0.5, 'value %d' % i, True)
+    return dict(('field_%d' % n, values[n % 4]) for n in range(WIDE_FIELDS))
+
+
+def wide_invalid_data(i=0):
+    return dict(('field_%d' % n, 'broken') for n in range(WIDE_FIELDS)
+                if n % 4 != 2)
+
+
+# Deep
+
+DEPTH = 8
+
+
+def _make_deep_schema(depth):
+    attrs = {
+        '__module__': __name__,
+        'id': SchemaUnit(Integer()),
+        'title': SchemaUnit(String()),
+    }
+    if depth > 1:
+        attrs['child'] = _make_deep_schema(depth - 1)()
+    name = 'DeepSchema%d' % depth
+    cls = globals()[name] = type(name, (MappingSchema,), attrs)
+    return cls
+
+
+DeepSchema = _make_deep_schema(DEPTH)
+
+
+def deep_data(depth=DEPTH):
+    data = {'id': depth, 'title': 'Level %d' % depth}
+    if depth > 1:
+        data['child'] = deep_data(depth - 1)
+    return data
+
+
+def deep_invalid_data(depth=DEPTH):
+    data = {'id': 'broken'}
+    if depth > 1:
+        data['child'] = deep_invalid_data(depth - 1)
+    return data
+
+
+# Sequence heavy
+
+ITEMS = 1000
+
+
+class IntSequence(SequenceSchema):
+    item = SchemaUnit(Integer())
+
+
+class RowSequence(SequenceSchema):
+    row = FlatObjectSchema()
+
+
+class RoleRow(ObjectMappingSchema):
+    id = SchemaUnit(Integer(), validator=Range(min=0))
+    name = SchemaUnit(String(), validator=Length(max=100))
+    email = SchemaUnit(String(), required=False, visible=['admin'])
+    score = SchemaUnit(Float(), visible=['admin'])
+    active = SchemaUnit(Boolean())
+    created = SchemaUnit(DateTime())
+    birthday = SchemaUnit(
+        Date(), required=False, allow_none=True, visible=['admin'])
+
+
+class RoleRowSequence(SequenceSchema):
+    row = RoleRow()
+
+
+class Report(ObjectMappingSchema):
+    title = SchemaUnit(String())
+    values = IntSequence()
+    rows = RowSequence()
+
+
+def report_native(items=ITEMS):
+    return Record(
+        title='Report',
+        values=range(items),
+        rows=[Record(**flat_native(i)) for i in range(items // 10)])
+
+
+def report_data(items=ITEMS):
+    return {
+        'title': 'Report',
+        'values': range(items),
+        'rows': [flat_data(i) for i in range(items // 10)],
+    }
+
+
+def report_invalid_data(items=ITEMS):
+    return {
+        'values': ['broken'] * items,
+        'rows': [flat_invalid_data(i) for i in range(items // 10)],
+    }
+
+
+# Event stream, a sequence of tagged unions
+
+EVENT_TYPES = 40
+
+
+def _make_event_schema(i):
+    attrs = {
+        '__module__': __name__,
+        'type': SchemaUnit(String()),
+        'id': SchemaUnit(Integer()),
+        'value_%d' % i: SchemaUnit(String()),
+    }
+    name = 'Event%dSchema' % i
+    cls = globals()[name] = type(name, (MappingSchema,), attrs)
+    return cls('event_%d' % i)
+
+
+EventSchema = type('EventSchema', (OneOfSchema,), dict(
+    [('__module__', __name__)] +
+    [('event_%d' % i, _make_event_schema(i)) for i in range(EVENT_TYPES)]))
+
+
+class EventStream(SequenceSchema):
+    event = EventSchema()
+
+
+def events_data(items=ITEMS):
+    return [{'type': 'event_%d' % (i % EVENT_TYPES), 'id': i,
+             'value_%d' % (i % EVENT_TYPES): 'value %d' % i}
+            for i in range(items)]
+
+
+# Recursive tree
+
+TREE_DEPTH = 6
+TREE_FANOUT = 3
+
+
+class ChildrenSchema(SequenceSchema):
+    node = Ref('NodeSchema', max_depth=TREE_DEPTH + 1)
+
+
+class NodeSchema(MappingSchema):
+    id = SchemaUnit(Integer())
+    title = SchemaUnit(String())
+    children = ChildrenSchema()
+
+
+def tree_data(depth=TREE_DEPTH):
+    counter = iter(xrange(10 ** 6))
+
+    def node(depth):
+        return {
+            'id': next(counter), 'title': 'Node',
+            'children': [node(depth - 1) for i in range(TREE_FANOUT)]
+            if depth else []}
+    return node(depth)
+
+
+# Dynamic keys
+
+class StockSchema(DictSchema):
+    sku = SchemaUnit(String())
+    quantity = SchemaUnit(Integer(), validator=Range(min=0))
+
+
+def stock_data(items=ITEMS):
+    return dict(('sku-%d' % i, i) for i in range(items))
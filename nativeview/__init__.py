@@ -3,4 +3,6 @@ from schemas import *
 from units import *
 from exceptions import *
 from preparers import *
+from formats import *
+from cache import *
 from i18n import set_default_translator
\ No newline at end of file
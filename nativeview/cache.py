@@ -0,0 +1,278 @@
+import threading
+from collections import OrderedDict
+
+
+__all__ = [
+    'CacheBackend', 'LRUCache', 'DictCache', 'ValidationMemo',
+    'ValidationSnapshot']
+
+
+class CacheBackend(object):
+    """
+    Interface of serialization cache backends, see
+    `SyncedSchemaUnit.cache_backend`. Keys are tuples of the schema class,
+    the projection, the object identity and its version, values are
+    serialized results.
+    """
+    def get(self, key, default=None):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+
+class LRUCache(CacheBackend):
+    """
+    In-process cache which keeps `maxsize` most recently used results.
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DictCache(CacheBackend):
+    """
+    Unbounded cache over any dict-like object, e.g. a `shelve` for a file
+    cache if keys are made strings in `SyncedSchemaUnit.get_cache_key`.
+    """
+    def __init__(self, data=None):
+        self.data = {} if data is None else data
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+
+class _ActiveCalls(threading.local):
+    # Number of `is_valid` calls with a memo or a snapshot in progress,
+    # per thread, so calls of other threads do not affect each other.
+    count = 0
+
+
+class ValidationMemo(object):
+    """
+    Memo of validation results for a call of `SchemaUnit.is_valid`.
+    Children of mappings and sequences which are pure, see
+    `SchemaUnit.is_pure`, are validated once per distinct input value,
+    at most `maxsize` results are kept:
+
+        memo = ValidationMemo()
+        schema.is_valid(memo=memo)
+        memo.hit_rate, memo.stats()
+    """
+    # Calls with a memo in the current thread, units only look for a memo
+    # if there are any.
+    active = _ActiveCalls()
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.size = 0
+        # Unit -> `_MemoTable` or None if the unit is not pure.
+        self._tables = {}
+
+    def validate(self, unit, data, key=None):
+        """
+        Same as `unit._run_validation(data)`. `key` is the name or the
+        position of the value in its parent.
+        """
+        try:
+            table = self._tables[unit]
+        except KeyError:
+            table = self._tables[unit] = (
+                _MemoTable() if unit.is_pure() else None)
+        if table is None:
+            return unit._run_validation(data)
+
+        # Equal values of other types, e.g. 1 and True, could give other
+        # results.
+        key = (type(data), data)
+        try:
+            result = table.results[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # Unhashable.
+            return unit._run_validation(data)
+        else:
+            table.hits += 1
+            return result
+
+        table.misses += 1
+        result = unit._run_validation(data)
+        if self.size < self.maxsize:
+            table.results[key] = result
+            self.size += 1
+        return result
+
+    @property
+    def hits(self):
+        return sum(t.hits for t in self._tables.itervalues() if t)
+
+    @property
+    def misses(self):
+        return sum(t.misses for t in self._tables.itervalues() if t)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def stats(self):
+        """
+        Returns a mapping of dotted paths of pure units to `(hits, misses)`,
+        positions in sequences are `*`.
+        """
+        stats = {}
+        for unit, table in self._tables.iteritems():
+            if table is not None:
+                path = '.'.join(unit.index.path(unit))
+                hits, misses = stats.get(path, (0, 0))
+                stats[path] = (hits + table.hits, misses + table.misses)
+        return stats
+
+
+class _MemoTable(object):
+    __slots__ = ('results', 'hits', 'misses')
+
+    def __init__(self):
+        self.results = {}
+        self.hits = 0
+        self.misses = 0
+
+
+class ValidationSnapshot(object):
+    """
+    Results of validation of a document by path, which the next call of
+    `SchemaUnit.is_valid` reuses for parts of the next version of the
+    document that are equal to previous ones. Only changed mappings and
+    sequences and their parents are validated again, with validators and
+    constraints of the parents:
+
+        snapshot = ValidationSnapshot()
+        schema.bind(data=draft)
+        schema.is_valid(snapshot=snapshot)
+        ...
+        schema.bind(data=next_draft)
+        schema.is_valid(snapshot=snapshot, changed=['address.city'])
+
+    Values are compared with `==`, unless paths of changed values are
+    given, then other values are reused without comparing. Documents
+    changed in place require the paths. Results are reused as is, so
+    validated data must not be modified, and the schema and its context
+    must be the same between calls.
+    """
+    def __init__(self):
+        self._root = None
+        self._stack = []
+        self._memo = None
+        self._changed = None
+        self._prefixes = None
+        # Numbers of reused and validated mappings and sequences in the
+        # last call.
+        self.reused = 0
+        self.validated = 0
+
+    def start(self, memo=None, changed=None):
+        """
+        Prepares a call, `memo` is a `ValidationMemo` for values which are
+        validated, `changed` are dotted paths or tuples.
+        """
+        self._memo = memo
+        self.reused = self.validated = 0
+        if changed is None:
+            self._changed = self._prefixes = None
+            return
+        self._changed = set()
+        self._prefixes = set()
+        for path in changed:
+            if isinstance(path, basestring):
+                path = path.split('.')
+            path = tuple(unicode(segment) for segment in path)
+            self._changed.add(path)
+            for size in xrange(len(path) + 1):
+                self._prefixes.add(path[:size])
+
+    def validate(self, unit, data, key=None):
+        """
+        Same as `unit._run_validation(data)`, the result is reused if the
+        value at the same path has not changed.
+        """
+        stack = self._stack
+        if not unit.children and not unit.type.delegates:
+            # Leaves are validated as fast as they are compared.
+            if self._memo is not None:
+                return self._memo.validate(unit, data, key)
+            return unit._run_validation(data)
+
+        if stack:
+            old_parent, parent, path, forced = stack[-1]
+            old = None
+            if old_parent is not None:
+                old = old_parent.children.get(key)
+            path = path + (unicode(key),)
+        else:
+            old, parent, path, forced = self._root, None, (), False
+
+        changed = self._changed
+        if changed is not None:
+            forced = forced or path in changed
+        if old is not None and old.unit is unit and (
+                (not forced and path not in self._prefixes)
+                if changed is not None else
+                (old.data is data or old.data == data)):
+            self.reused += 1
+            node = old
+        else:
+            self.validated += 1
+            node = _SnapshotNode(unit, data)
+            stack.append((old, node, path, forced))
+            try:
+                node.result = unit._run_validation(data)
+            finally:
+                stack.pop()
+
+        if parent is None:
+            self._root = node
+        else:
+            parent.children[key] = node
+        return node.result
+
+
+class _SnapshotNode(object):
+    __slots__ = ('unit', 'data', 'result', 'children')
+
+    def __init__(self, unit, data):
+        self.unit = unit
+        self.data = data
+        self.result = None
+        self.children = {}
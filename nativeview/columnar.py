@@ -0,0 +1,234 @@
+"""
+Columnar serialization of sequences of flat mappings.
+
+Every unit of the item schema becomes a column with a typed buffer of
+values and a mask of nulls, which could be consumed without building a
+mapping per item, e.g. with `numpy.frombuffer`:
+
+    columns = ReportRowsSchema().serialize_columns(rows)
+    scores = numpy.frombuffer(columns['score'].values, 'f8')
+
+Buffers are `array.array` objects:
+
+    Integer         'l', C longs, 64-bit ones only
+    Float           'd'
+    Boolean         'b'
+    DateTime        'l', microseconds since the epoch, naive values are UTC
+    Date            'l', days since the epoch
+
+Where longs are narrower, e.g. on Windows, columns of 'l' are lists, as
+`array` has no typecode for 64-bit integers in Python 2. Values of other
+types are serialized into lists. Masks are bytearrays, 1
+marks a null, values of nulls are zeros.
+
+Given a path, columns are also written to a file and mapped into memory,
+typed buffers are then `buffer` objects over the mapping. The file could
+be opened again with `open_columns`, e.g. by another process.
+"""
+import json
+import mmap
+import struct
+from array import array
+from calendar import timegm
+from collections import OrderedDict
+from datetime import datetime, date
+
+from formats import DICT
+from unit_types import (
+    Integer, Float, Boolean, DateTime, Date, Mapping, ObjectMapping)
+
+
+__all__ = ['Column', 'serialize_columns', 'open_columns']
+
+
+FILE_VERSION = 1
+# Buffers in files are aligned, so they could be viewed as arrays.
+ALIGNMENT = 8
+
+EPOCH_DATE = date(1970, 1, 1)
+
+# Typecode of 64-bit integers, None if they are kept in lists.
+INT64 = 'l' if array('l').itemsize == 8 else None
+
+
+class Column(object):
+    def __init__(self, name, kind, typecode, values, nulls):
+        self.name = name
+        # One of `KINDS` or 'object' for lists.
+        self.kind = kind
+        # Typecode of `array` or None for lists.
+        self.typecode = typecode
+        self.values = values
+        self.nulls = nulls
+
+    def __len__(self):
+        return len(self.nulls)
+
+    def to_list(self):
+        """
+        Returns values as a list with None for nulls.
+        """
+        values = self.values
+        if not isinstance(values, (array, list)):
+            values = array(self.typecode, str(values))
+        return [None if null else value
+                for value, null in zip(values, bytearray(self.nulls))]
+
+    def __repr__(self):
+        return '<Column %s %s[%d]>' % (self.name, self.kind, len(self))
+
+
+def _epoch_microseconds(value):
+    if not isinstance(value, datetime):
+        raise ValueError('Not a datetime: %r' % (value,))
+    seconds = timegm(value.utctimetuple())
+    return seconds * 1000000 + value.microsecond
+
+
+def _epoch_days(value):
+    if isinstance(value, datetime):
+        value = value.date()
+    elif not isinstance(value, date):
+        raise ValueError('Not a date: %r' % (value,))
+    return (value - EPOCH_DATE).days
+
+
+# Kinds by unit type, subclasses share the kind of their base. Converters
+# of raw values are used instead of `serialize` if given.
+KINDS = [
+    (Boolean, 'bool', 'b', None),
+    (Integer, 'int', INT64, None),
+    (Float, 'float', 'd', None),
+    (DateTime, 'datetime', INT64, _epoch_microseconds),
+    (Date, 'date', INT64, _epoch_days),
+]
+
+
+def _kind(type_):
+    for cls, kind, typecode, convert in KINDS:
+        if isinstance(type_, cls):
+            return kind, typecode, convert
+    return 'object', None, None
+
+
+def _none_getter(name, default=None):
+    return default
+
+
+def serialize_columns(schema, items, path=None, trusted=None):
+    """
+    Returns an ordered mapping of column names to `Column` for a sequence
+    schema unit of flat mappings. Every item is a row, None items are rows
+    of nulls.
+    """
+    item_unit = schema.children.values()[0]
+    item_type = item_unit.type
+    if not isinstance(item_type, (Mapping, ObjectMapping)):
+        raise TypeError('Columns require a sequence of mappings')
+    if trusted is None:
+        trusted = schema.trusted or item_unit.trusted
+
+    getter = item_type._getter
+    getters = [_none_getter if item is None else getter(item)
+               for item in items]
+
+    columns = OrderedDict()
+    for name, attr, unit, key, native in item_type._visible_plan()[0]:
+        if unit.children:
+            raise TypeError('Columns require flat mappings: %s has %s' % (
+                name, ', '.join(unit.children)))
+        raw = [get(attr, None) for get in getters]
+        if unit._overrides_serialize or unit.type._overrides_serialize:
+            # Only `serialize` gives values of such units.
+            kind, typecode, convert = 'object', None, None
+        else:
+            kind, typecode, convert = _kind(unit.type)
+
+        if convert is not None:
+            raw = [None if value is None else convert(value)
+                   for value in raw]
+        elif not (trusted and native is not None):
+            serialize = unit._serialize
+            raw = [None if value is None else
+                   serialize(value, DICT, trusted) for value in raw]
+        nulls = bytearray(value is None for value in raw)
+
+        if typecode is None:
+            values = raw
+        else:
+            values = array(typecode, [0 if value is None else value
+                                      for value in raw])
+        columns[name] = Column(name, kind, typecode, values, nulls)
+
+    if path is not None:
+        _write(path, columns)
+        return open_columns(path)
+    return columns
+
+
+def _padding(size):
+    return -size % ALIGNMENT
+
+
+def _write(path, columns):
+    rows = len(columns.itervalues().next()) if columns else 0
+    header = {'version': FILE_VERSION, 'rows': rows, 'columns': []}
+    chunks = []
+    offset = 0
+    for column in columns.itervalues():
+        info = {'name': column.name, 'kind': column.kind,
+                'typecode': column.typecode}
+        if column.typecode is None:
+            info['values'] = column.values
+        else:
+            data = column.values.tostring()
+            info['offset'] = offset
+            info['size'] = len(data)
+            chunks.append(data + '\0' * _padding(len(data)))
+            offset += len(data) + _padding(len(data))
+        info['nulls'] = offset
+        chunks.append(str(column.nulls) + '\0' * _padding(rows))
+        offset += rows + _padding(rows)
+        header['columns'].append(info)
+
+    header = json.dumps(header)
+    header += ' ' * _padding(8 + len(header))
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for chunk in chunks:
+            f.write(chunk)
+
+
+def open_columns(path):
+    """
+    Maps a file written by `serialize_columns` into memory and returns its
+    columns.
+    """
+    with open(path, 'rb') as f:
+        size, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(size))
+        if header['version'] != FILE_VERSION:
+            raise ValueError(
+                'Unsupported columns file version: %r' % (header['version'],))
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    start = 8 + size
+    rows = header['rows']
+    columns = OrderedDict()
+    for info in header['columns']:
+        name = info['name']
+        typecode = info['typecode'] and str(info['typecode'])
+        if typecode is None:
+            values = info['values']
+        elif typecode == 'l' and INT64 is None:
+            # Written where longs are 64-bit.
+            typecode = None
+            values = list(struct.unpack_from(
+                '=%dq' % (info['size'] // 8), data,
+                start + info['offset']))
+        else:
+            values = buffer(data, start + info['offset'], info['size'])
+        nulls = buffer(data, start + info['nulls'], rows)
+        columns[name] = Column(name, info['kind'], typecode, values, nulls)
+    return columns
@@ -0,0 +1,166 @@
+"""
+ETags of serialized values.
+
+An ETag is a hex digest of the JSON text which `serialize` gives in `JSON`
+format with the built-in encoder, so equal output has equal ETags in any
+process. `etag` computes it without building the whole text: sequences of
+mappings or sequences are walked and their items are fed to the hash one
+at a time, so memory does not grow with the number of items. ETags of
+cached schemas are cached as well, see `SyncedSchemaUnit.etag`:
+
+    etag = schema.etag(article)
+    if etag == request.if_none_match:
+        return NotModified()
+    body, etag = schema.serialize_with_etag(article)
+"""
+import hashlib
+
+from formats import JSON, encode_json_value
+from units import _SchemaUnit
+from unit_types import (
+    MappingSerializeMixin, Sequence, allow_to_serialize_json)
+
+
+__all__ = ['etag', 'digest']
+
+
+DEFAULT_ALGORITHM = 'sha1'
+
+MAPPING = 'mapping'
+SEQUENCE = 'sequence'
+
+
+def digest(text, algorithm=DEFAULT_ALGORITHM):
+    """
+    Returns the ETag of a JSON text.
+    """
+    if text.__class__ is unicode:
+        text = text.encode('utf-8')
+    return hashlib.new(algorithm, text).hexdigest()
+
+
+def etag(unit, value, trusted=False, algorithm=DEFAULT_ALGORITHM):
+    """
+    Returns the ETag of `unit._serialize(value, JSON, trusted)`.
+    """
+    hasher = hashlib.new(algorithm)
+    _feed(unit, value, trusted, hasher.update)
+    return hasher.hexdigest()
+
+
+def _feed(unit, value, trusted, update):
+    # Feeds the JSON text of the value, values of streamed units piece by
+    # piece and others at once.
+    trusted = trusted or unit.trusted
+    if value is None or not _streamed(unit):
+        update(_utf8(unit._serialize(value, JSON, trusted)))
+        return
+
+    if unit.type.positional:
+        child = unit.children.values()[0]
+        separator = '['
+        for subvalue in value:
+            if subvalue is not None and not child.omit_if_empty:
+                update(separator)
+                _feed(child, subvalue, trusted, update)
+            else:
+                encoded = child._serialize(subvalue, JSON, trusted)
+                if not allow_to_serialize_json(child, encoded):
+                    continue
+                update(separator)
+                update(_utf8(encoded))
+            separator = ','
+        update('[]' if separator == '[' else ']')
+        return
+
+    get = unit.type._getter(value)
+    separator = '{'
+    parts = []
+    for name, attr, child, key, native in unit.type._visible_plan()[0]:
+        subvalue = get(attr, None)
+        if (subvalue is not None and not child.omit_if_empty and
+                _streamed(child)):
+            # Fields before the child go at once.
+            parts.append(key)
+            update(separator + ','.join(parts))
+            separator = ','
+            parts = []
+            _feed(child, subvalue, trusted, update)
+            continue
+        if trusted and native is not None:
+            assert subvalue is None or isinstance(subvalue, native), \
+                'Untrusted value %r' % (subvalue,)
+            encoded = encode_json_value(subvalue)
+        else:
+            encoded = child._serialize(subvalue, JSON, trusted)
+        if allow_to_serialize_json(child, encoded):
+            parts.append(key + _utf8(encoded))
+    if parts:
+        update(separator + ','.join(parts) + '}')
+    else:
+        update('{}' if separator == '{' else '}')
+
+
+def _utf8(text):
+    if text.__class__ is unicode:
+        return text.encode('utf-8')
+    return text
+
+
+def _streamed(unit):
+    """
+    Whether values of the unit are fed piece by piece, that is it is a
+    sequence of mappings or sequences, or a mapping with such units
+    inside, which serialize as the base classes do and are not cached.
+    Cached as `_etag_stream` of the unit.
+    """
+    try:
+        return unit._etag_stream
+    except AttributeError:
+        pass
+
+    kind = _walkable(unit)
+    if kind is SEQUENCE:
+        child = unit.children.values()[0]
+        streamed = bool(child.children) and _walkable(child) is not None
+    elif kind is MAPPING:
+        streamed = any(_streamed(child)
+                       for child in unit.children.itervalues())
+    else:
+        streamed = False
+    unit._etag_stream = streamed
+    return streamed
+
+
+def _walkable(unit):
+    """
+    Returns `MAPPING` or `SEQUENCE` if the unit serializes as the base
+    classes do and is not cached, so its text could be fed piece by piece,
+    None if its text should be fed at once.
+    """
+    if (getattr(unit, 'cache_backend', None) is not None or
+            unit._overrides_serialize or unit.type._overrides_serialize):
+        return None
+    key = (unit.__class__, unit.type.__class__)
+    try:
+        return _kinds[key]
+    except KeyError:
+        pass
+
+    # Synced schemas serialize as the base class without a cache.
+    from schemas import SyncedSchemaUnit
+
+    cls, type_cls = key
+    kind = None
+    if cls._serialize.im_func in (_SchemaUnit._serialize.im_func,
+                                  SyncedSchemaUnit._serialize.im_func):
+        serialize_as = type_cls.serialize_as.im_func
+        if serialize_as is MappingSerializeMixin.serialize_as.im_func:
+            kind = MAPPING
+        elif serialize_as is Sequence.serialize_as.im_func:
+            kind = SEQUENCE
+    _kinds[key] = kind
+    return kind
+
+
+_kinds = {}
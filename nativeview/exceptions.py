@@ -1,22 +1,28 @@
-from i18n import default_translator
+from i18n import get_default_translator
 
 
 __all__ = ['ValidationError']
 
 
-def translate(detail):
+def translate(detail, translator=None):
+    if translator is None:
+        translator = get_default_translator()
+
     if isinstance(detail, list):
-        new_detail = []
-        for subdetail in detail:
-            new_detail.append(translate(subdetail))
-        return new_detail
+        return [translate(subdetail, translator)
+                if isinstance(subdetail, (list, dict))
+                else translator(subdetail)
+                for subdetail in detail]
     elif isinstance(detail, dict):
         new_detail = {}
         for key, subdetail in detail.iteritems():
-            new_detail[key] = translate(subdetail)
+            if isinstance(subdetail, (list, dict)):
+                new_detail[key] = translate(subdetail, translator)
+            else:
+                new_detail[key] = translator(subdetail)
         return new_detail
     else:
-        return default_translator(detail)
+        return translator(detail)
 
 
 class ValidationError(Exception):
@@ -35,3 +41,21 @@ class ValidationError(Exception):
 
     def __str__(self):
         return self.detail
+
+
+class Invalid(object):
+    """
+    Non-raising counterpart of `ValidationError` which units and unit types
+    return to each other while validating. The detail is not translated,
+    that happens once for the whole tree.
+    """
+    __slots__ = ('_detail', 'unit')
+
+    def __init__(self, detail, unit=None):
+        if not isinstance(detail, (dict, list)):
+            detail = [detail]
+        self._detail = detail
+        self.unit = unit
+
+    def error(self):
+        return ValidationError(self._detail, self.unit)
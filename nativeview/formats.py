@@ -0,0 +1,80 @@
+import json
+from json.encoder import encode_basestring_ascii
+
+
+__all__ = ['ORDERED', 'DICT', 'TUPLE', 'JSON', 'set_json_encoder']
+
+
+# Output formats of `serialize`.
+ORDERED = 'ordered'  # OrderedDict for mappings, the default.
+DICT = 'dict'        # Plain dict for mappings.
+TUPLE = 'tuple'      # Tuple of values in field order for mappings.
+JSON = 'json'        # JSON text.
+
+FORMATS = (ORDERED, DICT, TUPLE, JSON)
+
+
+INFINITY = float('inf')
+
+
+def encode_json_key(name):
+    return encode_basestring_ascii(name) + ':'
+
+
+def encode_json_value(value):
+    """
+    Encodes a serialized scalar, anything else goes to the json module.
+    """
+    cls = value.__class__
+    if cls is str or cls is unicode:
+        return encode_basestring_ascii(value)
+    if value is None:
+        return 'null'
+    if cls is bool:
+        return 'true' if value else 'false'
+    if cls is int or cls is long:
+        return str(value)
+    if cls is float and value == value and -INFINITY < value < INFINITY:
+        return repr(value)
+    return json.dumps(value)
+
+
+def convert_serialized(value, format, keyed=False):
+    """
+    Converts a value serialized in `ORDERED` format to another format, for
+    units which override `serialize`. Mappings become plain dicts for
+    `DICT` and tuples of values for `TUPLE`, or tuples of pairs if `keyed`.
+    """
+    if format == ORDERED:
+        return value
+    if format == JSON:
+        return json.dumps(value, separators=(',', ':'))
+    if isinstance(value, dict):
+        if format == DICT:
+            return dict((key, convert_serialized(subvalue, format))
+                        for key, subvalue in value.iteritems())
+        if keyed:
+            return tuple((key, convert_serialized(subvalue, format))
+                         for key, subvalue in value.iteritems())
+        return tuple(convert_serialized(subvalue, format)
+                     for subvalue in value.itervalues())
+    if isinstance(value, list):
+        return [convert_serialized(subvalue, format) for subvalue in value]
+    return value
+
+
+def get_json_encoder():
+    return _json_encoder
+
+
+def set_json_encoder(encoder):
+    """
+    Sets an encoder used for `JSON` format, e.g. `ujson.dumps`. It gets
+    plain dicts and lists. By default an order preserving encoder of this
+    module is used.
+    """
+    global _json_encoder
+    _json_encoder = encoder
+
+
+_json_encoder = None
@@ -4,6 +4,82 @@ import translationstring
 TranslationStringFactory = translationstring.TranslationStringFactory('nativeview')
 
 
+class ErrorMessages(dict):
+    """
+    Read-only table of error messages. Tables are shared by all instances
+    of a class, so copies return the same table. Messages of an instance
+    are replaced by its `error_messages` argument, which gives a new table.
+    """
+    def _read_only(self, *args, **kwargs):
+        raise TypeError(
+            'Tables of error messages are shared, pass error_messages '
+            'to replace messages.')
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return ErrorMessages, (dict(self),)
+
+
+def get_error_messages(cls, overrides=None):
+    """
+    Returns `default_error_messages` of cls merged with its bases. The
+    table is built once per class, `overrides` give a new table.
+    """
+    try:
+        messages = cls.__dict__['_error_messages']
+    except KeyError:
+        messages = {}
+        for c in reversed(cls.__mro__):
+            messages.update(getattr(c, 'default_error_messages', {}))
+        messages = cls._error_messages = ErrorMessages(messages)
+
+    if overrides:
+        messages = dict(messages)
+        messages.update(overrides)
+        messages = ErrorMessages(messages)
+    return messages
+
+
+class CachedTranslator(object):
+    """
+    Caches translated and interpolated messages of a translator, which is
+    usually bound to a locale, so there is a cache per locale:
+
+        set_default_translator(CachedTranslator(translator))
+    """
+    def __init__(self, translator, maxsize=1024):
+        self.translator = translator
+        self.maxsize = maxsize
+        self._cache = {}
+
+    def __call__(self, term):
+        mapping = getattr(term, 'mapping', None)
+        key = (term.__class__, term, getattr(term, 'domain', None),
+               getattr(term, 'default', None),
+               tuple(sorted(mapping.items())) if mapping else None)
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # Unhashable mapping values.
+            return self.translator(term)
+
+        result = self.translator(term)
+        if len(self._cache) >= self.maxsize:
+            self._cache.clear()
+        self._cache[key] = result
+        return result
+
+
 def simple_translator(term):
     if hasattr(term, 'interpolate'):
         return term.interpolate()
@@ -14,9 +90,13 @@ def default_translator(term):
     return _default_translator(term)
 
 
+def get_default_translator():
+    return _default_translator
+
+
 def set_default_translator(new_translator):
     global _default_translator
     _default_translator = new_translator
 
 
-_default_translator = simple_translator
+_default_translator = CachedTranslator(simple_translator)
@@ -0,0 +1,126 @@
+"""
+Intermediate representation of schema trees.
+
+The representation holds classes, names, flags, validators and preparers
+of units and their types, it is built once per schema class and could be
+pickled, e.g. to ship schemas to worker processes:
+
+    data = ir.dumps(UserSchema)
+    schema = ir.loads(data)
+
+Loading does not run `SchemaMeta`, `__init__` of units and types or
+copying of class level units, so it is cheaper than instantiating the
+schema class. Classes, validators and preparers are pickled by reference,
+so they must be importable, e.g. no lambdas or classes defined in
+functions.
+"""
+import cPickle as pickle
+from collections import OrderedDict
+
+from units import empty, _SchemaUnit
+from i18n import get_error_messages
+from unit_types import prepare_class
+
+
+__all__ = ['IR_VERSION', 'to_ir', 'from_ir', 'dumps', 'loads']
+
+
+IR_VERSION = 1
+
+# Attributes bound to a particular call, they are reset on load.
+UNIT_RUNTIME_ATTRS = frozenset([
+    'children', 'parent', 'type', 'source_object', '_initial_data',
+    '_context', '_index', '_errors', '_validated_data', '_changes',
+    '_resolved', '_proxied', '_active', '_json_walk', '_memo',
+    '_etag_stream'])
+TYPE_RUNTIME_ATTRS = frozenset([
+    'unit', '_plan_cache', '_variants_cache', '_by_class_cache',
+    '_static_plan', '_role_plans'])
+
+_cache = {}
+
+
+def to_ir(schema):
+    """
+    Returns the representation of a schema class or unit. Representations
+    of classes are cached.
+    """
+    if isinstance(schema, _SchemaUnit):
+        return (IR_VERSION, _unit_node(schema))
+
+    try:
+        return _cache[schema]
+    except KeyError:
+        ir = _cache[schema] = (IR_VERSION, _unit_node(schema()))
+        return ir
+
+
+def from_ir(ir):
+    """
+    Returns a new schema unit built from the representation.
+    """
+    version, node = ir
+    if version != IR_VERSION:
+        raise ValueError(
+            'Unsupported schema representation version: %r' % (version,))
+    return _build_unit(node, None)
+
+
+def dumps(schema, protocol=pickle.HIGHEST_PROTOCOL):
+    return pickle.dumps(to_ir(schema), protocol)
+
+
+def loads(data):
+    return from_ir(pickle.loads(data))
+
+
+def _state(obj, runtime_attrs):
+    state = {}
+    for name, value in obj.__dict__.iteritems():
+        if name in runtime_attrs:
+            continue
+        if name == 'error_messages' and \
+                value is obj.__class__.__dict__.get('_error_messages'):
+            # Shared table of the class, see `get_error_messages`.
+            continue
+        state[name] = value
+    return state
+
+
+def _unit_node(unit):
+    type_ = unit.type
+    children = tuple(
+        (name, _unit_node(child)) for name, child in unit.children.iteritems())
+    return (
+        unit.__class__, _state(unit, UNIT_RUNTIME_ATTRS),
+        type_.__class__, _state(type_, TYPE_RUNTIME_ATTRS),
+        children)
+
+
+def _build(cls, state):
+    # Bypasses `_SchemaUnit.__new__`, which copies class level units.
+    obj = object.__new__(cls)
+    obj.__dict__.update(state)
+    if 'error_messages' not in state:
+        obj.error_messages = get_error_messages(cls)
+    return obj
+
+
+def _build_unit(node, parent):
+    unit_cls, unit_state, type_cls, type_state, children = node
+
+    unit = _build(unit_cls, unit_state)
+    unit.parent = parent
+    unit.source_object = None
+    unit._initial_data = empty
+    unit._context = {}
+
+    if '_native' not in type_cls.__dict__:
+        prepare_class(type_cls)
+    type_ = _build(type_cls, type_state)
+    type_.unit = unit
+    unit.type = type_
+
+    unit.children = OrderedDict(
+        (name, _build_unit(child, unit)) for name, child in children)
+    return unit
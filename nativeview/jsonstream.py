@@ -0,0 +1,414 @@
+"""
+Validation of JSON documents without decoding them into a tree first.
+
+The document is parsed along with the schema. Objects and arrays of
+mapping and sequence units which have mappings or sequences inside are
+walked by the validator, which only builds validated values. Other values,
+e.g. flat objects, are decoded at once by the C scanner of the `json`
+module and validated by their units as usual:
+
+    schema = UserSchema()
+    if not schema.validate_json(request.body):
+        return schema.errors, schema.error_positions
+
+Besides errors, `error_positions` maps paths of invalid values to their
+`(line, column)` in the document. Positions are only looked up for
+invalid values.
+"""
+import json
+import re
+from collections import OrderedDict
+from json.decoder import WHITESPACE, scanstring
+
+from exceptions import ValidationError, Invalid
+from i18n import TranslationStringFactory as _
+from units import empty, _SchemaUnit
+from unit_types import MappingDeserializeMixin, Sequence, merge_errors
+
+
+__all__ = ['JSONValidator']
+
+
+# Messages of the scanner end with the position of the error.
+ERROR_POSITION_RE = re.compile(r'\(char (\d+)')
+
+# Empty string is in it as well, the pattern then matches nothing.
+WHITESPACE_CHARS = ' \t\n\r'
+
+MAPPING = 'mapping'
+SEQUENCE = 'sequence'
+
+
+class JSONSyntaxError(Exception):
+    def __init__(self, pos):
+        self.pos = pos
+
+
+class JSONValidator(object):
+    invalid_json_message = _('Invalid JSON at line ${line} column ${column}.')
+    unknown_message = _('Unknown field.')
+    too_long_message = _('Value is longer than ${max} characters.')
+
+    _scan_once = json.JSONDecoder().scan_once
+    _match_whitespace = WHITESPACE.match
+
+    def __init__(self, reject_unknown=False, max_value_size=None):
+        """
+        Args:
+            reject_unknown - Report keys of objects which mapping units
+                have no units for, they are ignored by default.
+            max_value_size - Maximal length of strings in the document,
+                values with longer ones are reported without validating.
+        """
+        self.reject_unknown = reject_unknown
+        self.max_value_size = max_value_size
+
+    def validate(self, unit, source):
+        """
+        Returns a validated value, `empty` or `Invalid` and a mapping of
+        paths of errors to `(line, column)`. `source` is a string or a
+        file-like object.
+        """
+        if hasattr(source, 'read'):
+            source = source.read()
+        self.text = source
+        self.positions = OrderedDict()
+        try:
+            value, pos = self._value(unit, self._skip(0), ())
+            pos = self._skip(pos)
+            if pos != len(source):
+                raise JSONSyntaxError(pos)
+        except JSONSyntaxError as e:
+            line, column = self.location(e.pos)
+            value = Invalid(self.invalid_json_message % {
+                'line': line, 'column': column}, unit)
+            self.positions = OrderedDict([((), e.pos)])
+        positions = OrderedDict(
+            (path, self.location(pos))
+            for path, pos in self.positions.iteritems())
+        self.text = self.positions = None
+        return value, positions
+
+    def location(self, pos):
+        line = self.text.count('\n', 0, pos) + 1
+        return line, pos - self.text.rfind('\n', 0, pos)
+
+    def _skip(self, pos):
+        # Skips whitespace.
+        text = self.text
+        if pos < len(text) and text[pos] in ' \t\n\r':
+            pos = self._match_whitespace(text, pos).end()
+        return pos
+
+    def _scan(self, pos):
+        # Decodes a whole value at `pos`.
+        try:
+            return self._scan_once(self.text, pos)
+        except StopIteration:
+            raise JSONSyntaxError(pos)
+        except ValueError as e:
+            match = ERROR_POSITION_RE.search(str(e))
+            raise JSONSyntaxError(int(match.group(1)) if match else pos)
+
+    def _value(self, unit, pos, path):
+        # Same as `_run_validation` of the unit for the value at `pos`.
+        try:
+            kind = unit._json_walk
+        except AttributeError:
+            kind = unit._json_walk = _walk(unit)
+        char = self.text[pos:pos + 1]
+        if kind is MAPPING and char == '{':
+            value, end = self._mapping(unit, pos + 1, path)
+        elif kind is SEQUENCE and char == '[':
+            value, end = self._sequence(unit, pos + 1, path)
+        else:
+            data, end = self._scan(pos)
+            value = self._validate(unit, data, end - pos)
+            if value is not empty and value.__class__ is Invalid:
+                self._locate(pos, value._detail, path)
+            return value, end
+
+        if value.__class__ is Invalid or not unit.validator:
+            return value, end
+        try:
+            unit.validator(unit, value)
+        except ValidationError as e:
+            self.positions[path] = pos
+            return Invalid(e._detail, unit), end
+        return value, end
+
+    def _validate(self, unit, data, size):
+        max_size = self.max_value_size
+        if max_size is not None and size > max_size:
+            # Only values which text is long could have long strings.
+            detail = self._find_long(data)
+            if detail is not None:
+                return Invalid(detail, unit)
+
+        kind = _streamable(unit) if unit.children else None
+        if (kind is SEQUENCE and data.__class__ is not list and
+                data is not None):
+            # Sequences take any iterable, keys of objects as well.
+            detail = unit.type.error_messages['iterable'] % {'value': data}
+            return Invalid(detail, unit)
+
+        value = unit._run_validation(data)
+        if (self.reject_unknown and data.__class__ is dict and
+                kind is MAPPING):
+            unknown = [key for key in data if key not in unit.children]
+            if unknown:
+                errors = OrderedDict()
+                if value is not empty and value.__class__ is Invalid:
+                    if not isinstance(value._detail, dict):
+                        return value
+                    errors.update(value._detail)
+                for key in unknown:
+                    errors[key] = [self.unknown_message]
+                value = Invalid(errors, unit)
+        return value
+
+    def _find_long(self, data):
+        if isinstance(data, basestring):
+            if len(data) > self.max_value_size:
+                return [self.too_long_message % {'max': self.max_value_size}]
+            return None
+        if isinstance(data, dict):
+            items = data.iteritems()
+        elif isinstance(data, list):
+            items = enumerate(data)
+        else:
+            return None
+        errors = OrderedDict()
+        for key, value in items:
+            detail = self._find_long(value)
+            if detail is not None:
+                errors[key] = detail
+        return errors or None
+
+    def _locate(self, pos, detail, path):
+        # Finds positions of errors of the value at `pos`.
+        if (not isinstance(detail, dict) or
+                self.text[pos:pos + 1] not in ('{', '[')):
+            self.positions[path] = pos
+            return
+
+        children = {}
+        for key, end in self._items(pos):
+            children[key] = end
+        for key, subdetail in detail.iteritems():
+            if key in children:
+                self._locate(children[key], subdetail, path + (key,))
+            else:
+                # Missing values are reported at the end of the object.
+                self.positions[path + (key,)] = end
+
+    def _items(self, pos):
+        # Yields keys or indexes and positions of values of an object or
+        # an array at `pos`, and None with the position of its end at last.
+        text = self.text
+        is_object = text[pos] == '{'
+        pos = self._skip(pos + 1)
+        num = 0
+        while text[pos] not in '}]':
+            if is_object:
+                key, pos = scanstring(text, pos + 1)
+                pos = self._skip(self._skip(pos) + 1)
+            else:
+                key = num
+                num += 1
+            yield key, pos
+            pos = self._skip(self._scan(pos)[1])
+            if text[pos] == ',':
+                pos = self._skip(pos + 1)
+        yield None, pos
+
+    def _skip_items(self, pos, end):
+        # Returns the position after the end of an array or an object,
+        # `pos` is at the start of an item.
+        text = self.text
+        while True:
+            pos = self._skip(self._scan(pos)[1])
+            char = text[pos:pos + 1]
+            if char == end:
+                return pos + 1
+            if char != ',':
+                raise JSONSyntaxError(pos)
+            pos = self._skip(pos + 1)
+
+    def _mapping(self, unit, pos, path):
+        text = self.text
+        match_whitespace = self._match_whitespace
+        entries, plan, children = unit.type._visible_plan()
+        values = {}
+        unknown = []
+
+        if text[pos:pos + 1] in WHITESPACE_CHARS:
+            pos = match_whitespace(text, pos).end()
+        if text[pos:pos + 1] == '}':
+            pos += 1
+        else:
+            while True:
+                if text[pos:pos + 1] != '"':
+                    raise JSONSyntaxError(pos)
+                try:
+                    key, pos = scanstring(text, pos + 1)
+                except ValueError:
+                    raise JSONSyntaxError(pos)
+                if text[pos:pos + 1] in WHITESPACE_CHARS:
+                    pos = match_whitespace(text, pos).end()
+                if text[pos:pos + 1] != ':':
+                    raise JSONSyntaxError(pos)
+                pos += 1
+                if text[pos:pos + 1] in WHITESPACE_CHARS:
+                    pos = match_whitespace(text, pos).end()
+
+                child = children.get(key)
+                if child is None or child.read_only:
+                    if child is None and self.reject_unknown:
+                        unknown.append(key)
+                        self.positions[path + (key,)] = pos
+                    pos = self._scan(pos)[1]
+                else:
+                    values[key], pos = self._value(child, pos, path + (key,))
+
+                if text[pos:pos + 1] in WHITESPACE_CHARS:
+                    pos = match_whitespace(text, pos).end()
+                char = text[pos:pos + 1]
+                pos += 1
+                if char == '}':
+                    break
+                if char != ',':
+                    raise JSONSyntaxError(pos - 1)
+                if text[pos:pos + 1] in WHITESPACE_CHARS:
+                    pos = match_whitespace(text, pos).end()
+
+        # The rest is `MappingDeserializeMixin._deserialize` over values.
+        result = unit.type.dict_class()
+        errors = None
+        for name, attr, child, key, native in entries:
+            if not child.read_only:
+                if name in values:
+                    value = values[name]
+                else:
+                    value = child._run_validation(empty)
+                    if value is not empty and value.__class__ is Invalid:
+                        # Missing values are reported at the end of
+                        # the object.
+                        self.positions[path + (name,)] = pos - 1
+                if value is empty:
+                    pass
+                elif value.__class__ is Invalid:
+                    if errors is None:
+                        errors = OrderedDict()
+                    merge_errors(errors, name, value._detail)
+                else:
+                    result[name] = value
+            if name in plan:
+                if errors is None:
+                    errors = OrderedDict()
+                unit.type._check_constraints(plan[name], result, errors)
+
+        for key in unknown:
+            if errors is None:
+                errors = OrderedDict()
+            errors[key] = [self.unknown_message]
+
+        if errors:
+            return Invalid(errors), pos
+        return result, pos
+
+    def _sequence(self, unit, pos, path):
+        text = self.text
+        match_whitespace = self._match_whitespace
+        child = unit.children.values()[0]
+        max_items = unit.type.max_items
+        result = []
+        errors = None
+
+        if text[pos:pos + 1] in WHITESPACE_CHARS:
+            pos = match_whitespace(text, pos).end()
+        if text[pos:pos + 1] == ']':
+            return result, pos + 1
+
+        num = 0
+        while True:
+            if num == max_items:
+                # The rest is only parsed, errors of items are replaced.
+                size = len(path)
+                for key in [key for key in self.positions
+                            if key[:size] == path]:
+                    del self.positions[key]
+                self.positions[path] = pos
+                return (unit.type._max_items_error(),
+                        self._skip_items(pos, ']'))
+            value, pos = self._value(child, pos, path + (num,))
+            if value is empty:
+                pass
+            elif value.__class__ is Invalid:
+                if errors is None:
+                    errors = OrderedDict()
+                errors[num] = value._detail
+            else:
+                result.append(value)
+            num += 1
+
+            if text[pos:pos + 1] in WHITESPACE_CHARS:
+                pos = match_whitespace(text, pos).end()
+            char = text[pos:pos + 1]
+            pos += 1
+            if char == ']':
+                break
+            if char != ',':
+                raise JSONSyntaxError(pos - 1)
+            if text[pos:pos + 1] in WHITESPACE_CHARS:
+                pos = match_whitespace(text, pos).end()
+
+        if errors:
+            return Invalid(errors), pos
+        return result, pos
+
+
+def _walk(unit):
+    """
+    Returns the kind of the unit if its value should be walked, that is it
+    has mappings or sequences inside, None if it should be decoded at once.
+    Cached as `_json_walk` of the unit.
+    """
+    kind = _streamable(unit)
+    if kind is not None and not any(
+            child.children and _streamable(child)
+            for child in unit.children.itervalues()):
+        kind = None
+    return kind
+
+
+def _streamable(unit):
+    """
+    Returns `MAPPING` or `SEQUENCE` if the unit is a mapping or a sequence
+    which could be validated while parsing, that is it behaves as the base
+    classes do, None otherwise.
+    """
+    # Limits of units are checked over decoded values.
+    if (unit.preparer is not None or unit.read_only or
+            unit._limits is not None or unit._overrides_deserialize):
+        return None
+    key = (unit.__class__, unit.type.__class__)
+    try:
+        return _kinds[key]
+    except KeyError:
+        pass
+
+    cls, type_cls = key
+    kind = None
+    deserialize = getattr(type_cls._deserialize_quietly, 'im_func', None)
+    if (cls._run_validation.im_func is _SchemaUnit._run_validation.im_func and
+            cls._proxied is None):
+        if deserialize is MappingDeserializeMixin._deserialize.im_func:
+            kind = MAPPING
+        elif deserialize is Sequence._deserialize.im_func:
+            kind = SEQUENCE
+    _kinds[key] = kind
+    return kind
+
+
+_kinds = {}
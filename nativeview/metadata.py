@@ -17,6 +17,31 @@ def handle_basic(unit, only_type=False):
     if unit.validator and hasattr(unit.validator, 'get_metadata'):
         result.update(unit.validator.get_metadata(unit=unit))
 
+    if unit.preparer and hasattr(unit.preparer, 'get_metadata'):
+        result.update(unit.preparer.get_metadata(unit=unit))
+
+    for name in ('max_nodes', 'max_nesting'):
+        value = getattr(unit, name)
+        if value is not None:
+            result[name] = value
+    for name in ('max_items', 'max_length'):
+        value = getattr(unit.type, name, None)
+        if value is not None:
+            result[name] = value
+
+    return result
+
+
+def handle_file(unit, only_type=False):
+    result = handle_basic(unit, only_type)
+    if only_type:
+        return result
+
+    for name in ('max_size', 'content_types', 'checksum'):
+        value = getattr(unit.type, name)
+        if value is not None:
+            result[name] = value
+
     return result
 
 
@@ -25,12 +50,51 @@ def handle_mapping(unit, only_type=False):
     fields = result['fields'] = OrderedDict()
 
     children_only_type = unit.read_only
-    for name, child in unit.children.iteritems():
+    children = unit.children
+    if isinstance(unit.type, unit_types.MappingPlanMixin):
+        # Fields hidden for the role of the context are left out.
+        children = unit.type._visible_plan()[2]
+    for name, child in children.iteritems():
         fields[name] = determine_metadata(child, only_type=children_only_type)
 
     return result
 
 
+def handle_dict(unit, only_type=False):
+    result = handle_basic(unit, only_type)
+    key_unit, value_unit = unit.children.values()
+
+    children_only_type = unit.read_only
+    result['keys'] = determine_metadata(
+        key_unit, only_type=children_only_type)
+    result['values'] = determine_metadata(
+        value_unit, only_type=children_only_type)
+
+    return result
+
+
+def handle_one_of(unit, only_type=False):
+    result = handle_basic(unit, only_type)
+    result['discriminator'] = unit.type.discriminator
+    variants = result['variants'] = OrderedDict()
+
+    children_only_type = unit.read_only
+    for name, child in unit.children.iteritems():
+        variants[child.name or name] = determine_metadata(
+            child, only_type=children_only_type)
+
+    return result
+
+
+def handle_ref(unit, only_type=False):
+    result = handle_basic(unit, only_type)
+    result['ref'] = unit.target_name
+    if not only_type and unit.max_depth is not None:
+        result['max_depth'] = unit.max_depth
+
+    return result
+
+
 handlers_lookup = {
     unit_types.Integer: handle_basic,
     unit_types.Float: handle_basic,
@@ -38,9 +102,13 @@ handlers_lookup = {
     unit_types.Date: handle_basic,
     unit_types.DateTime: handle_basic,
     unit_types.Boolean: handle_basic,
+    unit_types.FileFieldStorage: handle_file,
     unit_types.Mapping: handle_mapping,
     unit_types.ObjectMapping: handle_mapping,
     unit_types.Sequence: handle_mapping,
+    unit_types.Dict: handle_dict,
+    unit_types.OneOf: handle_one_of,
+    unit_types.Reference: handle_ref,
 }
 
 def lookup_handler(unit):
@@ -58,9 +126,13 @@ types_lookup = {
     unit_types.Date: 'string',
     unit_types.DateTime: 'string',
     unit_types.Boolean: 'boolean',
+    unit_types.FileFieldStorage: 'file',
     unit_types.Mapping: 'dictionary',
     unit_types.ObjectMapping: 'dictionary',
     unit_types.Sequence: 'sequence',
+    unit_types.Dict: 'map',
+    unit_types.OneOf: 'one_of',
+    unit_types.Reference: 'ref',
 }
 
 def lookup_type(unit):
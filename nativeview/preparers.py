@@ -1,9 +1,213 @@
-__all__ = ['preparer_chain']
+__all__ = [
+    'preparer_chain', 'Preparer', 'Strip', 'Lower', 'Upper',
+    'NormalizeWhitespace', 'EmptyToNone'
+]
 
 
 def preparer_chain(*preparers):
-    def inner(data):
-        for preparer in preparers:
-            data = preparer(data)
+    """
+    Returns a preparer applying preparers in order. Runs of built-in
+    preparers are fused into one generated function, which is skipped for
+    missing data and non-string values.
+    """
+    if preparers and all(isinstance(p, Preparer) for p in preparers):
+        return _fused_class(preparers)(preparers)
+
+    steps = []
+    run = []
+    for preparer in preparers:
+        if isinstance(preparer, Preparer):
+            run.append(preparer)
+            continue
+        if run:
+            steps.append(preparer_chain(*run))
+            run = []
+        steps.append(preparer)
+    if run:
+        steps.append(preparer_chain(*run))
+    return PreparerChain(preparers, steps)
+
+
+class PreparerChain(object):
+    # Whether units skip the preparer for missing data, custom preparers
+    # could replace it.
+    skip_empty = False
+
+    @property
+    def pure(self):
+        return all(getattr(p, 'pure', False) for p in self.preparers)
+
+    def __init__(self, preparers, steps=None):
+        self.preparers = tuple(preparers)
+        self.steps = steps
+
+    def __call__(self, data):
+        for step in self.steps:
+            data = step(data)
         return data
-    return inner
\ No newline at end of file
+
+    def __reduce__(self):
+        return (preparer_chain, self.preparers)
+
+    # Chains are immutable, so units share them.
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def get_metadata(self, unit):
+        return {'preparers': [_get_metadata(p) for p in self.preparers]}
+
+
+def _get_metadata(preparer):
+    if isinstance(preparer, Preparer):
+        return preparer.metadata()
+    return {'name': getattr(
+        preparer, '__name__', preparer.__class__.__name__)}
+
+
+class FusedPreparerChain(PreparerChain):
+    skip_empty = True
+
+
+_fused_classes = {}
+
+
+def _fused_class(preparers):
+    key = tuple((p.__class__, p.params()) for p in preparers)
+    try:
+        return _fused_classes[key]
+    except KeyError:
+        pass
+
+    namespace = {}
+    lines = [
+        'def __call__(self, data):',
+        '    if not isinstance(data, basestring):',
+        '        return data',
+    ]
+    expression = 'data'
+    for num, preparer in enumerate(_simplify(preparers)):
+        name = 'p%d' % num
+        namespace[name] = preparer
+        if preparer.returns_none_if_empty:
+            if expression != 'data':
+                lines.append('    data = %s' % expression)
+                expression = 'data'
+            lines.append('    if not data:')
+            lines.append('        return None')
+        else:
+            expression = preparer.expression(expression, name)
+    lines.append('    return %s' % expression)
+
+    code = compile('\n'.join(lines), '<preparer_chain>', 'exec')
+    exec code in namespace
+    cls = _fused_classes[key] = type(
+        'FusedPreparerChain', (FusedPreparerChain,),
+        {'__call__': namespace['__call__']})
+    return cls
+
+
+def _simplify(preparers):
+    result = []
+    for preparer in preparers:
+        if result:
+            last = result[-1]
+            if (last.__class__ is preparer.__class__ and
+                    last.params() == preparer.params() and
+                    preparer.idempotent):
+                continue
+            # Splitting by whitespace strips it as well.
+            if (isinstance(preparer, NormalizeWhitespace) and
+                    isinstance(last, Strip) and last.chars is None):
+                result.pop()
+            elif (isinstance(preparer, Strip) and preparer.chars is None and
+                    isinstance(last, NormalizeWhitespace)):
+                continue
+        result.append(preparer)
+    return result
+
+
+# Built-in preparers
+
+class Preparer(object):
+    """
+    Base of built-in preparers, which are applied to strings only and
+    could be fused by `preparer_chain`.
+    """
+    name = None
+    skip_empty = True
+    pure = True
+    # Applying it twice gives the same result as once.
+    idempotent = True
+    returns_none_if_empty = False
+
+    def expression(self, value, name):
+        """
+        Returns source of an expression applying the preparer to `value`
+        expression, `name` refers to the preparer.
+        """
+        raise NotImplementedError
+
+    def params(self):
+        return ()
+
+    def metadata(self):
+        metadata = {'name': self.name}
+        metadata.update(self.params())
+        return metadata
+
+    def get_metadata(self, unit):
+        return {'preparers': [self.metadata()]}
+
+    def __call__(self, data):
+        try:
+            chain = self._chain
+        except AttributeError:
+            chain = self._chain = preparer_chain(self)
+        return chain(data)
+
+
+class Strip(Preparer):
+    name = 'strip'
+
+    def __init__(self, chars=None):
+        self.chars = chars
+
+    def expression(self, value, name):
+        if self.chars is None:
+            return '%s.strip()' % value
+        return '%s.strip(%s.chars)' % (value, name)
+
+    def params(self):
+        return (('chars', self.chars),) if self.chars is not None else ()
+
+
+class Lower(Preparer):
+    name = 'lower'
+
+    def expression(self, value, name):
+        return '%s.lower()' % value
+
+
+class Upper(Preparer):
+    name = 'upper'
+
+    def expression(self, value, name):
+        return '%s.upper()' % value
+
+
+class NormalizeWhitespace(Preparer):
+    """
+    Strips a string and replaces runs of whitespace with single spaces.
+    """
+    name = 'normalize_whitespace'
+
+    def expression(self, value, name):
+        return "' '.join(%s.split())" % value
+
+
+class EmptyToNone(Preparer):
+    name = 'empty_to_none'
+    returns_none_if_empty = True
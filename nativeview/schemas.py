@@ -1,18 +1,146 @@
-from units import SchemaUnit
+from collections import OrderedDict
 
-from unit_types import Mapping, ObjectMapping, Sequence
+from units import SchemaUnit, SchemaMeta, _SchemaUnit
+
+from unit_types import (
+    Mapping, ObjectMapping, Sequence, Dict, OneOf, Reference)
 from units import empty
+from columnar import serialize_columns
+from jsonstream import JSONValidator
+import etags
+from exceptions import Invalid
+from formats import JSON
 
 
 __all__ = [
     'SyncedSchemaUnit', 'MappingSchema', 'ObjectMappingSchema',
-    'SequenceSchema'
+    'SequenceSchema', 'DictSchema', 'OneOfSchema', 'Ref'
 ]
 
 
 # Mapping schema
 
 class SyncedSchemaUnit(SchemaUnit):
+    # Serialization cache, e.g. `LRUCache()`. Results of mapping schemas
+    # are cached by object identity and version and shared between calls,
+    # so they must not be modified.
+    cache_backend = None
+    cache_identity = 'id'
+    cache_version = 'version'
+
+    # `serialize` only adds the cache.
+    _overrides_serialize = False
+
+    def serialize(self, value=empty, format=None, encoder=None, trusted=None):
+        if self.cache_backend is None or format is not None:
+            # Other formats are cached by `_serialize`.
+            return _SchemaUnit.serialize(
+                self, value, format, encoder, trusted)
+
+        if value is empty:
+            value = self.source_object
+        if trusted is None:
+            trusted = self.trusted
+        key = self.get_cache_key(value, trusted=trusted)
+        if key is None:
+            return _SchemaUnit.serialize(self, value, trusted=trusted)
+        return self._cached(
+            key, _SchemaUnit.serialize, value, None, None, trusted)
+
+    def _serialize(self, value, format, trusted=False):
+        if self.cache_backend is None:
+            return _SchemaUnit._serialize(self, value, format, trusted)
+
+        key = self.get_cache_key(value, format, trusted or self.trusted)
+        if key is None:
+            return _SchemaUnit._serialize(self, value, format, trusted)
+        return self._cached(
+            key, _SchemaUnit._serialize, value, format, trusted)
+
+    def etag(self, value=empty, trusted=None,
+             algorithm=etags.DEFAULT_ALGORITHM):
+        """
+        Returns the ETag of the value serialized in `JSON` format, which is
+        computed without building the text, see `etags` module. With
+        `cache_backend` ETags are cached like serialized values.
+        """
+        if value is empty:
+            value = self.source_object
+        if trusted is None:
+            trusted = self.trusted
+        if self.cache_backend is not None:
+            key = self.get_cache_key(value, 'etag:' + algorithm, trusted)
+            if key is not None:
+                return self._cached(key, etags.etag, value, trusted, algorithm)
+        return etags.etag(self, value, trusted, algorithm)
+
+    def serialize_with_etag(self, value=empty, trusted=None,
+                            algorithm=etags.DEFAULT_ALGORITHM):
+        """
+        Returns the value serialized in `JSON` format with the built-in
+        encoder and its ETag, which is the same as `etag` returns.
+        """
+        if value is empty:
+            value = self.source_object
+        if trusted is None:
+            trusted = self.trusted
+        text = self._serialize(value, JSON, trusted)
+        return text, etags.digest(text, algorithm)
+
+    def _cached(self, key, serialize, *args):
+        result = self.cache_backend.get(key, empty)
+        if result is empty:
+            result = serialize(self, *args)
+            self.cache_backend.set(key, result)
+        return result
+
+    def get_cache_key(self, value, format=None, trusted=False):
+        """
+        Returns a cache key of value or None if it should not be cached.
+        Trusted results are cached apart, as their values are not
+        converted.
+        """
+        getter = getattr(self.type, '_getter', None)
+        if value is None or getter is None:
+            return None
+
+        get = getter(value)
+        identity = get(self.cache_identity, None)
+        version = get(self.cache_version, None)
+        if identity is None or version is None:
+            return None
+
+        projection = (format, bool(trusted), self.cache_projection())
+        return (self.__class__, projection, identity, version)
+
+    def validate_json(self, source, reject_unknown=False,
+                      max_value_size=None):
+        """
+        Same as `is_valid` for a JSON document given as a string or a
+        file-like object, which is validated while parsing. Afterwards
+        `error_positions` maps paths of errors to `(line, column)`.
+
+        See `jsonstream.JSONValidator` for arguments.
+        """
+        validator = JSONValidator(reject_unknown, max_value_size)
+        value, self.error_positions = validator.validate(self, source)
+        self._errors = False
+        if value is not empty and value.__class__ is Invalid:
+            self._validated_data = empty
+            self._errors = value.error().detail
+        else:
+            self._validated_data = value
+
+        return not bool(self._errors)
+
+    def cache_projection(self):
+        """
+        Extra part of the projection, for schemas which output depends on
+        something besides the object and the format. By default it is the
+        role of the context, see `SchemaUnit.is_visible`.
+        """
+        return self.context.get(self.visibility_key)
+
     def sync(self, instance=None, value=empty):
         """
         Bind value data to instance, also may create a new instance
@@ -21,28 +149,60 @@ class SyncedSchemaUnit(SchemaUnit):
         Args:
             instance - Existing instance, all data will be bind to the instance.
             value - A validated data to bind to the instance.
+
+        Only changed values are assigned, a summary of what was assigned
+        is available as `changes` afterwards.
         """
         raise NotImplementedError
 
+    @property
+    def changes(self):
+        """
+        Mapping of changed names to `(old, new)` pairs, nested synced
+        schemas are represented by their own `changes`.
+        """
+        assert hasattr(self, '_changes'), \
+            'You must call `.sync()` before accessing `.changes`.'
+        return self._changes
+
+    def _sync_children(self, value, getter, setter):
+        changes = OrderedDict()
+
+        for name, subval in value.iteritems():
+            child = self.children[name]
+            current = getter(child.name)
+            if subval is not empty and isinstance(child, SyncedSchemaUnit):
+                subinstance = None if current is empty else current
+                subval = child.sync(instance=subinstance, value=subval)
+                if subval is subinstance and subinstance is not None:
+                    if child.changes:
+                        changes[name] = child.changes
+                    continue
+            if current is not empty and child.type.equals(current, subval):
+                continue
+            setter(child.name, subval)
+            changes[name] = (None if current is empty else current, subval)
+
+        self._changes = changes
+
 
 class MappingSchema(SyncedSchemaUnit):
     schema_type = Mapping
 
     def sync(self, instance=None, value=empty):
-        # Everytime create a new dict
-        instance = {}
+        if instance is None:
+            instance = self.source_object
+        if instance is None:
+            instance = {}
 
         if value is empty:
             value = self.validated_data
 
         assert value is not empty, 'Cannot process empty value'
 
-        for name, subval in value.iteritems():
-            child = self.children[name]
-            if subval is not empty and isinstance(child, SyncedSchemaUnit):
-                subinstance = instance.get(child.name)
-                subval = child.sync(instance=subinstance, value=subval)
-            instance[child.name] = subval
+        self._sync_children(
+            value, lambda key: instance.get(key, empty),
+            instance.__setitem__)
 
         return instance
 
@@ -60,12 +220,9 @@ class ObjectMappingSchema(SyncedSchemaUnit):
         assert instance is not None, 'Cannot sync with None value'
         assert value is not empty, 'Cannot process empty value'
 
-        for name, subval in value.iteritems():
-            child = self.children[name]
-            if subval is not empty and isinstance(child, SyncedSchemaUnit):
-                subinstance = getattr(instance, child.name, None)
-                subval = child.sync(instance=subinstance, value=subval)
-            setattr(instance, child.name, subval)
+        self._sync_children(
+            value, lambda attr: getattr(instance, attr, empty),
+            lambda attr, subval: setattr(instance, attr, subval))
 
         return instance
 
@@ -94,4 +251,192 @@ class SequenceSchema(SyncedSchemaUnit):
                 subval = child.sync(value=subval)
             instance.append(subval)
 
+        # The list is always replaced as a whole, the parent schema
+        # compares it with the current one.
+        self._changes = OrderedDict()
+
+        return instance
+
+    def serialize_columns(self, value=empty, path=None, trusted=None):
+        """
+        Serializes a sequence of flat mappings into typed columns, see
+        `columnar` module.
+        """
+        if value is empty:
+            value = self.source_object
+        return serialize_columns(self, value, path, trusted)
+
+
+class DictSchema(SyncedSchemaUnit):
+    """
+    Mapping of arbitrary keys, the first child validates keys and the
+    second one values:
+
+        class StockSchema(DictSchema):
+            sku = SchemaUnit(String())
+            quantity = SchemaUnit(Integer(), validator=Range(min=0))
+    """
+    schema_type = Dict
+
+    def __init__(self, *args, **kw):
+        super(DictSchema, self).__init__(*args, **kw)
+        if len(self.children) != 2:
+            raise TypeError(
+                'Dict schemas must have exactly two child units')
+
+    def sync(self, instance=None, value=empty):
+        # Everytime create a new dict
+        if value is empty:
+            value = self.validated_data
+
+        assert value is not empty, 'Cannot process empty value'
+
+        instance = {}
+        child = self.children.values()[1]
+        for key, subval in value.iteritems():
+            if subval is not empty and isinstance(child, SyncedSchemaUnit):
+                subval = child.sync(value=subval)
+            instance[key] = subval
+
+        # The dict is always replaced as a whole, the parent schema
+        # compares it with the current one.
+        self._changes = OrderedDict()
+
+        return instance
+
+
+class OneOfSchema(SyncedSchemaUnit):
+    """
+    Tagged union of schemas, children are variants named by their tags:
+
+        class EventSchema(OneOfSchema):
+            discriminator = 'type'
+            classes = {UserCreated: 'user.created'}
+
+            created = UserCreatedSchema('user.created')
+            deleted = UserDeletedSchema('user.deleted')
+    """
+    discriminator = 'type'
+    # Mapping of object classes to tags, used by serialization.
+    classes = None
+
+    def schema_type(self):
+        return OneOf(discriminator=self.discriminator, classes=self.classes)
+
+    def sync(self, instance=None, value=empty):
+        if value is empty:
+            value = self.validated_data
+
+        assert value is not empty, 'Cannot process empty value'
+
+        tag = value[self.discriminator]
+        unit, key, declared = self.type._variants()[tag]
+        if not isinstance(unit, SyncedSchemaUnit):
+            self._changes = OrderedDict()
+            return value
+
+        if instance is None:
+            instance = self.source_object
+        if (instance is not None and self.classes and
+                self.type._variant_by_class(instance.__class__) != tag):
+            # The instance is of another variant.
+            instance = None
+        if instance is None and isinstance(unit, ObjectMappingSchema):
+            # Objects are built by classes of variants, without arguments.
+            cls = self._class_of(tag)
+            if cls is None:
+                self._changes = OrderedDict()
+                return value
+            instance = cls()
+        if not declared:
+            value = value.copy()
+            del value[self.discriminator]
+        instance = unit.sync(instance=instance, value=value)
+        self._changes = unit.changes
+        return instance
+
+    def _class_of(self, tag):
+        # Class of objects of a variant or None.
+        for cls, class_tag in (self.classes or {}).iteritems():
+            if class_tag == tag:
+                return cls
+        return None
+
+
+class Ref(SyncedSchemaUnit):
+    """
+    Reference to a schema class or its name, resolved on first use. Allows
+    recursive schemas:
+
+        class RepliesSchema(SequenceSchema):
+            item = Ref('CommentSchema', max_depth=50)
+
+        class CommentSchema(MappingSchema):
+            text = SchemaUnit(String())
+            replies = RepliesSchema(required=False)
+
+    If the reference is inside an instance of the schema, it is resolved
+    to that instance, so all levels of recursion share units, otherwise a
+    new instance is created once. Options of the unit, like `required`,
+    apply to every level instead of options of the referenced unit.
+
+    Args:
+        max_depth - Maximum depth of recursion through the reference.
+    """
+    schema_type = Reference
+
+    _resolved = None
+    # Depth of recursion in progress.
+    _active = 0
+
+    def __init__(self, target, *args, **kwargs):
+        self.target = target
+        self.max_depth = kwargs.pop('max_depth', None)
+        super(Ref, self).__init__(*args, **kwargs)
+
+    @property
+    def target_name(self):
+        if isinstance(self.target, basestring):
+            return self.target
+        return self.target.__name__
+
+    def resolve(self):
+        resolved = self._resolved
+        if resolved is not None:
+            return resolved
+
+        cls = self.target
+        if isinstance(cls, basestring):
+            cls = SchemaMeta.lookup(cls)
+
+        resolved = self.parent
+        while resolved is not None and not isinstance(resolved, cls):
+            resolved = resolved.parent
+
+        if resolved is None:
+            resolved = self._proxied = cls()
+            resolved.name = self.name
+            resolved.parent = self
+            if self._index is not None:
+                self._index.stale = True
+
+        self._resolved = resolved
+        return resolved
+
+    def sync(self, instance=None, value=empty):
+        if value is empty:
+            value = self.validated_data
+
+        resolved = self.resolve()
+        if not isinstance(resolved, SyncedSchemaUnit):
+            self._changes = OrderedDict()
+            return value
+
+        # A shared unit is bound to the object of its own level.
+        source_object, resolved.source_object = resolved.source_object, None
+        try:
+            instance = resolved.sync(instance=instance, value=value)
+        finally:
+            resolved.source_object = source_object
+        self._changes = resolved.changes
         return instance
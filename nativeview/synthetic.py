@@ -0,0 +1,508 @@
+"""
+Synthetic payloads generated from schemas, e.g. for load tests and
+benchmarks.
+
+Payloads are raw data as `is_valid` takes it, e.g. decoded JSON. Values
+are generated for types of units within bounds of `Range`, `Length`,
+`Choices` and `Regex` validators and of payload limits, values which other
+validators, preparers or constraints reject are generated again. Every
+payload is determined by the seed and its number, and payloads are
+generated lazily:
+
+    generator = PayloadGenerator(UserSchema, seed=1, items=(10, 100))
+    for payload, path in generator.payloads(1000, invalid_rate=0.1):
+        client.post('/users', json.dumps(payload))
+
+An invalid payload is the valid payload of the same number with one
+deliberately invalid value, `path` of the value is given along with it.
+"""
+import datetime
+import itertools
+import random
+import sre_constants
+import sre_parse
+import string
+
+from exceptions import Invalid
+from units import empty, _SchemaUnit
+from unit_types import (
+    Integer, Float, String, Boolean, DateTime, Date, Sequence, Dict, OneOf,
+    Reference, MappingDeserializeMixin, get_datetime_formatter)
+from validators import ValidatedChain, Range, Length, Choices, Regex
+
+
+__all__ = ['PayloadGenerator', 'generate_string']
+
+
+TEXT_CHARS = string.ascii_letters + string.digits
+# Characters of negated sets, e.g. `[^a-z]`.
+PRINTABLE_CHARS = TEXT_CHARS + ' .,:;-_@#/'
+
+NUMBER_BOUNDS = (0, 10000)
+DATETIME_START = datetime.datetime(2000, 1, 1)
+DATETIME_SPAN = 30 * 365 * 24 * 60 * 60
+
+
+class PayloadGenerator(object):
+    def __init__(self, schema, seed=0, items=(1, 5), text_length=(1, 20),
+                 optional=0.8, none=0.1, max_depth=3, attempts=100):
+        """
+        Args:
+            schema - A schema class or unit.
+            items - Bounds of numbers of items of sequences and dicts.
+            text_length - Bounds of lengths of strings.
+            optional - Probability of a value of an optional unit.
+            none - Probability of None for units which allow it.
+            max_depth - Depth of nesting after which optional mappings
+                are omitted and sequences get the least number of items,
+                e.g. for recursive schemas.
+            attempts - Number of attempts to generate an accepted value.
+        """
+        if not isinstance(schema, _SchemaUnit):
+            schema = schema()
+        self.unit = schema
+        self.seed = seed
+        self.items = items
+        self.text_length = text_length
+        self.optional = optional
+        self.none = none
+        self.max_depth = max_depth
+        self.attempts = attempts
+        # Unit -> whether its values should be validated, see `_checked`.
+        self._checks = {}
+
+    def payloads(self, count=None, invalid_rate=0.0, start=0):
+        """
+        Yields `(payload, path)` for payloads from `start`, endlessly if
+        `count` is None. `path` of an invalid value or None for valid
+        payloads.
+        """
+        if count is None:
+            nums = itertools.count(start)
+        else:
+            nums = xrange(start, start + count)
+        for num in nums:
+            if invalid_rate and self._random(num, 1).random() < invalid_rate:
+                yield self.invalid(num)
+            else:
+                yield self.valid(num), None
+
+    def valid(self, num=0):
+        """
+        Returns the valid payload with a number.
+        """
+        rng = self._random(num)
+        for attempt in xrange(self.attempts):
+            payload = self._value(self.unit, rng, 0)
+            if _accepts(self.unit, payload):
+                return payload
+        raise ValueError('No valid payload in %d attempts' % self.attempts)
+
+    def invalid(self, num=0):
+        """
+        Returns the valid payload with a number with one invalid value and
+        the path of the value.
+        """
+        payload = self.valid(num)
+        rng = self._random(num, 2)
+        targets = list(_targets(self.unit, payload, ()))
+        rng.shuffle(targets)
+        for path, unit, container, key in targets:
+            value = container[key]
+            for invalid in _invalid_values(unit, value):
+                if invalid is empty:
+                    if isinstance(container, list):
+                        continue
+                    del container[key]
+                else:
+                    container[key] = invalid
+                if not _accepts(self.unit, payload):
+                    return payload, path
+                container[key] = value
+        raise ValueError('No invalid value for payload %d' % num)
+
+    def _random(self, num, stream=0):
+        return random.Random((((self.seed << 64) + num) << 2) + stream)
+
+    def _generate(self, unit, rng, depth):
+        # A value which the unit accepts.
+        value = self._value(unit, rng, depth)
+        if not self._checked(unit):
+            return value
+        for attempt in xrange(self.attempts):
+            if _accepts(unit, value):
+                return value
+            value = self._value(unit, rng, depth)
+        raise ValueError('No value of %s in %d attempts' % (
+            '.'.join(map(unicode, unit.index.path(unit))) or 'schema',
+            self.attempts))
+
+    def _checked(self, unit):
+        # Whether generated values could be rejected, so they should be
+        # validated.
+        try:
+            return self._checks[unit]
+        except KeyError:
+            pass
+        checked = bool(
+            unit.validator or unit.preparer or
+            getattr(unit, '__constraints__', None) or
+            isinstance(unit.type, OneOf))
+        if checked and not unit.preparer and not unit.children:
+            checked = not all(_honored(unit.type, validator)
+                              for validator in _validators(unit))
+        self._checks[unit] = checked
+        return checked
+
+    def _value(self, unit, rng, depth):
+        type_ = unit.type
+        if isinstance(type_, Reference):
+            return self._value(unit.resolve(), rng, depth)
+
+        validators = _validators(unit)
+        choices = _first(validators, Choices)
+        if choices is not None and not unit.children:
+            return rng.choice([value for value, label in choices])
+
+        if isinstance(type_, MappingDeserializeMixin):
+            return self._mapping(unit, rng, depth)
+        if isinstance(type_, OneOf):
+            return self._one_of(unit, rng, depth)
+        if isinstance(type_, Sequence):
+            return self._sequence(unit, validators, rng, depth)
+        if isinstance(type_, Dict):
+            return self._dict(unit, validators, rng, depth)
+        if isinstance(type_, Boolean):
+            return rng.random() < 0.5
+        if isinstance(type_, Integer):
+            return rng.randint(*_bounds(validators, Range, *NUMBER_BOUNDS))
+        if isinstance(type_, Float):
+            return rng.uniform(*_bounds(validators, Range, *NUMBER_BOUNDS))
+        if isinstance(type_, (DateTime, Date)):
+            return self._datetime(type_, rng)
+        if isinstance(type_, String):
+            return self._string(type_, validators, rng)
+        raise TypeError(
+            'Values of %s could not be generated' % type_.__class__.__name__)
+
+    def _mapping(self, unit, rng, depth):
+        result = {}
+        for name, child in unit.type._visible_plan()[2].iteritems():
+            if child.read_only:
+                continue
+            if not child.required and (
+                    rng.random() >= self.optional or
+                    (child.children and depth >= self.max_depth)):
+                continue
+            if child.allow_none and rng.random() < self.none:
+                result[name] = None
+            else:
+                result[name] = self._generate(child, rng, depth + 1)
+        return result
+
+    def _one_of(self, unit, rng, depth):
+        variants = unit.type._variants()
+        tag = rng.choice(sorted(variants))
+        # Variants are checked along with the discriminator by the unit.
+        result = self._value(variants[tag][0], rng, depth)
+        result[unit.type.discriminator] = tag
+        return result
+
+    def _size(self, unit, validators, depth):
+        low, high = _bounds(validators, Length, *self.items)
+        max_items = unit.type.max_items
+        if max_items is not None and max_items < high:
+            high = max_items
+            low = min(low, high)
+        if depth >= self.max_depth:
+            # The least number of items the unit accepts.
+            high = low = min(_bounds(validators, Length, 0, high)[0], high)
+        return low, high
+
+    def _sequence(self, unit, validators, rng, depth):
+        child = unit.children.values()[0]
+        size = rng.randint(*self._size(unit, validators, depth))
+        result = []
+        for num in xrange(size):
+            if child.allow_none and rng.random() < self.none:
+                result.append(None)
+            else:
+                result.append(self._generate(child, rng, depth + 1))
+        return result
+
+    def _dict(self, unit, validators, rng, depth):
+        key_unit, value_unit = unit.children.values()
+        size = rng.randint(*self._size(unit, validators, depth))
+        result = {}
+        for attempt in xrange(self.attempts):
+            if len(result) >= size:
+                break
+            key = self._generate(key_unit, rng, depth + 1)
+            result[key] = self._generate(value_unit, rng, depth + 1)
+        return result
+
+    def _datetime(self, type_, rng):
+        value = DATETIME_START + datetime.timedelta(
+            seconds=rng.randint(0, DATETIME_SPAN))
+        if isinstance(type_, DateTime):
+            format = type_.input_formats[0]
+        else:
+            format = type_.format
+            value = value.date()
+        formatter = get_datetime_formatter(format)
+        if formatter is None:
+            return type_.serialize(value)
+        return formatter(value)
+
+    def _string(self, type_, validators, rng):
+        regex = _first(validators, Regex)
+        if regex is not None:
+            text = generate_string(regex.pattern, rng)
+            if text is not None:
+                return text
+
+        low, high = _bounds(validators, Length, *self.text_length)
+        if type_.max_length is not None and type_.max_length < high:
+            high = type_.max_length
+            low = min(low, high)
+        return u''.join(rng.choice(TEXT_CHARS)
+                        for num in xrange(rng.randint(low, high)))
+
+
+def _accepts(unit, data):
+    value = unit._run_validation(data)
+    return value is empty or value.__class__ is not Invalid
+
+
+def _honored(type_, validator):
+    # Whether generated values of the type satisfy the validator.
+    if isinstance(validator, Choices):
+        return True
+    if isinstance(validator, Range):
+        return isinstance(type_, (Integer, Float))
+    if isinstance(validator, Length):
+        return isinstance(type_, String)
+    return False
+
+
+def _validators(unit):
+    validator = unit.validator
+    if validator is None:
+        return []
+    if isinstance(validator, ValidatedChain):
+        return validator.validators
+    return [validator]
+
+
+def _first(validators, cls):
+    for validator in validators:
+        if isinstance(validator, cls):
+            return validator
+    return None
+
+
+def _bounds(validators, cls, low, high):
+    """
+    Returns bounds within `min` and `max` of validators of a class, default
+    bounds are moved to them if they do not overlap.
+    """
+    minimum = maximum = None
+    for validator in validators:
+        if isinstance(validator, cls):
+            if validator.min is not None and (
+                    minimum is None or validator.min > minimum):
+                minimum = validator.min
+            if validator.max is not None and (
+                    maximum is None or validator.max < maximum):
+                maximum = validator.max
+
+    span = high - low
+    if minimum is not None and maximum is not None:
+        return minimum, maximum
+    if minimum is not None:
+        low = max(low, minimum)
+        if high < low:
+            high = low + span
+    elif maximum is not None:
+        high = min(high, maximum)
+        if low > high:
+            low = high - span
+    return low, high
+
+
+def _targets(unit, value, path):
+    """
+    Yields `(path, unit, container, key)` for values inside a payload.
+    """
+    if isinstance(unit.type, Reference):
+        unit = unit.resolve()
+    type_ = unit.type
+    if value is None:
+        return
+
+    if isinstance(type_, MappingDeserializeMixin):
+        for name, child in type_._visible_plan()[2].iteritems():
+            if name in value and not child.read_only:
+                yield path + (name,), child, value, name
+                for target in _targets(child, value[name], path + (name,)):
+                    yield target
+    elif isinstance(type_, OneOf):
+        variants = type_._variants()
+        child = variants[value[type_.discriminator]][0]
+        for target in _targets(child, value, path):
+            if target[0][len(path):] != (type_.discriminator,):
+                yield target
+    elif isinstance(type_, Sequence):
+        child = unit.children.values()[0]
+        for num, item in enumerate(value):
+            yield path + (num,), child, value, num
+            for target in _targets(child, item, path + (num,)):
+                yield target
+    elif isinstance(type_, Dict):
+        value_unit = unit.children.values()[1]
+        for key, item in value.items():
+            yield path + (key,), value_unit, value, key
+            for target in _targets(value_unit, item, path + (key,)):
+                yield target
+
+
+def _invalid_values(unit, value):
+    """
+    Yields values which the unit could reject, most specific first, and
+    `empty` for a missing value.
+    """
+    type_ = unit.type
+    if isinstance(type_, Reference):
+        type_ = unit.resolve().type
+
+    for validator in _validators(unit):
+        if isinstance(validator, Choices):
+            yield u'\u2205'
+        elif isinstance(validator, Range):
+            if validator.max is not None:
+                yield validator.max + 1
+            if validator.min is not None:
+                yield validator.min - 1
+        elif isinstance(validator, Length) and isinstance(type_, String):
+            if validator.max is not None:
+                yield u'x' * (validator.max + 1)
+            if validator.min:
+                yield u'x' * (validator.min - 1)
+        elif isinstance(validator, Regex):
+            yield u'\x00'
+
+    if isinstance(type_, (Integer, Float)):
+        yield u'not a number'
+    elif isinstance(type_, Boolean):
+        yield u'maybe'
+    elif isinstance(type_, (DateTime, Date)):
+        yield u'not a date'
+    elif isinstance(type_, String):
+        if type_.max_length is not None:
+            yield u'x' * (type_.max_length + 1)
+    elif isinstance(type_, (Sequence, Dict)):
+        yield 0
+    elif isinstance(type_, OneOf):
+        yield {}
+
+    if not unit.allow_none:
+        yield None
+    if unit.required:
+        yield empty
+
+
+# Strings matching regular expressions
+
+class _Unsupported(Exception):
+    pass
+
+
+CATEGORY_CHARS = {
+    sre_constants.CATEGORY_DIGIT: string.digits,
+    sre_constants.CATEGORY_NOT_DIGIT: string.ascii_letters,
+    sre_constants.CATEGORY_SPACE: ' ',
+    sre_constants.CATEGORY_NOT_SPACE: TEXT_CHARS,
+    sre_constants.CATEGORY_WORD: TEXT_CHARS + '_',
+    sre_constants.CATEGORY_NOT_WORD: ' .,-',
+}
+
+# Ranges wider than that are cut, e.g. `[\x00-\uffff]`.
+MAX_RANGE = 256
+
+
+def generate_string(pattern, rng=random, max_repeat=5):
+    """
+    Returns a random unicode string matching a regular expression, None if
+    the expression has unsupported constructs, e.g. lookarounds. Unbounded
+    repeats are repeated up to `max_repeat` times more than required.
+    """
+    if hasattr(pattern, 'pattern'):
+        pattern = pattern.pattern
+    try:
+        parsed = sre_parse.parse(pattern)
+    except sre_constants.error:
+        return None
+    try:
+        return u''.join(_generate_regex(parsed, rng, max_repeat, {}))
+    except _Unsupported:
+        return None
+
+
+def _generate_regex(pattern, rng, max_repeat, groups):
+    parts = []
+    for op, av in pattern:
+        if op == sre_constants.LITERAL:
+            parts.append(unichr(av))
+        elif op == sre_constants.NOT_LITERAL:
+            parts.append(rng.choice(
+                [char for char in PRINTABLE_CHARS if ord(char) != av]))
+        elif op == sre_constants.ANY:
+            parts.append(rng.choice(TEXT_CHARS))
+        elif op == sre_constants.IN:
+            parts.append(_generate_in(av, rng))
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            low, high, item = av
+            high = min(high, low + max_repeat)
+            for num in xrange(rng.randint(low, high)):
+                parts.extend(_generate_regex(item, rng, max_repeat, groups))
+        elif op == sre_constants.SUBPATTERN:
+            group, item = av[0], av[-1]
+            text = u''.join(_generate_regex(item, rng, max_repeat, groups))
+            if group:
+                groups[group] = text
+            parts.append(text)
+        elif op == sre_constants.BRANCH:
+            parts.extend(_generate_regex(
+                rng.choice(av[1]), rng, max_repeat, groups))
+        elif op == sre_constants.GROUPREF:
+            parts.append(groups.get(av, u''))
+        elif op == sre_constants.AT:
+            # Anchors hold for generated strings, which are matched whole.
+            pass
+        else:
+            raise _Unsupported(op)
+    return parts
+
+
+def _generate_in(items, rng):
+    negate = False
+    chars = []
+    for op, av in items:
+        if op == sre_constants.NEGATE:
+            negate = True
+        elif op == sre_constants.LITERAL:
+            chars.append(unichr(av))
+        elif op == sre_constants.RANGE:
+            low, high = av
+            chars.extend(unichr(code) for code in
+                         xrange(low, min(high, low + MAX_RANGE) + 1))
+        elif op == sre_constants.CATEGORY:
+            chars.extend(CATEGORY_CHARS[av])
+        else:
+            raise _Unsupported(op)
+    if negate:
+        excluded = set(chars)
+        chars = [char for char in PRINTABLE_CHARS if char not in excluded]
+    if not chars:
+        raise _Unsupported(sre_constants.IN)
+    return rng.choice(chars)
@@ -0,0 +1,168 @@
+"""
+Streaming CSV and TSV export and import of flat mapping schemas.
+
+Columns follow the order of units of the schema, units hidden for the role
+of the context are left out. Rows are written straight
+from objects, without intermediate mappings:
+
+    with open('users.csv', 'wb') as f:
+        tabular.dump(UserSchema, users, f)
+
+and validated positionally while reading:
+
+    with open('users.csv', 'rb') as f:
+        for row, values, errors in tabular.load(UserSchema, f):
+            ...
+
+Empty cells are missing values. Use `dialect='excel-tab'` for TSV.
+"""
+import csv
+from collections import OrderedDict
+
+from units import empty, _SchemaUnit
+from unit_types import MappingPlanMixin
+from formats import TUPLE
+from exceptions import ValidationError, Invalid, translate
+
+
+__all__ = ['columns', 'dump', 'load']
+
+
+def columns(schema):
+    """
+    Returns names of columns of a schema class or unit. Raises TypeError if
+    the schema is not flat.
+    """
+    units = _units(schema)
+    for name, unit in units.iteritems():
+        if unit.children:
+            raise TypeError('Tabular schemas must be flat: %s has %s' % (
+                name, ', '.join(unit.children)))
+    return list(units)
+
+
+def _units(schema):
+    # Units of columns, visible ones for units with a context.
+    if not isinstance(schema, _SchemaUnit):
+        return schema.__schema_units__
+    if isinstance(schema.type, MappingPlanMixin):
+        return schema.type._visible_plan()[2]
+    return schema.children
+
+
+def _get_unit(schema):
+    if isinstance(schema, _SchemaUnit):
+        return schema
+    return schema()
+
+
+def dump(schema, objects, f, dialect='excel', header=True, trusted=None,
+         encoding='utf-8'):
+    """
+    Writes objects to a file-like object as rows, one object at a time.
+
+    Args:
+        trusted - See `SchemaUnit.serialize`.
+        encoding - Encoding of unicode values.
+    """
+    schema = _get_unit(schema)
+    names = columns(schema)
+    if trusted is None:
+        trusted = schema.trusted
+
+    writer = csv.writer(f, dialect)
+    if header:
+        writer.writerow([name.encode(encoding) for name in names])
+
+    serialize = schema._serialize
+    writer.writerows(
+        [cell.encode(encoding) if cell.__class__ is unicode else cell
+         for cell in serialize(value, TUPLE, trusted)]
+        for value in objects)
+
+
+def load(schema, f, dialect='excel', header=True, encoding='utf-8'):
+    """
+    Validates rows of a file-like object. Yields `(row, values, errors)`
+    for every row, where `row` is a number of the row starting from 1 like
+    in spreadsheets (the header is the first row), `values` is a tuple of
+    validated values in column order, None for skipped units, and
+    `errors` is None or a mapping of `(row, column)` to messages. Errors
+    of the whole row are reported under `(row, None)`.
+
+    With `header` columns are matched by names, unknown columns are
+    ignored and absent ones are missing in every row. Otherwise columns go
+    in order of `columns`.
+    """
+    schema = _get_unit(schema)
+    names = columns(schema)
+    reader = csv.reader(f, dialect)
+
+    row = 0
+    positions = range(len(names))
+    if header:
+        try:
+            head = next(reader)
+        except StopIteration:
+            return
+        row += 1
+        head = dict((name.decode(encoding), num)
+                    for num, name in enumerate(head))
+        positions = [head.get(name) for name in names]
+
+    plan = [(name, schema.children[name], position)
+            for name, position in zip(names, positions)]
+    plan_names = set(names)
+    # Constraints and the validator of the schema need a mapping of
+    # values, it is only built for them.
+    # Constraints on hidden units are not checked, as by the mapping.
+    constraints = [constraint for constraint in schema.__constraints__
+                   if all(name in plan_names for name in constraint.fields)]
+    check_row = bool(constraints or schema.validator)
+
+    for cells in reader:
+        row += 1
+        width = len(cells)
+        values = []
+        errors = None
+        for name, unit, position in plan:
+            if position is None or position >= width or not cells[position]:
+                data = empty
+            elif encoding is not None:
+                data = cells[position].decode(encoding)
+            else:
+                data = cells[position]
+
+            value = unit._run_validation(data)
+            if value is empty:
+                if not check_row:
+                    value = None
+            elif value.__class__ is Invalid:
+                if errors is None:
+                    errors = OrderedDict()
+                errors[(row, name)] = translate(value._detail)
+                value = None
+            values.append(value)
+
+        if check_row:
+            if errors is None:
+                errors = _check_row(schema, constraints, names, values, row)
+            values = [None if value is empty else value for value in values]
+        yield row, tuple(values), errors
+
+
+def _check_row(schema, constraints, names, values, row):
+    result = schema.type.dict_class(
+        (name, value) for name, value in zip(names, values)
+        if value is not empty)
+    errors = OrderedDict()
+    schema.type._check_constraints(constraints, result, errors)
+    if not errors and schema.validator:
+        try:
+            schema.validator(schema, result)
+        except ValidationError as e:
+            errors[None] = e._detail
+    if not errors:
+        return None
+    return OrderedDict(
+        ((row, name), translate(detail)) for name, detail in errors.iteritems())
@@ -1,24 +1,59 @@
 from collections import OrderedDict
+from functools import partial
 import datetime
-
-import arrow
-
-from exceptions import ValidationError
-from units import empty, SkipUnit
-from i18n import TranslationStringFactory as _
+import hashlib
+import importlib
+import itertools
+import mmap
+import operator
+import os
+import re
+
+from exceptions import ValidationError, Invalid, translate
+from units import empty, _SchemaUnit
+from i18n import TranslationStringFactory as _, get_error_messages
+from cache import ValidationMemo
+from formats import (
+    ORDERED, DICT, TUPLE, JSON, encode_json_key, encode_json_value)
 
 
 __all__ = [
     'ValidationError', 'Integer', 'Float',
     'DateTime', 'Date', 'TimeDeltaSeconds',
     'String', 'FileFieldStorage', 'Boolean',
-    'Mapping', 'ObjectMapping', 'Sequence'
+    'Mapping', 'ObjectMapping', 'Sequence', 'Dict', 'OneOf', 'Reference'
 ]
 
 
+# arrow takes most of the import time, it's imported on first use of
+# DateTime or Date.
+arrow = None
+
+
+def get_arrow():
+    global arrow
+    if arrow is None:
+        arrow = importlib.import_module('arrow')
+    return arrow
+
+
 # UnitTypes
 
 class UnitType(object):
+    # Children are addressed by position, e.g. `items.0.name`.
+    positional = False
+    # The last child is addressed by any key, e.g. `prices.sku-1`.
+    keyed = False
+    # Types of values which `serialize` returns as is. In trusted mode they
+    # are not passed to `serialize`, see `SchemaUnit.serialize`.
+    native = None
+    # Deserialization depends on the value only and gives immutable
+    # results, so they could be reused, see `SchemaUnit.is_pure`.
+    pure = False
+    # Values are validated by units of another schema, e.g. a referenced
+    # one, so units of the type are not leaves, see `ValidationSnapshot`.
+    delegates = False
+
     def __init__(
             self, unit=None,
             error_messages=None,
@@ -26,25 +61,109 @@ class UnitType(object):
         ):
         self.unit = unit
 
-        messages = {}
-        for c in reversed(self.__class__.__mro__):
-            messages.update(getattr(c, 'default_error_messages', {}))
-        messages.update(error_messages or {})
-        self.error_messages = messages
+        cls = self.__class__
+        if '_native' not in cls.__dict__:
+            prepare_class(cls)
+
+        self.error_messages = get_error_messages(cls, error_messages)
 
         self.__dict__.update(kwargs)
 
     def serialize(self, value):
         raise NotImplementedError
 
+    def serialize_as(self, value, format, trusted=False):
+        """
+        Serializes to one of formats, see `formats` module. Only mappings
+        and sequences differ between formats apart from `JSON`.
+        """
+        if trusted and self._native is not None:
+            assert value is None or isinstance(value, self._native), \
+                'Untrusted value %r' % (value,)
+            serialized = value
+        else:
+            serialized = self.serialize(value)
+        if format == JSON:
+            return encode_json_value(serialized)
+        return serialized
+
     def deserialize(self, value):
+        result = self._deserialize(value)
+        if result.__class__ is Invalid:
+            raise result.error()
+        return result
+
+    def _deserialize(self, value):
+        """
+        Returns `Invalid` instead of raising `ValidationError`.
+        """
         raise NotImplementedError
 
+    def _deserialize_quietly(self, value):
+        # Every subclass gets its own resolved version on instantiation.
+        return _find_quiet_deserializer(self.__class__)(self, value)
+
+    def equals(self, old, new):
+        """
+        Used by `sync` to decide whether a value has changed. Could be
+        overridden per instance, e.g. `Float(equals=lambda a, b: ...)`.
+        """
+        return old == new
+
+
+def prepare_class(cls):
+    """
+    Resolves per class attributes of a unit type, done on the first
+    instantiation.
+    """
+    if '_deserialize_quietly' not in cls.__dict__:
+        cls._deserialize_quietly = _find_quiet_deserializer(cls)
+    cls._native = _find_native(cls)
+    cls._overrides_serialize = _find_serialize_override(cls)
+
+
+def _find_native(cls):
+    # `native` is trusted only along with `serialize` of the same class.
+    for klass in cls.__mro__:
+        if 'serialize' in klass.__dict__:
+            return klass.__dict__.get('native')
+    return None
+
+
+def _find_serialize_override(cls):
+    # `serialize_as` of types of this module gives what their `serialize`
+    # does in every format, `serialize` of subclasses is called instead.
+    for klass in cls.__mro__:
+        if 'serialize_as' in klass.__dict__:
+            return False
+        if 'serialize' in klass.__dict__:
+            return klass.__module__ != __name__
+    return False
+
+
+def _deserialize_raising(type_, value):
+    try:
+        return type_.deserialize(value)
+    except ValidationError as e:
+        return Invalid(e._detail, type_.unit)
+
+
+def _find_quiet_deserializer(cls):
+    # Subclasses which still override `deserialize` take precedence over
+    # `_deserialize` of their bases.
+    for c in cls.__mro__:
+        if '_deserialize' in c.__dict__:
+            return c.__dict__['_deserialize']
+        if 'deserialize' in c.__dict__:
+            return _deserialize_raising
+
 
 class Integer(UnitType):
     default_error_messages = {
         'invalid': _('Enter a whole number.')
     }
+    native = (int, long)
+    pure = True
 
     def serialize(self, value):
         if value is None:
@@ -55,17 +174,19 @@ class Integer(UnitType):
 
         return int(str(value))
 
-    def deserialize(self, value):
+    def _deserialize(self, value):
         try:
             return int(str(value))
         except (TypeError, ValueError):
-            raise ValidationError(self.error_messages['invalid'], self.unit)
+            return Invalid(self.error_messages['invalid'], self.unit)
 
 
 class Float(UnitType):
     default_error_messages = {
         'invalid': _('Enter a floating-point number.')
     }
+    native = float
+    pure = True
 
     def serialize(self, value):
         if value is None:
@@ -76,11 +197,114 @@ class Float(UnitType):
 
         return float(str(value))
 
-    def deserialize(self, value):
+    def _deserialize(self, value):
         try:
             return float(str(value))
         except (TypeError, ValueError):
-            raise ValidationError(self.error_messages['invalid'], self.unit)
+            return Invalid(self.error_messages['invalid'], self.unit)
+
+
+# Native formatting of datetimes, same as arrow does for supported tokens.
+# Only tokens which every version of arrow since 0.4.4 formats alike are
+# supported, formats with other runs of letters, e.g. `ZZZ` or names of
+# months, or with escapes in brackets, which older versions print as is,
+# are left to arrow.
+
+DATETIME_TOKEN_RE = re.compile(r'([A-Za-z])\1*')
+# Not a token in any version.
+DATETIME_LITERAL_TOKENS = frozenset(['T'])
+
+_zero_offset_sign = None
+
+
+def _format_offset(value, separator):
+    global _zero_offset_sign
+    offset = value.utcoffset()
+    minutes = int(offset.total_seconds() / 60) if offset is not None else 0
+    if minutes == 0:
+        # Differs between versions of arrow.
+        if _zero_offset_sign is None:
+            _zero_offset_sign = get_arrow().get(
+                datetime.datetime(2000, 1, 1)).format('ZZ')[0]
+        sign = _zero_offset_sign
+    else:
+        sign = '+' if minutes > 0 else '-'
+    hours, minutes = divmod(abs(minutes), 60)
+    return '%s%02d%s%02d' % (sign, hours, separator, minutes)
+
+
+DATETIME_FIELDS = {
+    'YYYY': ('%04d', operator.attrgetter('year')),
+    'MM': ('%02d', operator.attrgetter('month')),
+    'M': ('%d', operator.attrgetter('month')),
+    'DD': ('%02d', operator.attrgetter('day')),
+    'D': ('%d', operator.attrgetter('day')),
+    'HH': ('%02d', operator.attrgetter('hour')),
+    'H': ('%d', operator.attrgetter('hour')),
+    'mm': ('%02d', operator.attrgetter('minute')),
+    'm': ('%d', operator.attrgetter('minute')),
+    'ss': ('%02d', operator.attrgetter('second')),
+    's': ('%d', operator.attrgetter('second')),
+    'SSSSSS': ('%06d', operator.attrgetter('microsecond')),
+    'SSSSS': ('%05d', lambda value: value.microsecond // 10),
+    'SSSS': ('%04d', lambda value: value.microsecond // 100),
+    'SSS': ('%03d', lambda value: value.microsecond // 1000),
+    'SS': ('%02d', lambda value: value.microsecond // 10000),
+    'S': ('%d', lambda value: value.microsecond // 100000),
+    'ZZ': ('%s', lambda value: _format_offset(value, ':')),
+    'Z': ('%s', lambda value: _format_offset(value, '')),
+}
+
+_datetime_formatters = {}
+
+
+def _parse_datetime_format(format):
+    # Template for `%` and getters of its values, None if the format is
+    # not supported.
+    if '[' in format or ']' in format:
+        return None
+    parts = []
+    getters = []
+    position = 0
+    for match in DATETIME_TOKEN_RE.finditer(format):
+        token = match.group(0)
+        if token in DATETIME_LITERAL_TOKENS:
+            continue
+        if token not in DATETIME_FIELDS:
+            return None
+        spec, getter = DATETIME_FIELDS[token]
+        parts.append(format[position:match.start()].replace('%', '%%'))
+        parts.append(spec)
+        getters.append(getter)
+        position = match.end()
+    parts.append(format[position:].replace('%', '%%'))
+    return ''.join(parts), getters
+
+
+def get_datetime_formatter(format):
+    """
+    Returns a function which formats datetimes in arrow format, or None if
+    the format has tokens which need arrow, e.g. names of months.
+    """
+    try:
+        return _datetime_formatters[format]
+    except KeyError:
+        pass
+
+    formatter = None
+    parsed = _parse_datetime_format(format)
+    if parsed is not None:
+        template, getters = parsed
+
+        def formatter(value):
+            if not isinstance(value, datetime.datetime):
+                if not isinstance(value, datetime.date):
+                    return None
+                value = datetime.datetime(value.year, value.month, value.day)
+            return template % tuple([getter(value) for getter in getters])
+
+    _datetime_formatters[format] = formatter
+    return formatter
 
 
 class DateTime(UnitType):
@@ -89,6 +313,7 @@ class DateTime(UnitType):
             "Datetime has wrong format. Use this format instead: '${format}'."),
     }
     format = 'YYYY-MM-DDTHH:mm:ss.SSSZZ'
+    pure = True
     input_formats = [
         'YYYY-MM-DDTHH:mm:ssZZ',
         'YYYY-MM-DDTHH:mm:ss.SSSZZ',
@@ -103,17 +328,32 @@ class DateTime(UnitType):
         if value is None:
             return value
 
+        formatter = get_datetime_formatter(self.format)
+        if formatter is not None:
+            formatted = formatter(value)
+            if formatted is not None:
+                return formatted
+
+        arrow = get_arrow()
         try:
             return arrow.get(value).format(self.format)
         except arrow.parser.ParserError as e:
             raise ValueError(e.message)
 
-    def deserialize(self, value):
+    def _deserialize(self, value):
+        arrow = get_arrow()
         try:
             return arrow.get(value, self.input_formats).datetime
         except (TypeError, arrow.parser.ParserError):
             msg = self.error_messages['invalid'] % {'format': self.format}
-            raise ValidationError(msg, self.unit)
+            return Invalid(msg, self.unit)
+
+    def equals(self, old, new):
+        # Naive and aware values are not comparable.
+        try:
+            return old == new
+        except TypeError:
+            return False
 
 
 class Date(UnitType):
@@ -122,6 +362,7 @@ class Date(UnitType):
             "Date has wrong format. Use this format instead: '${format}'."),
     }
     format = 'YYYY-MM-DD'
+    pure = True
 
     def __init__(self, format=None, *args, **kwargs):
         self.format = format if format is not None else self.format
@@ -131,22 +372,37 @@ class Date(UnitType):
         if value is None:
             return value
 
+        formatter = get_datetime_formatter(self.format)
+        if formatter is not None:
+            formatted = formatter(value)
+            if formatted is not None:
+                return formatted
+
+        arrow = get_arrow()
         try:
             return arrow.get(value).format(self.format)
         except arrow.parser.ParserError as e:
             raise ValueError(e.message)
 
-    def deserialize(self, value):
+    def _deserialize(self, value):
+        arrow = get_arrow()
         try:
             return arrow.get(value, self.format).date()
         except (TypeError, arrow.parser.ParserError):
             msg = self.error_messages['invalid'] % {'format': self.format}
-            raise ValidationError(msg, self.unit)
+            return Invalid(msg, self.unit)
+
+    def equals(self, old, new):
+        # Naive and aware values are not comparable.
+        try:
+            return old == new
+        except TypeError:
+            return False
 
 
 class TimeDeltaSeconds(Integer):
     default_error_messages = {
-        'overflow:': _('Overflow value.'),
+        'overflow': _('Overflow value.'),
     }
 
     def serialize(self, value):
@@ -155,16 +411,34 @@ class TimeDeltaSeconds(Integer):
 
         return int(value.total_seconds())
 
-    def deserialize(self, value):
-        value = super(TimeDeltaSeconds, self).deserialize(value)
+    def _deserialize(self, value):
+        value = super(TimeDeltaSeconds, self)._deserialize(value)
+        if value.__class__ is Invalid:
+            return value
         try:
             return datetime.timedelta(seconds=value)
         except OverflowError:
             msg = self.error_messages['overflow']
-            raise ValidationError(msg, self.unit)
+            return Invalid(msg, self.unit)
 
 
 class String(UnitType):
+    """
+    Args:
+        max_length - Maximum length, checked before validators of the unit.
+    """
+    native = basestring
+    pure = True
+
+    default_error_messages = {
+        'max_length': _("Ensure this value has at most ${max_length} "
+                        "characters."),
+    }
+
+    def __init__(self, max_length=None, *args, **kwargs):
+        self.max_length = max_length
+        super(String, self).__init__(*args, **kwargs)
+
     def serialize(self, value):
         if value is None:
             return value
@@ -174,20 +448,66 @@ class String(UnitType):
 
         return unicode(value)
 
-    def deserialize(self, value):
-        if isinstance(value, basestring):
-            return value
+    def _deserialize(self, value):
+        if not isinstance(value, basestring):
+            if value is None:
+                return None
+            value = unicode(value)
+
+        max_length = self.max_length
+        if max_length is not None and len(value) > max_length:
+            detail = self.error_messages['max_length'] % {
+                'max_length': max_length}
+            return Invalid(detail, self.unit)
+        return value
+
+
+# Leading bytes of files which content type could be sniffed.
+FILE_SIGNATURES = [
+    ('\x89PNG\r\n\x1a\n', 'image/png'),
+    ('\xff\xd8\xff', 'image/jpeg'),
+    ('GIF87a', 'image/gif'),
+    ('GIF89a', 'image/gif'),
+    ('%PDF-', 'application/pdf'),
+    ('PK\x03\x04', 'application/zip'),
+]
 
-        if value is None:
-            return None
 
-        return unicode(value)
+def sniff_content_type(head):
+    for signature, content_type in FILE_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    return None
 
 
 class FileFieldStorage(UnitType):
+    """
+    Uploaded file, e.g. `cgi.FieldStorage`. The file is never read into
+    memory: size is taken from the file system when possible, checksum
+    is computed over mmap of on-disk files or over chunks otherwise.
+
+    Args:
+        max_size - Maximum size in bytes.
+        content_types - Allowed content types, checked against the `type`
+            attribute of the upload or sniffed ones, see `sniff`.
+        checksum - Name of hashlib algorithm, the hex digest is assigned
+            to `checksum` attribute of the upload.
+        sniff - Detect content type by leading bytes of the file.
+    """
     default_error_messages = {
         'invalid': _("The submitted data was not a file."),
+        'max_size': _("File is larger than ${max_size} bytes."),
+        'content_type': _("File type '${content_type}' is not allowed."),
     }
+    chunk_size = 64 * 1024
+
+    def __init__(self, max_size=None, content_types=None, checksum=None,
+                 sniff=False, *args, **kwargs):
+        self.max_size = max_size
+        self.content_types = content_types
+        self.checksum = checksum
+        self.sniff = sniff
+        super(FileFieldStorage, self).__init__(*args, **kwargs)
 
     def serialize(self, value):
         if value is None:
@@ -195,7 +515,7 @@ class FileFieldStorage(UnitType):
 
         return value.filename
 
-    def deserialize(self, data):
+    def _deserialize(self, data):
         if data is None:
             return None
 
@@ -204,10 +524,86 @@ class FileFieldStorage(UnitType):
             getattr(data, 'file')
         except AttributeError:
             message = self.error_messages['invalid']
-            raise ValidationError(message, self.unit)
+            return Invalid(message, self.unit)
+
+        if self.max_size is None and self.checksum is None and not self.sniff:
+            return self._check_content_type(getattr(data, 'type', None), data)
 
+        size, digest, head = self._scan(data.file)
+        if self.max_size is not None and size > self.max_size:
+            message = self.error_messages['max_size'] % {
+                'max_size': self.max_size}
+            return Invalid(message, self.unit)
+
+        content_type = getattr(data, 'type', None)
+        if self.sniff:
+            content_type = sniff_content_type(head) or content_type
+        result = self._check_content_type(content_type, data)
+
+        if digest is not None and result.__class__ is not Invalid:
+            data.checksum = digest
+        return result
+
+    def _check_content_type(self, content_type, data):
+        if (self.content_types is not None and
+                content_type not in self.content_types):
+            message = self.error_messages['content_type'] % {
+                'content_type': content_type}
+            return Invalid(message, self.unit)
         return data
 
+    def _scan(self, f):
+        """
+        Returns size, checksum and leading bytes of the file, the file
+        position is kept.
+        """
+        hasher = hashlib.new(self.checksum) if self.checksum else None
+        # Size check comes first, so oversized files are never read.
+        check_size = self.max_size is not None
+        try:
+            fileno = f.fileno()
+        except (AttributeError, IOError, ValueError):
+            fileno = None
+
+        if fileno is not None:
+            if hasattr(f, 'flush'):
+                f.flush()
+            size = os.fstat(fileno).st_size
+            if check_size and size > self.max_size:
+                return size, None, ''
+            if size == 0:
+                return size, self._hexdigest(hasher), ''
+            mapped = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+            try:
+                if hasher is not None:
+                    hasher.update(mapped)
+                head = mapped[:16]
+            finally:
+                mapped.close()
+            return size, self._hexdigest(hasher), head
+
+        position = f.tell()
+        f.seek(0)
+        size, head = 0, None
+        try:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                if head is None:
+                    head = chunk[:16]
+                size += len(chunk)
+                if check_size and size > self.max_size:
+                    return size, None, head
+                if hasher is not None:
+                    hasher.update(chunk)
+        finally:
+            f.seek(position)
+        return size, self._hexdigest(hasher), head or ''
+
+    def _hexdigest(self, hasher):
+        return hasher.hexdigest() if hasher is not None else None
+
 
 class Boolean(UnitType):
     default_error_messages = {
@@ -215,6 +611,8 @@ class Boolean(UnitType):
     }
     TRUE_VALUES = set(('t', 'T', 'true', 'True', 'TRUE', '1', 1, True))
     FALSE_VALUES = set(('f', 'F', 'false', 'False', 'FALSE', '0', 0, 0.0, False))
+    native = bool
+    pure = True
 
     def serialize(self, value):
         if value in self.TRUE_VALUES:
@@ -223,12 +621,12 @@ class Boolean(UnitType):
             return False
         return bool(value)
 
-    def deserialize(self, data):
+    def _deserialize(self, data):
         if data in self.TRUE_VALUES:
             return True
         elif data in self.FALSE_VALUES:
             return False
-        raise ValidationError(self.default_error_messages['invalid'], self.unit)
+        return Invalid(self.error_messages['invalid'], self.unit)
 
 
 def allow_to_serialize(unit, serialized):
@@ -242,40 +640,223 @@ def allow_to_serialize(unit, serialized):
     return True
 
 
-class MappingDeserializeMixin(object):
-    def deserialize(self, data):
-        # TODO: To check data for dictionary
-        result = OrderedDict()
+def allow_to_serialize_json(unit, encoded):
+    if unit.omit_if_none and encoded == 'null':
+        return False
+    if unit.omit_if_empty and encoded in ('""', '[]', '{}'):
+        return False
+
+    return True
+
+
+def _get_memo(unit):
+    # `ValidationMemo` or `ValidationSnapshot` of the current call if any.
+    if not ValidationMemo.active.count:
+        return None
+    return unit.root._memo
+
+
+class MappingPlanMixin(object):
+    _static_plan = None
+    _role_plans = None
+
+    def _plan(self):
+        # Name, attribute or key of value, unit, JSON key and native types
+        # if values could be trusted without calling the unit.
+        try:
+            return self._plan_cache
+        except AttributeError:
+            plan = self._plan_cache = []
+            for name, unit in self.unit.children.iteritems():
+                native = None
+                if (not unit.children and
+                        unit.__class__._serialize.im_func is
+                        _SchemaUnit._serialize.im_func and
+                        not unit._overrides_serialize and
+                        not unit.type._overrides_serialize):
+                    native = unit.type._native
+                plan.append((
+                    name, unit.name or name, unit, encode_json_key(name),
+                    native))
+            return plan
+
+    def _visible_plan(self):
+        """
+        Returns the plan of children visible in the current context, the
+        constraint plan without constraints on hidden children and the
+        visible children by name, see `SchemaUnit.visible`. Plans are
+        built once per role.
+        """
+        plan = self._static_plan
+        if plan is not None:
+            return plan
+
+        unit = self.unit
+        if self._role_plans is None:
+            self._role_plans = {}
+            if all(child.visible is None
+                   for child in unit.children.itervalues()):
+                plan = self._static_plan = (
+                    self._plan(), unit.__constraint_plan__, unit.children)
+                return plan
+
+        role = unit.context.get(unit.visibility_key)
+        try:
+            return self._role_plans[role]
+        except KeyError:
+            pass
+
+        hidden = set(name for name, child in unit.children.iteritems()
+                     if not child.is_visible(role))
+        constraints = {}
+        for name, planned in unit.__constraint_plan__.iteritems():
+            planned = tuple(c for c in planned
+                            if hidden.isdisjoint(c.fields))
+            if planned:
+                constraints[name] = planned
+        plan = self._role_plans[role] = (
+            [entry for entry in self._plan() if entry[0] not in hidden],
+            constraints,
+            OrderedDict((name, child)
+                        for name, child in unit.children.iteritems()
+                        if name not in hidden))
+        return plan
+
+
+def merge_errors(errors, key, detail):
+    """
+    Adds a detail of errors under a key, e.g. of a constraint, which target
+    could have errors already. Lists of messages are joined, messages for
+    a mapping of errors of a nested unit go under None, as in `tabular`.
+    """
+    current = errors.get(key)
+    if current is None:
+        errors[key] = detail
+        return
+    if isinstance(current, list) and isinstance(detail, list):
+        errors[key] = current + detail
+        return
+    if isinstance(current, list):
+        current, detail = detail, current
+    merged = OrderedDict(current)
+    if isinstance(detail, dict):
+        merged.update(detail)
+    else:
+        merged[None] = merged.get(None, []) + detail
+    errors[key] = merged
+
+
+class MappingDeserializeMixin(MappingPlanMixin):
+    default_error_messages = {
+        'mapping': _("'${value}' is not a mapping."),
+    }
+    # Type of deserialized mappings, could be replaced with `dict`.
+    dict_class = OrderedDict
+
+    def _deserialize(self, data):
+        if not hasattr(data, 'get'):
+            detail = self.error_messages['mapping'] % {'value': data}
+            return Invalid(detail, self.unit)
+
+        result = self.dict_class()
         errors = OrderedDict()
+        entries, plan, children = self._visible_plan()
+        memo = _get_memo(self.unit)
 
-        for name, unit in self.unit.children.iteritems():
+        for name, attr, unit, key, native in entries:
             # TODO: raise an error or not?
-            if unit.read_only:
+            if not unit.read_only:
+                if memo is None:
+                    validated_value = unit._run_validation(
+                        data.get(name, empty))
+                else:
+                    validated_value = memo.validate(
+                        unit, data.get(name, empty), name)
+                if validated_value is empty:
+                    pass
+                elif validated_value.__class__ is Invalid:
+                    if name in errors:
+                        # A constraint targets the unit.
+                        merge_errors(errors, name, validated_value._detail)
+                    else:
+                        errors[name] = validated_value._detail
+                else:
+                    result[name] = validated_value
+            if name in plan:
+                self._check_constraints(plan[name], result, errors)
+
+        if errors:
+            return Invalid(errors)
+
+        return result
+
+    def _check_constraints(self, constraints, result, errors):
+        for constraint in constraints:
+            # Constraints of failed units would only repeat their errors.
+            if any(name in errors for name in constraint.fields):
                 continue
-            value = data.get(name, empty)
             try:
-                validated_value = unit.run_validation(value)
+                constraint(self.unit, result)
             except ValidationError as e:
-                errors[name] = e.detail
-            except SkipUnit:
-                pass
-            else:
-                result[name] = validated_value
+                merge_errors(errors, constraint.target, e._detail)
 
-        if errors:
-            raise ValidationError(errors)
 
+class MappingSerializeMixin(MappingPlanMixin):
+    def serialize_as(self, value, format, trusted=False):
+        if format == ORDERED and not trusted:
+            return self.serialize(value)
+
+        if value is None:
+            return 'null' if format == JSON else None
+
+        get = self._getter(value)
+
+        if format == JSON:
+            parts = []
+            for name, attr, unit, key, native in self._visible_plan()[0]:
+                subvalue = get(attr, None)
+                if trusted and native is not None:
+                    assert subvalue is None or isinstance(subvalue, native), \
+                        'Untrusted value %r' % (subvalue,)
+                    encoded = encode_json_value(subvalue)
+                else:
+                    encoded = unit._serialize(subvalue, JSON, trusted)
+                if not allow_to_serialize_json(unit, encoded):
+                    continue
+                parts.append(key + encoded)
+            return '{' + ','.join(parts) + '}'
+
+        # Positional, so nothing is omitted.
+        positional = format == TUPLE
+        if positional:
+            result = []
+        else:
+            result = {} if format == DICT else OrderedDict()
+        for name, attr, unit, key, native in self._visible_plan()[0]:
+            subvalue = get(attr, None)
+            if trusted and native is not None:
+                assert subvalue is None or isinstance(subvalue, native), \
+                    'Untrusted value %r' % (subvalue,)
+                serialized = subvalue
+            else:
+                serialized = unit._serialize(subvalue, format, trusted)
+            if positional:
+                result.append(serialized)
+            elif allow_to_serialize(unit, serialized):
+                result[name] = serialized
+
+        if positional:
+            return tuple(result)
         return result
 
 
-class Mapping(MappingDeserializeMixin, UnitType):
+class Mapping(MappingSerializeMixin, MappingDeserializeMixin, UnitType):
     def serialize(self, value):
         if value is None:
             return None
 
         result = OrderedDict()
-        for name, unit in self.unit.children.iteritems():
-            key = unit.name or name
+        for name, key, unit, json_key, native in self._visible_plan()[0]:
             subvalue = value.get(key)
             serialized = unit.serialize(subvalue)
             if not allow_to_serialize(unit, serialized):
@@ -283,15 +864,18 @@ class Mapping(MappingDeserializeMixin, UnitType):
             result[name] = serialized
         return result
 
+    def _getter(self, value):
+        return value.get
+
 
-class ObjectMapping(MappingDeserializeMixin, UnitType):
+class ObjectMapping(
+        MappingSerializeMixin, MappingDeserializeMixin, UnitType):
     def serialize(self, value):
         if value is None:
             return None
 
         result = OrderedDict()
-        for name, unit in self.unit.children.iteritems():
-            attrname = unit.name or name
+        for name, attrname, unit, key, native in self._visible_plan()[0]:
             subvalue = getattr(value, attrname, None)
             serialized = unit.serialize(subvalue)
             if not allow_to_serialize(unit, serialized):
@@ -299,22 +883,51 @@ class ObjectMapping(MappingDeserializeMixin, UnitType):
             result[name] = serialized
         return result
 
+    def _getter(self, value):
+        return partial(getattr, value)
+
 
 class Sequence(UnitType):
+    """
+    Args:
+        max_items - Maximum number of items, checked before items are
+            validated. Iterators are consumed up to the limit only.
+    """
+    positional = True
+
     default_error_messages = {
         'iterable': _("'${value}' is not a sequence."),
+        'max_items': _("Ensure this sequence has at most ${max_items} "
+                       "items."),
     }
 
+    def __init__(self, max_items=None, *args, **kwargs):
+        self.max_items = max_items
+        super(Sequence, self).__init__(*args, **kwargs)
+
+    def _max_items_error(self):
+        detail = self.error_messages['max_items'] % {
+            'max_items': self.max_items}
+        return Invalid(detail, self.unit)
+
     def _validate_seq(self, value):
+        max_items = self.max_items
         if isinstance(value, list):
+            if max_items is not None and len(value) > max_items:
+                return self._max_items_error()
             return value
         elif (hasattr(value, '__iter__') and
             not hasattr(value, 'get') and
             not isinstance(value, basestring)):
-            return list(value)
+            if max_items is None:
+                return list(value)
+            value = list(itertools.islice(value, max_items + 1))
+            if len(value) > max_items:
+                return self._max_items_error()
+            return value
         else:
             detail = self.error_messages['iterable'] % {'value': value}
-            raise ValidationError(detail, self.unit)
+            return Invalid(detail, self.unit)
 
     def serialize(self, value):
         if value is None:
@@ -329,8 +942,35 @@ class Sequence(UnitType):
             result.append(serialized)
         return result
 
-    def deserialize(self, value):
+    def serialize_as(self, value, format, trusted=False):
+        if format == ORDERED and not trusted:
+            return self.serialize(value)
+
+        if value is None:
+            return 'null' if format == JSON else None
+
+        child = self.unit.children.values()[0]
+        if format == JSON:
+            parts = []
+            for subval in value:
+                encoded = child._serialize(subval, format, trusted)
+                if not allow_to_serialize_json(child, encoded):
+                    continue
+                parts.append(encoded)
+            return '[' + ','.join(parts) + ']'
+
+        result = []
+        for subval in value:
+            serialized = child._serialize(subval, format, trusted)
+            if not allow_to_serialize(child, serialized):
+                continue
+            result.append(serialized)
+        return result
+
+    def _deserialize(self, value):
         value = self._validate_seq(value)
+        if value.__class__ is Invalid:
+            return value
         result = []
         errors = OrderedDict()
 
@@ -341,19 +981,365 @@ class Sequence(UnitType):
                 detail = "%s is read only value." % self.unit.name
             else:
                 detail = "Read only value."
-            raise ValidationError(detail, self.unit)
+            return Invalid(detail, self.unit)
 
+        memo = _get_memo(self.unit)
         for num, subval in enumerate(value):
-            try:
-                validated_value = child.run_validation(subval)
-            except ValidationError as e:
-                errors[num] = e.detail
-            except SkipUnit:
-                pass
+            if memo is None:
+                validated_value = child._run_validation(subval)
+            else:
+                validated_value = memo.validate(child, subval, num)
+            if validated_value is empty:
+                continue
+            if validated_value.__class__ is Invalid:
+                errors[num] = validated_value._detail
             else:
                 result.append(validated_value)
 
         if errors:
-            raise ValidationError(errors)
+            return Invalid(errors)
 
         return result
+
+
+# Types of values which are equal to each other only when they are
+# interchangeable.
+IMMUTABLE_SCALARS = frozenset([int, long, float, str, unicode, bool])
+
+
+class Dict(UnitType):
+    """
+    Mapping of arbitrary keys to values, the first child of the unit
+    validates keys and the second one values. Mappings are copied only if
+    a key or a value has been changed, so large mappings of valid values
+    are passed through as is.
+
+    Args:
+        max_items - Maximum number of entries, checked before entries are
+            validated.
+    """
+    keyed = True
+
+    # Type of mappings built by deserialization, ordered serialization
+    # builds OrderedDict.
+    dict_class = dict
+
+    default_error_messages = {
+        'mapping': _("'${value}' is not a mapping."),
+        'max_items': _("Ensure this mapping has at most ${max_items} "
+                       "entries."),
+    }
+
+    def __init__(self, max_items=None, *args, **kwargs):
+        self.max_items = max_items
+        super(Dict, self).__init__(*args, **kwargs)
+
+    def _units(self):
+        return self.unit.children.values()
+
+    @staticmethod
+    def _same(old, new):
+        # Numbers are converted to new but equal objects, e.g. ints beyond
+        # the cached small ones, and are as good as the original ones.
+        if new is old:
+            return True
+        return (
+            new.__class__ is old.__class__ and
+            new.__class__ in IMMUTABLE_SCALARS and new == old)
+
+    def _copy_until(self, value, entries, dict_class):
+        # Copy of the first `entries` entries, which are unchanged.
+        return dict_class(itertools.islice(value.iteritems(), entries))
+
+    def serialize(self, value):
+        return self.serialize_as(value, ORDERED)
+
+    def serialize_as(self, value, format, trusted=False):
+        if value is None:
+            return 'null' if format == JSON else None
+
+        key_unit, value_unit = self._units()
+        if format == JSON:
+            return self._serialize_json(value, key_unit, value_unit, trusted)
+
+        result = None
+        # TUPLE gives pairs in a tuple, so it is always a copy.
+        if format == TUPLE:
+            result = []
+        dict_class = OrderedDict if format == ORDERED else dict
+
+        for num, (key, subval) in enumerate(value.iteritems()):
+            serialized_key = key_unit._serialize(key, format, trusted)
+            serialized = value_unit._serialize(subval, format, trusted)
+            if not allow_to_serialize(value_unit, serialized):
+                if result is None:
+                    result = self._copy_until(value, num, dict_class)
+                continue
+            if result is None:
+                if (self._same(key, serialized_key) and
+                        self._same(subval, serialized)):
+                    continue
+                result = self._copy_until(value, num, dict_class)
+            if format == TUPLE:
+                result.append((serialized_key, serialized))
+            else:
+                result[serialized_key] = serialized
+
+        if result is None:
+            return value
+        if format == TUPLE:
+            return tuple(result)
+        return result
+
+    def _serialize_json(self, value, key_unit, value_unit, trusted):
+        parts = []
+        for key, subval in value.iteritems():
+            encoded = value_unit._serialize(subval, JSON, trusted)
+            if not allow_to_serialize_json(value_unit, encoded):
+                continue
+            key = key_unit._serialize(key, ORDERED, trusted)
+            if not isinstance(key, basestring):
+                # Same as the json module does.
+                key = encode_json_value(key)
+            parts.append(encode_json_key(key) + encoded)
+        return '{' + ','.join(parts) + '}'
+
+    def _deserialize(self, value):
+        if not hasattr(value, 'iteritems'):
+            detail = self.error_messages['mapping'] % {'value': value}
+            return Invalid(detail, self.unit)
+        max_items = self.max_items
+        if max_items is not None and len(value) > max_items:
+            detail = self.error_messages['max_items'] % {
+                'max_items': max_items}
+            return Invalid(detail, self.unit)
+
+        key_unit, value_unit = self._units()
+        result = None
+        errors = OrderedDict()
+        memo = _get_memo(self.unit)
+
+        for num, (key, subval) in enumerate(value.iteritems()):
+            validated_key = key_unit._run_validation(key)
+            validated_value = empty
+            if validated_key is not empty:
+                if validated_key.__class__ is Invalid:
+                    errors[key] = validated_key._detail
+                    continue
+                if memo is None:
+                    validated_value = value_unit._run_validation(subval)
+                else:
+                    validated_value = memo.validate(value_unit, subval, key)
+                if (validated_value is not empty and
+                        validated_value.__class__ is Invalid):
+                    errors[key] = validated_value._detail
+                    continue
+            if errors:
+                # The result is not used anymore.
+                continue
+
+            if validated_key is empty or validated_value is empty:
+                if result is None:
+                    result = self._copy_until(value, num, self.dict_class)
+                continue
+            if result is None:
+                if (self._same(key, validated_key) and
+                        self._same(subval, validated_value)):
+                    continue
+                result = self._copy_until(value, num, self.dict_class)
+            result[validated_key] = validated_value
+
+        if errors:
+            return Invalid(errors)
+
+        if result is None:
+            return value
+        return result
+
+
+class OneOf(UnitType):
+    """
+    Tagged union, children of the unit are variants keyed by the value of
+    `discriminator` field, a name of a child is its tag. Variants are
+    serialized by class of value if it is listed in `classes`, a mapping
+    of classes to tags, otherwise by the discriminator of value.
+    """
+    default_error_messages = {
+        'mapping': _("'${value}' is not a mapping."),
+        'discriminator': _("'${discriminator}' is required."),
+        'unknown': _("'${value}' is not one of ${tags}."),
+    }
+
+    def __init__(self, discriminator='type', classes=None, *args, **kwargs):
+        super(OneOf, self).__init__(*args, **kwargs)
+        self.discriminator = discriminator
+        self.classes = classes or {}
+
+    def _variants(self):
+        # Tag to (child, encoded tag for JSON, whether child has a unit for
+        # the discriminator).
+        try:
+            return self._variants_cache
+        except AttributeError:
+            variants = {}
+            for name, unit in self.unit.children.iteritems():
+                tag = unit.name or name
+                variants[tag] = (
+                    unit, encode_json_key(self.discriminator) +
+                    encode_json_value(tag),
+                    self.discriminator in unit.children)
+            self._variants_cache = variants
+            return variants
+
+    def _variant_by_class(self, cls):
+        try:
+            by_class = self._by_class_cache
+        except AttributeError:
+            by_class = self._by_class_cache = {}
+
+        try:
+            return by_class[cls]
+        except KeyError:
+            pass
+
+        tag = None
+        for base in cls.__mro__:
+            if base in self.classes:
+                tag = self.classes[base]
+                break
+        by_class[cls] = tag
+        return tag
+
+    def _tag_of(self, value):
+        tag = None
+        if self.classes:
+            tag = self._variant_by_class(value.__class__)
+        if tag is None:
+            if hasattr(value, 'get'):
+                tag = value.get(self.discriminator)
+            else:
+                tag = getattr(value, self.discriminator, None)
+
+        try:
+            return tag, self._variants()[tag]
+        except (KeyError, TypeError):
+            raise ValueError('No variant for %r' % (value,))
+
+    def serialize(self, value):
+        if value is None:
+            return None
+
+        tag, (unit, key, declared) = self._tag_of(value)
+        serialized = unit.serialize(value)
+        if declared or serialized is None:
+            return serialized
+
+        # Serialized values could be shared by a cache, so they are copied.
+        result = OrderedDict([(self.discriminator, tag)])
+        result.update(serialized)
+        return result
+
+    def serialize_as(self, value, format, trusted=False):
+        if format == ORDERED and not trusted:
+            return self.serialize(value)
+
+        if value is None:
+            return 'null' if format == JSON else None
+
+        tag, (unit, key, declared) = self._tag_of(value)
+        serialized = unit._serialize(value, format, trusted)
+        if declared or serialized in (None, 'null'):
+            return serialized
+
+        if format == ORDERED:
+            result = OrderedDict([(self.discriminator, tag)])
+            result.update(serialized)
+            serialized = result
+        elif format == DICT:
+            serialized = dict(serialized)
+            serialized[self.discriminator] = tag
+        elif format == TUPLE:
+            serialized = (tag,) + serialized
+        elif serialized == '{}':
+            serialized = '{' + key + '}'
+        else:
+            serialized = '{' + key + ',' + serialized[1:]
+        return serialized
+
+    def _deserialize(self, value):
+        if not hasattr(value, 'get'):
+            detail = self.error_messages['mapping'] % {'value': value}
+            return Invalid(detail, self.unit)
+
+        tag = value.get(self.discriminator)
+        if tag is None:
+            detail = self.error_messages['discriminator'] % {
+                'discriminator': self.discriminator}
+            return Invalid({self.discriminator: [detail]}, self.unit)
+
+        variants = self._variants()
+        try:
+            unit, key, declared = variants[tag]
+        except (KeyError, TypeError):
+            detail = self.error_messages['unknown'] % {
+                'value': tag, 'tags': ', '.join(sorted(variants))}
+            return Invalid({self.discriminator: [detail]}, self.unit)
+
+        result = unit._run_validation(value)
+        if result is empty or result.__class__ is Invalid:
+            return result
+        if not declared:
+            result[self.discriminator] = tag
+        return result
+
+
+class Reference(UnitType):
+    """
+    Type of `Ref` units, delegates to the referenced schema and limits
+    depth of recursion by `max_depth` of the unit.
+    """
+    default_error_messages = {
+        'max_depth': _('Maximum depth ${max_depth} exceeded.'),
+    }
+    delegates = True
+
+    def _enter(self):
+        unit = self.unit
+        if unit.max_depth is not None and unit._active >= unit.max_depth:
+            return None
+        resolved = unit.resolve()
+        unit._active += 1
+        return resolved
+
+    def _leave(self):
+        self.unit._active -= 1
+
+    def _max_depth_error(self):
+        return self.error_messages['max_depth'] % {
+            'max_depth': self.unit.max_depth}
+
+    def serialize(self, value):
+        return self.serialize_as(value, ORDERED)
+
+    def serialize_as(self, value, format, trusted=False):
+        resolved = self._enter()
+        if resolved is None:
+            raise ValueError(translate(self._max_depth_error()))
+        try:
+            if format == ORDERED and not trusted:
+                return resolved.serialize(value)
+            return resolved._serialize(value, format, trusted)
+        finally:
+            self._leave()
+
+    def _deserialize(self, value):
+        resolved = self._enter()
+        if resolved is None:
+            return Invalid(self._max_depth_error(), self.unit)
+        try:
+            return resolved.type._deserialize_quietly(value)
+        finally:
+            self._leave()
+
+    def equals(self, old, new):
+        return self.unit.resolve().type.equals(old, new)
@@ -1,9 +1,15 @@
 import copy
 import itertools
+import warnings
+import weakref
 from collections import OrderedDict
 
-from exceptions import ValidationError
-from i18n import TranslationStringFactory as _
+from exceptions import ValidationError, Invalid
+from i18n import TranslationStringFactory as _, get_error_messages
+from formats import (
+    FORMATS, ORDERED, DICT, JSON, get_json_encoder, convert_serialized)
+from validators import Constraint
+from cache import ValidationMemo
 
 
 __all__ = ['SchemaUnit']
@@ -17,6 +23,111 @@ class SkipUnit(Exception):
     pass
 
 
+class SchemaIndex(object):
+    """
+    Index of a schema tree, built once for the root and shared by all
+    units of the tree.
+
+    Paths are tuples of child names, a child of a positional unit
+    (a sequence) and the value child of a keyed unit (a dict) are stored
+    under `'*'`.
+    """
+    ANY_POSITION = '*'
+
+    # Set when units have been added to the tree, e.g. by `Ref`.
+    stale = False
+
+    def __init__(self, root):
+        self.root = root
+        self.units = {}
+        self.paths = {}
+        # Paths of keyed units.
+        self.keyed = set()
+        stack = [(root, ())]
+        while stack:
+            unit, path = stack.pop()
+            unit._index = self
+            self.units[path] = unit
+            self.paths[id(unit)] = path
+            if unit._proxied is not None:
+                # The proxied unit shares the path of its proxy.
+                unit = unit._proxied
+                unit._index = self
+                self.paths[id(unit)] = path
+            positional = getattr(unit.type, 'positional', False)
+            keyed = getattr(unit.type, 'keyed', False)
+            if keyed:
+                self.keyed.add(path)
+            last = len(unit.children) - 1
+            for num, (name, child) in enumerate(unit.children.iteritems()):
+                if positional or (keyed and num == last):
+                    name = self.ANY_POSITION
+                stack.append((child, path + (name,)))
+
+    def __deepcopy__(self, memo):
+        # Copies of units belong to another tree and build their own index.
+        return None
+
+    def path(self, unit):
+        return self.paths[id(unit)]
+
+    def lookup(self, path):
+        key = ()
+        for segment in path:
+            segment = unicode(segment)
+            child = self._child(key, segment)
+            if child is None:
+                # Paths go on through references, e.g. `Ref` units of
+                # recursive schemas, to the units they are resolved to.
+                resolve = getattr(self.units[key], 'resolve', None)
+                if resolve is not None:
+                    resolved = resolve()
+                    if id(resolved) not in self.paths:
+                        # A new unit, which is not indexed yet.
+                        return SchemaIndex(self.root).lookup(path)
+                    child = self._child(self.paths[id(resolved)], segment)
+            if child is None:
+                raise KeyError('.'.join(map(unicode, path)))
+            key = child
+        return self.units[key]
+
+    def _child(self, key, segment):
+        # Key of a child or None.
+        if key + (segment,) in self.units:
+            return key + (segment,)
+        if ((segment.isdigit() or key in self.keyed) and
+                key + (self.ANY_POSITION,) in self.units):
+            return key + (self.ANY_POSITION,)
+        return None
+
+
+def check_limits(data, max_nodes=None, max_nesting=None):
+    """
+    Returns 'max_nodes' or 'max_nesting' if data has more values, including
+    itself, or more levels of nested lists, tuples and dicts than given,
+    None otherwise. Sizes of containers are checked before their items, so
+    it takes O(max_nodes) time at most.
+    """
+    nodes = 1
+    stack = [(data, 1)]
+    while stack:
+        value, level = stack.pop()
+        if isinstance(value, dict):
+            items = value.itervalues()
+        elif isinstance(value, (list, tuple)):
+            items = value
+        else:
+            continue
+        if max_nesting is not None and level > max_nesting:
+            return 'max_nesting'
+        nodes += len(value)
+        if max_nodes is not None and nodes > max_nodes:
+            return 'max_nodes'
+        level += 1
+        stack.extend((item, level) for item in items)
+    return None
+
+
 # Schema units
 
 class _SchemaUnit(object):
@@ -24,7 +135,9 @@ class _SchemaUnit(object):
 
     default_error_messages = {
         'required': _('This field is required.'),
-        'none': _('None does not allow.')
+        'none': _('None does not allow.'),
+        'max_nodes': _('Data has more than ${max_nodes} values.'),
+        'max_nesting': _('Data is nested deeper than ${max_nesting} levels.'),
     }
 
     def __new__(cls, *args, **kw):
@@ -59,11 +172,8 @@ class _SchemaUnit(object):
 
         self.source_object = kwargs.pop('object', None)
 
-        messages = {}
-        for c in reversed(self.__class__.__mro__):
-            messages.update(getattr(c, 'default_error_messages', {}))
-        messages.update(kwargs.pop('error_messages', {}))
-        self.error_messages = messages
+        self.error_messages = get_error_messages(
+            self.__class__, kwargs.pop('error_messages', None))
 
         self.required = kwargs.pop('required', True)
         self.default = kwargs.pop('default', empty)
@@ -78,6 +188,24 @@ class _SchemaUnit(object):
 
         self.preparer = kwargs.pop('preparer', None)
 
+        # See `serialize`.
+        self.trusted = kwargs.pop('trusted', False)
+
+        # See `is_pure`.
+        self.pure = kwargs.pop('pure', None)
+
+        # Roles the unit is visible for, e.g. `('admin', 'staff')`, or a
+        # function of a role. See `is_visible`.
+        self.visible = kwargs.pop('visible', None)
+
+        # Limits of the whole value, checked before it is validated, see
+        # `check_limits`.
+        self.max_nodes = kwargs.pop('max_nodes', None)
+        self.max_nesting = kwargs.pop('max_nesting', None)
+        self._limits = None
+        if self.max_nodes is not None or self.max_nesting is not None:
+            self._limits = (self.max_nodes, self.max_nesting)
+
         assert not kwargs, 'Unknown arguments: %s' % kwargs
 
     @property
@@ -97,10 +225,47 @@ class _SchemaUnit(object):
         self._context = {}
         self._initial_data = empty
 
-    def serialize(self, value=empty):
+    def serialize(self, value=empty, format=None, encoder=None, trusted=None):
+        """
+        Args:
+            format - Output format, one of `ORDERED` (by default), `DICT`,
+                `TUPLE` or `JSON`.
+            encoder - An encoder for `JSON` format, see `set_json_encoder`.
+            trusted - Values are already of serialized types, e.g. loaded
+                from a database, so they are not converted. Defaults to
+                `trusted` of the unit.
+        """
         if value is empty:
             value = self.source_object
-        return self.type.serialize(value)
+        if trusted is None:
+            trusted = self.trusted
+        if format is None:
+            if not trusted:
+                return self.type.serialize(value)
+            return self._serialize_type(value, ORDERED, trusted)
+        if format not in FORMATS:
+            raise ValueError('Unknown format: %r' % (format,))
+        if format == JSON:
+            encoder = encoder or get_json_encoder()
+            if encoder is not None:
+                return encoder(self._serialize(value, DICT, trusted))
+        return self._serialize(value, format, trusted)
+
+    def _serialize(self, value, format, trusted=False):
+        # Used by unit types to serialize children in the given format.
+        # Subclasses which override `serialize` get it called without a
+        # format, other formats are converted from its result.
+        if self._overrides_serialize:
+            return convert_serialized(
+                self.serialize(value), format, self.type.keyed)
+        return self._serialize_type(value, format, trusted or self.trusted)
+
+    def _serialize_type(self, value, format, trusted):
+        type_ = self.type
+        if type_._overrides_serialize:
+            return convert_serialized(
+                type_.serialize(value), format, type_.keyed)
+        return type_.serialize_as(value, format, trusted)
 
     def deserialize(self, value=empty):
         return self.type.deserialize(value)
@@ -110,35 +275,156 @@ class _SchemaUnit(object):
             raise SkipUnit
         return self.default
 
+    _index = None
+    # Unit which this one stands in for, see `schemas.Ref`.
+    _proxied = None
+
+    # Cross-field constraints, see `SchemaMeta`.
+    __constraints__ = ()
+    __constraint_plan__ = {}
+
+    # Set by SchemaMeta for subclasses which override `run_validation` or
+    # `deserialize`.
+    _overrides_run_validation = False
+    _overrides_deserialize = False
+    # Set by SchemaMeta for subclasses which override `serialize`, see
+    # `_serialize`.
+    _overrides_serialize = False
+
     def run_validation(self, data=empty):
-        if self.preparer is not None:
-            data = self.preparer(data)
+        if self._overrides_run_validation:
+            value = _SchemaUnit._run_validation(self, data)
+        else:
+            value = self._run_validation(data)
+
+        if value is empty:
+            raise SkipUnit
+        if value.__class__ is Invalid:
+            raise value.error()
+        return value
+
+    def _run_validation(self, data=empty):
+        """
+        Same as `run_validation`, but returns `empty` instead of raising
+        `SkipUnit` and `Invalid` instead of raising `ValidationError`.
+        Units and unit types use it to validate their children.
+        """
+        preparer = self.preparer
+        if preparer is not None and (
+                data is not empty or
+                not getattr(preparer, 'skip_empty', False)):
+            try:
+                data = preparer(data)
+            except ValidationError as e:
+                return Invalid(e._detail, self)
 
         if self.read_only:
-            return self.get_default()
+            return self.default
 
         if data is empty:
             if self.required:
-                raise ValidationError(self.error_messages['required'])
-            return self.get_default()
+                return Invalid(self.error_messages['required'], self)
+            return self.default
 
         if data is None:
             if not self.allow_none:
-                raise ValidationError(self.error_messages['none'])
+                return Invalid(self.error_messages['none'], self)
             return None
 
-        value = self.deserialize(data)
+        if self._limits is not None:
+            exceeded = check_limits(data, *self._limits)
+            if exceeded is not None:
+                return Invalid(self.error_messages[exceeded] % {
+                    exceeded: getattr(self, exceeded)}, self)
+
+        if self._overrides_deserialize:
+            try:
+                value = self.deserialize(data)
+            except ValidationError as e:
+                return Invalid(e._detail, self)
+        else:
+            value = self.type._deserialize_quietly(data)
+            if value.__class__ is Invalid:
+                return value
+
         if self.validator:
-            self.validator(self, value)
+            try:
+                self.validator(self, value)
+            except ValidationError as e:
+                return Invalid(e._detail, self)
         return value
 
-    def is_valid(self):
+    # Key of the role in the context, see `is_visible`.
+    visibility_key = 'role'
+
+    def is_visible(self, role):
+        """
+        Whether the unit is visible for a role, hidden units are neither
+        serialized nor validated by their mappings. The role is taken from
+        the context of the tree by `visibility_key` of the mapping, and
+        results are cached per role, so they must depend on the role only.
+        """
+        visible = self.visible
+        if visible is None:
+            return True
+        if callable(visible):
+            return bool(visible(role))
+        return role in visible
+
+    def is_pure(self):
+        """
+        Whether results of validation depend on the input value only and
+        could be reused within a call, see `ValidationMemo`. That is the
+        case for leaf units which type, preparer and validator are pure,
+        or if the unit is created with `pure=True`.
+        """
+        if self.pure is not None:
+            return self.pure
+        return (
+            not self.children and
+            not self._overrides_run_validation and
+            not self._overrides_deserialize and
+            getattr(self.type, 'pure', False) and
+            getattr(self.preparer, 'pure', self.preparer is None) and
+            getattr(self.validator, 'pure', self.validator is None))
+
+    # Memo of the current `is_valid` call, set on the root.
+    _memo = None
+
+    def is_valid(self, memo=None, snapshot=None, changed=None):
+        """
+        Args:
+            memo - A `ValidationMemo` or True for a new one, to validate
+                repeated values of pure units once.
+            snapshot - A `ValidationSnapshot` of the previous call, results
+                of unchanged values are reused.
+            changed - Paths of changed values for the snapshot, e.g.
+                `['address.city', 'items.2']`.
+        """
         self._errors = False
-        try:
-            self._validated_data = self.run_validation(self._initial_data)
-        except ValidationError as e:
+        if memo is None and snapshot is None:
+            value = self._run_validation(self._initial_data)
+        else:
+            if memo is True:
+                memo = ValidationMemo()
+            if snapshot is not None:
+                snapshot.start(memo, changed)
+            root = self.root
+            root._memo = snapshot or memo
+            ValidationMemo.active.count += 1
+            try:
+                if snapshot is None:
+                    value = self._run_validation(self._initial_data)
+                else:
+                    value = snapshot.validate(self, self._initial_data)
+            finally:
+                ValidationMemo.active.count -= 1
+                del root._memo
+        if value.__class__ is Invalid:
             self._validated_data = empty
-            self._errors = e.detail
+            self._errors = value.error().detail
+        else:
+            self._validated_data = value
 
         return not bool(self._errors)
 
@@ -156,38 +442,146 @@ class _SchemaUnit(object):
             return None
         return self._validated_data
 
+    @property
+    def index(self):
+        """
+        `SchemaIndex` of the tree, it is rebuilt when the root has been
+        attached to another unit.
+        """
+        index = self._index
+        if index is None or index.stale or index.root.parent is not None:
+            root = self
+            while root.parent is not None:
+                root = root.parent
+            index = SchemaIndex(root)
+        return index
+
     @property
     def root(self):
-        root = self
-        while root.parent is not None:
-            root = root.parent
-        return root
+        return self.index.root
 
     @property
     def context(self):
-        return getattr(self.root, '_context', {})
+        return getattr(self.index.root, '_context', {})
+
+    @property
+    def depth(self):
+        return len(self.index.path(self))
+
+    def get_unit(self, path):
+        """
+        Returns a unit by dotted path relative to this unit, for example
+        `schema.get_unit('a.b.0.c')`. Raises KeyError if there is no such
+        unit.
+        """
+        if isinstance(path, basestring):
+            path = path.split('.') if path else ()
+        index = self.index
+        return index.lookup(index.path(self) + tuple(path))
+
+
+def _run_overridden_validation(self, data=empty):
+    try:
+        return self.run_validation(data)
+    except ValidationError as e:
+        return Invalid(e._detail, self)
+    except SkipUnit:
+        return empty
 
 
 class SchemaMeta(type):
+    # Schema classes by full name, and in `names` by name and full name,
+    # see `lookup`. A class replaces one of the same full name, e.g. a
+    # redefined one, a name shared by modules is ambiguous.
+    registry = weakref.WeakValueDictionary()
+    names = {}
+
     def __new__(meta, class_name, bases, new_attrs):
+        if ('run_validation' in new_attrs and
+                '_run_validation' not in new_attrs):
+            new_attrs['_run_validation'] = _run_overridden_validation
+            new_attrs['_overrides_run_validation'] = True
+        if 'deserialize' in new_attrs:
+            new_attrs['_overrides_deserialize'] = True
+        if 'serialize' in new_attrs:
+            new_attrs.setdefault('_overrides_serialize', True)
+
         units = []
+        constraints = []
         for name, value in new_attrs.items():
             if isinstance(value, _SchemaUnit):
                 del new_attrs[name]
                 if value.name is None:
                     value.name = name
                 units.append((name, value))
+            elif isinstance(value, Constraint):
+                del new_attrs[name]
+                constraints.append(value)
 
         units.sort(key=lambda el: el[1]._order)
+        constraints.sort(key=lambda c: c._order)
 
         # Inherit super classes children.
         for base in reversed(bases):
             if hasattr(base, '__schema_units__'):
                 units = list(base.__schema_units__.iteritems()) + units
+            if hasattr(base, '__constraints__'):
+                constraints = list(base.__constraints__) + constraints
 
         new_attrs['__schema_units__'] = OrderedDict(units)
-
-        return type.__new__(meta, class_name, bases, new_attrs)
+        new_attrs['__constraints__'] = tuple(constraints)
+        new_attrs['__constraint_plan__'] = meta.plan_constraints(
+            class_name, new_attrs['__schema_units__'], constraints)
+
+        cls = type.__new__(meta, class_name, bases, new_attrs)
+        full_name = '%s.%s' % (cls.__module__, class_name)
+        classes = meta.names.setdefault(
+            class_name, weakref.WeakValueDictionary())
+        if [name for name in classes.keys() if name != full_name]:
+            warnings.warn(
+                'Schema name %s is ambiguous, refer to %s by full name.' % (
+                    class_name, full_name),
+                stacklevel=2)
+        classes[full_name] = meta.registry[full_name] = cls
+        return cls
+
+    @classmethod
+    def lookup(meta, name):
+        """
+        Returns a schema class by name, or by module and name if names
+        are ambiguous, e.g. `'myapp.schemas.CommentSchema'`.
+        """
+        try:
+            return meta.registry[name]
+        except KeyError:
+            pass
+        classes = meta.names.get(name, {}).items()
+        if not classes:
+            raise KeyError('Unknown schema: %s' % name)
+        if len(classes) > 1:
+            raise KeyError('Ambiguous schema name: %s, one of %s' % (
+                name, ', '.join(sorted(dict(classes)))))
+        return classes[0][1]
+
+    @staticmethod
+    def plan_constraints(class_name, units, constraints):
+        """
+        Returns a mapping of unit names to constraints which should be
+        checked right after the unit, that is after the last unit the
+        constraint depends on.
+        """
+        positions = dict((name, i) for i, name in enumerate(units))
+        plan = {}
+        for constraint in constraints:
+            unknown = [name for name in constraint.fields
+                       if name not in positions]
+            if unknown:
+                raise TypeError('%s has no units %s required by %r' % (
+                    class_name, ', '.join(unknown), constraint))
+            last = max(constraint.fields, key=positions.__getitem__)
+            plan.setdefault(last, []).append(constraint)
+
+        return dict((name, tuple(c)) for name, c in plan.iteritems())
 
 
 class SchemaUnit(_SchemaUnit):
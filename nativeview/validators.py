@@ -1,13 +1,19 @@
+import itertools
+import operator
 import re
 
 from exceptions import ValidationError
-from i18n import TranslationStringFactory as _
+from i18n import TranslationStringFactory as _, get_error_messages
 
 
 class ValidatedChain(object):
     def __init__(self, *validators):
         self.validators = list(validators)
 
+    @property
+    def pure(self):
+        return all(getattr(v, 'pure', False) for v in self.validators)
+
     def add(self, validator):
         self.validators.append(validator)
 
@@ -32,6 +38,9 @@ class ValidatedChain(object):
 
 
 class Choices(object):
+    # Validators which result depends on the value only within a call,
+    # see `SchemaUnit.is_pure`.
+    pure = True
     error_message = _("'${value}' is not one of ${choices_values}.")
 
     def __init__(self, iter_or_func):
@@ -64,6 +73,7 @@ class Choices(object):
 
 
 class Range(object):
+    pure = True
     min_error_message = _("'${value}' is less than minimum value ${min}.")
     max_error_message = _("'${value}' is greater than maximum value ${max}.")
 
@@ -97,6 +107,7 @@ class Range(object):
 
 
 class Length(object):
+    pure = True
     # TODO: Make some mixin class to handle error messages and
     # use it in all validators here and in unit_types module.
     default_error_messages = {
@@ -111,11 +122,8 @@ class Length(object):
         self.min = min
         self.max = max
 
-        messages = {}
-        for c in reversed(self.__class__.__mro__):
-            messages.update(getattr(c, 'default_error_messages', {}))
-        messages.update(error_messages or {})
-        self.error_messages = messages
+        self.error_messages = get_error_messages(
+            self.__class__, error_messages)
 
     def __call__(self, unit, value):
         if self.min is not None:
@@ -141,6 +149,7 @@ class Length(object):
 
 
 class Regex(object):
+    pure = True
     error_message = _("String does not match expected pattern.")
     pattern = None
 
@@ -157,3 +166,131 @@ class Regex(object):
 class Email(Regex):
     pattern = "(?i)^[A-Z0-9._%!#$%&'*+-/=?^_`{|}~()]+@[A-Z0-9]+([.-][A-Z0-9]+)*\.[A-Z]{2,8}$"
     error_message = _("Invalid email address.")
+
+
+# Cross-field constraints
+
+_any = object()
+
+class Constraint(object):
+    """
+    Rule between several units of a mapping schema, declared as a class
+    attribute:
+
+        class Event(MappingSchema):
+            start = SchemaUnit(DateTime())
+            end = SchemaUnit(DateTime())
+            end_after_start = Compare('end', '>=', 'start')
+
+    Constraints are checked while the mapping is deserialized, right after
+    the last of their `fields`, and are skipped if one of the fields has
+    failed. Errors are reported under `target`.
+
+    :fields: names of units the constraint depends on.
+    :check: callable taking values of fields, returns false if the
+        constraint is violated. It is called only if all values are present.
+    """
+    _counter = itertools.count()
+
+    default_error_messages = {
+        'invalid': _('Invalid value.'),
+    }
+
+    def __init__(self, fields, check=None, target=None, error_messages=None):
+        self.fields = tuple(fields)
+        if check is not None:
+            self.check = check
+        self.target = target if target is not None else self.fields[0]
+        self.error_messages = get_error_messages(
+            self.__class__, error_messages)
+        self._order = next(self._counter)
+
+    def __call__(self, unit, values):
+        """
+        :values: validated values of the mapping.
+        """
+        if not all(name in values for name in self.fields):
+            return
+
+        if not self.check(*[values[name] for name in self.fields]):
+            raise ValidationError(self.error_messages['invalid'], unit)
+
+    def check(self, *values):
+        raise NotImplementedError
+
+
+class Compare(Constraint):
+    operators = {
+        '<': operator.lt,
+        '<=': operator.le,
+        '>': operator.gt,
+        '>=': operator.ge,
+        '==': operator.eq,
+        '!=': operator.ne,
+    }
+
+    default_error_messages = {
+        'invalid': _("Must be ${op} '${other}'."),
+    }
+
+    def __init__(self, field, op, other, error_messages=None):
+        self.op = op
+        self.compare = self.operators[op]
+        super(Compare, self).__init__(
+            (field, other), error_messages=error_messages)
+
+    def __call__(self, unit, values):
+        field, other = self.fields
+        value = values.get(field)
+        other_value = values.get(other)
+        if value is None or other_value is None:
+            return
+
+        if not self.compare(value, other_value):
+            detail = self.error_messages['invalid'] % {
+                'op': self.op, 'other': other}
+            raise ValidationError(detail, unit)
+
+
+class RequireOneOf(Constraint):
+    default_error_messages = {
+        'invalid': _('One of ${fields} is required.'),
+    }
+
+    def __init__(self, *fields, **kwargs):
+        super(RequireOneOf, self).__init__(fields, **kwargs)
+
+    def __call__(self, unit, values):
+        for name in self.fields:
+            if values.get(name) is not None:
+                return
+
+        detail = self.error_messages['invalid'] % {
+            'fields': ', '.join(self.fields)}
+        raise ValidationError(detail, unit)
+
+
+class RequiredIf(Constraint):
+    """
+    `field` is required if `other` is present, or equals `value` if it
+    is passed.
+    """
+    default_error_messages = {
+        'invalid': _('This field is required.'),
+    }
+
+    def __init__(self, field, other, value=_any, error_messages=None):
+        self.value = value
+        super(RequiredIf, self).__init__(
+            (field, other), error_messages=error_messages)
+
+    def __call__(self, unit, values):
+        field, other = self.fields
+        other_value = values.get(other)
+        if other_value is None:
+            return
+        if self.value is not _any and other_value != self.value:
+            return
+
+        if values.get(field) is None:
+            raise ValidationError(self.error_messages['invalid'], unit)
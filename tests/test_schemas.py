@@ -1,10 +1,36 @@
+import copy
+import gc
+import io
+import json
+import os
+import pickle
+import random
+import re
+import tempfile
+import threading
 import unittest
+import warnings
+from collections import OrderedDict
+from datetime import date, datetime
+
+from dateutil.tz import tzoffset
 
 from nativeview import (
     ValidationError,
-    Integer, DateTime, Date, String, SchemaUnit,
-    SequenceSchema, ObjectMappingSchema, MappingSchema)
+    Integer, Float, Boolean, DateTime, Date, String, SchemaUnit,
+    SequenceSchema, ObjectMappingSchema, MappingSchema, OneOfSchema, Ref,
+    DictSchema, Sequence, Dict, Mapping,
+    ORDERED, DICT, TUPLE, JSON, set_json_encoder, LRUCache, ValidationMemo,
+    ValidationSnapshot)
+from nativeview import ir, tabular, columnar, etags
 from nativeview.metadata import determine_metadata
+from nativeview.validators import (
+    Constraint, Compare, RequireOneOf, RequiredIf, Range, Choices, Length,
+    Regex, Email)
+from nativeview.units import empty, SkipUnit, SchemaMeta
+from nativeview.preparers import (
+    preparer_chain, Strip, Lower, NormalizeWhitespace, EmptyToNone)
+from nativeview.synthetic import PayloadGenerator, generate_string
 
 
 class TestMappingObject(object):
@@ -168,4 +194,1767 @@ class TestObjectMappingSchemaCase(unittest.TestCase):
 
     # def test_metadata(self):
     #     schema = TestObjectSchema()
-    #     print dict(determine_metadata(schema))
\ No newline at end of file
+    #     print dict(determine_metadata(schema))
+
+
+class TrackedObject(TestMappingObject):
+    def __setattr__(self, name, value):
+        self.__dict__.setdefault('assigned', []).append(name)
+        self.__dict__[name] = value
+
+
+class TestSyncChangesCase(unittest.TestCase):
+    def setUp(self):
+        self.serialized_data = {
+            'int_unit': 123,
+            'nested_obj_schema': {
+                'int_unit': 1,
+                'str_unit': 'New string',
+                'str_seq_unit': ['string1', 'string2'],
+                'int_seq_unit': [1, 2, 3]
+            }
+        }
+
+    def test_object_sync_skips_unchanged(self):
+        nested = TrackedObject(
+            int_unit=1, str_unit='Some string',
+            str_seq_unit=['string1', 'string2'], int_seq_unit=[1, 2, 3])
+        instance = TrackedObject(int_unit=123, nested_obj_schema=nested)
+
+        schema = TestObjectSchemaNested1(
+            object=instance, data=self.serialized_data)
+        self.assertTrue(schema.is_valid())
+        self.assertIs(schema.sync(), instance)
+
+        self.assertNotIn('assigned', instance.__dict__)
+        self.assertEqual(nested.assigned, ['str_unit'])
+        self.assertEqual(nested.str_unit, 'New string')
+        self.assertEqual(
+            schema.changes,
+            {'nested_obj_schema': {'str_unit': ('Some string', 'New string')}})
+
+    def test_mapping_sync_changes(self):
+        instance = {'int_unit': 1}
+        schema = TestMappingSchemaNested1(
+            object=instance,
+            data={'int_unit': 2, 'nested_dict_schema': {
+                'int_unit': 1, 'str_unit': 'Some string',
+                'str_seq_unit': [], 'int_seq_unit': []}})
+        self.assertTrue(schema.is_valid())
+        schema.sync()
+        self.assertEqual(schema.changes.keys(), ['int_unit', 'nested_dict_schema'])
+        self.assertEqual(schema.changes['int_unit'], (1, 2))
+        self.assertEqual(instance['int_unit'], 2)
+
+    def test_custom_equality(self):
+        class Schema(MappingSchema):
+            str_unit = SchemaUnit(String(
+                equals=lambda old, new: old.lower() == new.lower()))
+
+        instance = {'str_unit': 'abc'}
+        schema = Schema(object=instance, data={'str_unit': 'ABC'})
+        self.assertTrue(schema.is_valid())
+        schema.sync()
+        self.assertEqual(instance['str_unit'], 'abc')
+        self.assertEqual(schema.changes, {})
+
+
+class TestValidationProtocolCase(unittest.TestCase):
+    def test_errors(self):
+        schema = TestMappingSchemaNested1(data={
+            'int_unit': 'broken',
+            'nested_dict_schema': {'str_unit': 'ok', 'int_seq_unit': [1, 'x']}
+        })
+        self.assertFalse(schema.is_valid())
+        self.assertEqual(schema.errors, {
+            'int_unit': ['Enter a whole number.'],
+            'nested_dict_schema': {
+                'int_unit': ['This field is required.'],
+                'str_seq_unit': ['This field is required.'],
+                'int_seq_unit': {1: ['Enter a whole number.']}
+            }
+        })
+        self.assertIsNone(schema.validated_data)
+
+    def test_run_validation_raises(self):
+        unit = SchemaUnit(Integer(), required=False)
+        self.assertRaises(SkipUnit, unit.run_validation)
+        self.assertRaises(ValidationError, unit.run_validation, 'broken')
+        self.assertEqual(unit.run_validation('1'), 1)
+
+    def test_overridden_deserialize(self):
+        class Upper(String):
+            def deserialize(self, value):
+                value = super(Upper, self).deserialize(value)
+                if value == 'BAD':
+                    raise ValidationError('Bad value.', self.unit)
+                return value.upper()
+
+        class Schema(MappingSchema):
+            str_unit = SchemaUnit(Upper())
+
+        schema = Schema(data={'str_unit': 'abc'})
+        self.assertTrue(schema.is_valid())
+        self.assertEqual(schema.validated_data, {'str_unit': 'ABC'})
+
+        schema = Schema(data={'str_unit': 'BAD'})
+        self.assertFalse(schema.is_valid())
+        self.assertEqual(schema.errors, {'str_unit': ['Bad value.']})
+
+    def test_overridden_unit_deserialize(self):
+        class UpperUnit(SchemaUnit):
+            def deserialize(self, value=empty):
+                value = super(UpperUnit, self).deserialize(value)
+                if value == 'bad':
+                    raise ValidationError('Bad.')
+                return value.upper()
+
+        class Schema(MappingSchema):
+            str_unit = UpperUnit(String())
+
+        schema = Schema(data={'str_unit': 'abc'})
+        self.assertTrue(schema.is_valid())
+        self.assertEqual(schema.validated_data, {'str_unit': 'ABC'})
+        self.assertTrue(schema.validate_json('{"str_unit": "abc"}'))
+        self.assertEqual(schema.validated_data, {'str_unit': 'ABC'})
+
+        schema = Schema(data={'str_unit': 'bad'})
+        self.assertFalse(schema.is_valid())
+        self.assertEqual(schema.errors, {'str_unit': ['Bad.']})
+        self.assertFalse(schema.is_valid(memo=True))
+        self.assertEqual(
+            UpperUnit(String()).run_validation('abc'), 'ABC')
+
+    def test_overridden_run_validation(self):
+        class Positive(SchemaUnit):
+            def run_validation(self, data=empty):
+                value = super(Positive, self).run_validation(data)
+                if value <= 0:
+                    raise ValidationError('Must be positive.')
+                return value
+
+        class Schema(MappingSchema):
+            int_unit = Positive(Integer())
+
+        schema = Schema(data={'int_unit': -1})
+        self.assertFalse(schema.is_valid())
+        self.assertEqual(schema.errors, {'int_unit': ['Must be positive.']})
+
+
+class TestSerializeFormatsCase(unittest.TestCase):
+    def setUp(self):
+        self.source_object = TestMappingObject(
+            int_unit=123,
+            nested_obj_schema=TestMappingObject(
+                int_unit=1,
+                str_unit=u'Some "string"',
+                str_seq_unit=['string1', 'string2'],
+                int_seq_unit=[1, 2]))
+        self.schema = TestObjectSchemaNested1(object=self.source_object)
+        self.expected = {
+            'int_unit': 123,
+            'nested_obj_schema': {
+                'int_unit': 1,
+                'str_unit': u'Some "string"',
+                'str_seq_unit': ['string1', 'string2'],
+                'int_seq_unit': [1, 2]
+            }
+        }
+
+    def test_dict(self):
+        result = self.schema.serialize(format=DICT)
+        self.assertIs(type(result), dict)
+        self.assertIs(type(result['nested_obj_schema']), dict)
+        self.assertEqual(result, self.expected)
+
+    def test_tuple(self):
+        self.assertEqual(
+            self.schema.serialize(format=TUPLE),
+            (123, (1, u'Some "string"', ['string1', 'string2'], [1, 2])))
+
+    def test_json(self):
+        result = self.schema.serialize(format=JSON)
+        self.assertEqual(
+            json.loads(result, object_pairs_hook=OrderedDict),
+            self.schema.serialize())
+        self.assertTrue(result.startswith('{"int_unit":123,'))
+
+    def test_json_encoder(self):
+        result = self.schema.serialize(format=JSON, encoder=json.dumps)
+        self.assertEqual(json.loads(result), self.expected)
+
+        set_json_encoder(lambda value: 'encoded')
+        try:
+            self.assertEqual(self.schema.serialize(format=JSON), 'encoded')
+        finally:
+            set_json_encoder(None)
+
+    def test_omit(self):
+        class Schema(MappingSchema):
+            int_unit = SchemaUnit(Integer(), omit_if_none=True)
+            str_seq_unit = StrSeqUnit(omit_if_empty=True)
+            str_unit = SchemaUnit(String())
+
+        schema = Schema(object={'str_seq_unit': []})
+        self.assertEqual(schema.serialize(format=JSON), '{"str_unit":null}')
+        self.assertEqual(schema.serialize(format=DICT), {'str_unit': None})
+        self.assertEqual(schema.serialize(format=TUPLE), (None, [], None))
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, self.schema.serialize, format='xml')
+
+    def test_overridden_serialize(self):
+        class UpperUnit(SchemaUnit):
+            def serialize(self, value=empty):
+                return super(UpperUnit, self).serialize(value).upper()
+
+        class ExtraMapping(Mapping):
+            def serialize(self, value):
+                result = super(ExtraMapping, self).serialize(value)
+                result['extra'] = True
+                return result
+
+        class InnerSchema(MappingSchema):
+            schema_type = ExtraMapping
+            int_unit = SchemaUnit(Integer())
+
+        class InnerSeqSchema(SequenceSchema):
+            item = InnerSchema()
+
+        class Schema(MappingSchema):
+            str_unit = UpperUnit(String())
+            inner = InnerSchema()
+            items = InnerSeqSchema()
+
+        value = {'str_unit': 'abc', 'inner': {'int_unit': 1},
+                 'items': [{'int_unit': 2}]}
+        expected = {'str_unit': 'ABC', 'inner': {'int_unit': 1, 'extra': True},
+                    'items': [{'int_unit': 2, 'extra': True}]}
+        for trusted in (False, True):
+            schema = Schema(trusted=trusted)
+            self.assertEqual(schema.serialize(value), expected)
+            self.assertEqual(schema.serialize(value, DICT), expected)
+            self.assertEqual(
+                json.loads(schema.serialize(value, JSON),
+                           object_pairs_hook=OrderedDict),
+                schema.serialize(value, ORDERED))
+            self.assertEqual(
+                schema.serialize(value, TUPLE),
+                ('ABC', (1, True), [(2, True)]))
+            self.assertEqual(schema.etag(value),
+                             etags.digest(schema.serialize(value, JSON)))
+
+
+class CachedObjectSchema(TestObjectSchema):
+    cache_backend = LRUCache(maxsize=2)
+
+
+class TestSerializationCacheCase(unittest.TestCase):
+    def setUp(self):
+        CachedObjectSchema.cache_backend.clear()
+        self.source_object = TestMappingObject(
+            id=1, version=1, int_unit=123, str_unit='Some string',
+            str_seq_unit=['string1'], int_seq_unit=[1])
+
+    def test_cached(self):
+        schema = CachedObjectSchema(object=self.source_object)
+        result = schema.serialize()
+        self.source_object.int_unit = 0
+        self.assertIs(schema.serialize(), result)
+        self.assertEqual(result['int_unit'], 123)
+
+        self.source_object.version = 2
+        self.assertEqual(schema.serialize()['int_unit'], 0)
+
+    def test_formats(self):
+        schema = CachedObjectSchema(object=self.source_object)
+        self.assertIsInstance(schema.serialize(), OrderedDict)
+        self.assertIs(type(schema.serialize(format=DICT)), dict)
+        json_result = schema.serialize(format=JSON)
+        self.assertIs(schema.serialize(format=JSON), json_result)
+
+    def test_nested(self):
+        class Schema(ObjectMappingSchema):
+            nested_obj_schema = CachedObjectSchema()
+
+        schema = Schema(object=TestMappingObject(
+            nested_obj_schema=self.source_object))
+        result = schema.serialize()
+        self.source_object.int_unit = 0
+        self.assertIs(
+            schema.serialize()['nested_obj_schema'],
+            result['nested_obj_schema'])
+
+    def test_trusted(self):
+        self.source_object.int_unit = '123'
+        schema = CachedObjectSchema(object=self.source_object)
+        for format in (None, DICT, JSON):
+            self.assertIn('123', str(schema.serialize(format=format)))
+            # Trusted values are not converted, so results are not shared.
+            self.assertRaises(AssertionError, schema.serialize,
+                              format=format, trusted=True)
+        self.assertNotEqual(
+            schema.get_cache_key(self.source_object),
+            schema.get_cache_key(self.source_object, trusted=True))
+
+    def test_not_versioned(self):
+        del self.source_object.version
+        schema = CachedObjectSchema(object=self.source_object)
+        self.assertIsNot(schema.serialize(), schema.serialize())
+
+    def test_lru(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+
+class TestSchemaIndexCase(unittest.TestCase):
+    def test_get_unit(self):
+        class Schema(MappingSchema):
+            nested = TestMappingSchemaNested1()
+            seq = StrSeqUnit()
+
+        schema = Schema()
+        nested = schema.children['nested']
+        self.assertIs(schema.get_unit('nested'), nested)
+        self.assertIs(
+            schema.get_unit('nested.nested_dict_schema.int_unit'),
+            nested.children['nested_dict_schema'].children['int_unit'])
+        self.assertIs(
+            schema.get_unit('seq.3'), schema.children['seq'].children['item'])
+        self.assertIs(
+            nested.get_unit(['nested_dict_schema', 'str_seq_unit', 0]),
+            schema.get_unit('nested.nested_dict_schema.str_seq_unit.0'))
+        self.assertIs(schema.get_unit(''), schema)
+        self.assertRaises(KeyError, schema.get_unit, 'nested.missing')
+        self.assertRaises(KeyError, schema.get_unit, 'seq.item')
+
+    def test_root_and_context(self):
+        seen = []
+
+        def validator(unit, value):
+            seen.append(unit.context['user'])
+
+        class Item(MappingSchema):
+            value = SchemaUnit(Integer(), validator=validator)
+
+        class Items(SequenceSchema):
+            item = Item()
+
+        class Schema(MappingSchema):
+            items = Items()
+
+        schema = Schema(
+            data={'items': [{'value': 1}, {'value': 2}]},
+            context={'user': 'admin'})
+        self.assertTrue(schema.is_valid())
+        self.assertEqual(seen, ['admin', 'admin'])
+
+        unit = schema.get_unit('items.0.value')
+        self.assertIs(unit.root, schema)
+        self.assertEqual(unit.depth, 3)
+        self.assertIs(unit.index, schema.index)
+
+    def test_reattached_root(self):
+        schema = TestMappingSchema()
+        unit = schema.children['int_unit']
+        self.assertIs(unit.root, schema)
+
+        parent = MappingSchema()
+        parent.children['schema'] = schema
+        schema.parent = parent
+        self.assertIs(unit.root, parent)
+        self.assertEqual(unit.depth, 2)
+        self.assertIs(parent.get_unit('schema.int_unit'), unit)
+
+
+class EventSchema(MappingSchema):
+    start = SchemaUnit(Integer())
+    end = SchemaUnit(Integer(), allow_none=True)
+    email = SchemaUnit(String(), required=False)
+    phone = SchemaUnit(String(), required=False)
+    notify = SchemaUnit(Integer(), required=False)
+
+    end_after_start = Compare('end', '>=', 'start')
+    contact = RequireOneOf('email', 'phone')
+    notify_needs_email = RequiredIf('email', 'notify', value=1)
+
+
+class TestConstraintsCase(unittest.TestCase):
+    def validate(self, schema_cls, data):
+        schema = schema_cls(data=data)
+        schema.is_valid()
+        return schema.errors
+
+    def test_valid(self):
+        self.assertFalse(self.validate(
+            EventSchema, {'start': 1, 'end': 2, 'phone': '1'}))
+        self.assertFalse(self.validate(
+            EventSchema, {'start': 1, 'end': None, 'email': 'a@b.c',
+                          'notify': 1}))
+
+    def test_errors(self):
+        errors = self.validate(
+            EventSchema, {'start': 2, 'end': 1, 'notify': 1})
+        self.assertEqual(errors, {
+            'end': ["Must be >= 'start'."],
+            'email': ['One of email, phone is required.'],
+        })
+
+        errors = self.validate(
+            EventSchema, {'start': 2, 'end': 1, 'phone': '1', 'notify': 0})
+        self.assertEqual(errors, {'end': ["Must be >= 'start'."]})
+
+    def test_failed_dependency(self):
+        errors = self.validate(
+            EventSchema, {'start': 'Broken', 'end': 1, 'phone': '1'})
+        self.assertEqual(list(errors), ['start'])
+
+    def test_custom_and_inherited(self):
+        class Schema(EventSchema):
+            duration = SchemaUnit(Integer())
+            matches = Constraint(
+                ('duration', 'start', 'end'),
+                lambda duration, start, end: end - start == duration,
+                error_messages={'invalid': 'Wrong duration.'})
+
+        self.assertEqual(len(Schema.__constraints__), 4)
+        self.assertEqual(
+            self.validate(Schema, {
+                'start': 1, 'end': 3, 'phone': '1', 'duration': 1}),
+            {'duration': ['Wrong duration.']})
+        self.assertFalse(self.validate(Schema, {
+            'start': 1, 'end': 3, 'phone': '1', 'duration': 2}))
+
+    def test_nested_target(self):
+        class Schema(MappingSchema):
+            start = SchemaUnit(Integer())
+            end = SchemaUnit(Integer())
+            nested = TestMappingSchemaNested1(required=False)
+            end_after_start = Constraint(
+                ('start', 'end'), lambda start, end: end >= start,
+                target='nested')
+
+        class NestedFirstSchema(MappingSchema):
+            nested = TestMappingSchemaNested1(required=False)
+            start = SchemaUnit(Integer())
+            end = SchemaUnit(Integer())
+            end_after_start = Constraint(
+                ('start', 'end'), lambda start, end: end >= start,
+                target='nested')
+
+        data = {'start': 2, 'end': 1, 'nested': {'int_unit': 'Broken'}}
+        for schema_cls in (Schema, NestedFirstSchema):
+            errors = self.validate(schema_cls, data)
+            self.assertEqual(errors['nested'][None], ['Invalid value.'])
+            self.assertEqual(errors['nested']['int_unit'],
+                             ['Enter a whole number.'])
+            schema = schema_cls()
+            self.assertFalse(schema.validate_json(json.dumps(data)))
+            self.assertEqual(schema.errors, errors)
+            self.assertEqual(
+                self.validate(schema_cls, {'start': 2, 'end': 1}),
+                {'nested': ['Invalid value.']})
+
+    def test_unknown_unit(self):
+        with self.assertRaises(TypeError):
+            class Schema(MappingSchema):
+                start = SchemaUnit(Integer())
+                end_after_start = Compare('end', '>=', 'start')
+
+
+class TestSchemaIRCase(unittest.TestCase):
+    def test_round_trip(self):
+        schema = ir.loads(ir.dumps(TestObjectSchemaNested1))
+        self.assertIs(schema.__class__, TestObjectSchemaNested1)
+        self.assertEqual(
+            determine_metadata(schema),
+            determine_metadata(TestObjectSchemaNested1()))
+
+        nested = schema.children['nested_obj_schema']
+        self.assertIs(nested.parent, schema)
+        self.assertIs(nested.type.unit, nested)
+        self.assertIs(schema.get_unit('nested_obj_schema.int_seq_unit.0'),
+                      nested.children['int_seq_unit'].children['item'])
+
+        value = TestMappingObject(
+            int_unit=1, nested_obj_schema=TestMappingObject(
+                int_unit=2, str_unit='a', str_seq_unit=['b'],
+                int_seq_unit=[3]))
+        self.assertEqual(
+            schema.serialize(value),
+            TestObjectSchemaNested1().serialize(value))
+
+    def test_validation(self):
+        data = ir.dumps(EventSchema)
+        schema = ir.loads(data)
+        schema.bind(data={'start': 2, 'end': 1, 'phone': '1'})
+        self.assertFalse(schema.is_valid())
+        self.assertEqual(schema.errors, {'end': ["Must be >= 'start'."]})
+
+        other = ir.loads(data)
+        self.assertIsNot(other.children['start'], schema.children['start'])
+        self.assertFalse(hasattr(other, '_errors'))
+
+    def test_cached(self):
+        self.assertIs(ir.to_ir(EventSchema), ir.to_ir(EventSchema))
+        self.assertIsNot(ir.to_ir(EventSchema()), ir.to_ir(EventSchema))
+
+    def test_version(self):
+        version, node = ir.to_ir(EventSchema)
+        self.assertRaises(ValueError, ir.from_ir, (version + 1, node))
+
+
+class Created(TestMappingObject):
+    pass
+
+
+class CreatedSchema(ObjectMappingSchema):
+    type = SchemaUnit(String())
+    name = SchemaUnit(String())
+
+
+class DeletedSchema(MappingSchema):
+    id = SchemaUnit(Integer())
+
+
+class UserEventSchema(OneOfSchema):
+    classes = {Created: 'created'}
+
+    created = CreatedSchema()
+    deleted = DeletedSchema()
+
+
+class UserEventsSchema(SequenceSchema):
+    item = UserEventSchema()
+
+
+class TestOneOfSchemaCase(unittest.TestCase):
+    def test_deserialize(self):
+        schema = UserEventsSchema(data=[
+            {'type': 'created', 'name': 'Bob'},
+            {'type': 'deleted', 'id': '1'}])
+        self.assertTrue(schema.is_valid())
+        self.assertEqual(schema.validated_data, [
+            {'type': 'created', 'name': 'Bob'},
+            {'id': 1, 'type': 'deleted'}])
+
+    def test_errors(self):
+        schema = UserEventsSchema(data=[
+            {'type': 'deleted', 'id': 'Broken'},
+            {'type': 'updated'},
+            {'name': 'Bob'},
+            'Broken'])
+        self.assertFalse(schema.is_valid())
+        self.assertEqual(schema.errors, {
+            0: {'id': ['Enter a whole number.']},
+            1: {'type': ["'updated' is not one of created, deleted."]},
+            2: {'type': ["'type' is required."]},
+            3: ["'Broken' is not a mapping."]})
+
+    def test_serialize(self):
+        events = [Created(type='created', name='Bob'), {'type': 'deleted',
+                                                        'id': 1}]
+        schema = UserEventsSchema()
+        self.assertEqual(schema.serialize(events), [
+            {'type': 'created', 'name': 'Bob'},
+            {'type': 'deleted', 'id': 1}])
+        self.assertEqual(
+            schema.serialize(events, format=TUPLE),
+            [('created', 'Bob'), ('deleted', 1)])
+        self.assertEqual(
+            json.loads(schema.serialize(events, format=JSON)),
+            json.loads(json.dumps(schema.serialize(events, format=DICT))))
+        self.assertRaises(ValueError, schema.serialize, [{'type': 'x'}])
+
+    def test_metadata(self):
+        metadata = determine_metadata(UserEventSchema())
+        self.assertEqual(metadata['type'], 'one_of')
+        self.assertEqual(metadata['discriminator'], 'type')
+        self.assertEqual(list(metadata['variants']), ['created', 'deleted'])
+        self.assertEqual(
+            metadata['variants']['deleted']['fields']['id']['type'],
+            'integer')
+
+    def test_sync(self):
+        schema = UserEventSchema(data={'type': 'created', 'name': 'Alice'})
+        self.assertTrue(schema.is_valid())
+        instance = Created(type='created', name='Bob')
+        self.assertIs(schema.sync(instance), instance)
+        self.assertEqual(instance.name, 'Alice')
+        self.assertEqual(schema.changes, {'name': ('Bob', 'Alice')})
+
+        schema = UserEventSchema(data={'type': 'deleted', 'id': 1})
+        self.assertTrue(schema.is_valid())
+        self.assertEqual(schema.sync(instance), {'id': 1})
+
+    def test_sync_without_instance(self):
+        data = [{'type': 'created', 'name': 'Alice'},
+                {'type': 'deleted', 'id': 1}]
+        schema = UserEventsSchema(data=data)
+        self.assertTrue(schema.is_valid())
+        created, deleted = schema.sync()
+        self.assertIsInstance(created, Created)
+        self.assertEqual((created.type, created.name), ('created', 'Alice'))
+        self.assertEqual(deleted, {'id': 1})
+
+        class UnclassedEventSchema(UserEventSchema):
+            classes = {}
+
+        schema = UnclassedEventSchema(data=data[0])
+        self.assertTrue(schema.is_valid())
+        self.assertEqual(schema.sync(), data[0])
+        self.assertEqual(schema.changes, {})
+
+
+class RepliesSchema(SequenceSchema):
+    item = Ref('CommentSchema', max_depth=3)
+
+
+class CommentSchema(MappingSchema):
+    text = SchemaUnit(String())
+    replies = RepliesSchema(required=False, omit_if_none=True)
+
+
+class PostSchema(MappingSchema):
+    title = SchemaUnit(String())
+    comment = Ref(CommentSchema, required=False)
+
+
+def comment(depth, text='a'):
+    result = {'text': text}
+    if depth:
+        result['replies'] = [comment(depth - 1)]
+    return result
+
+
+class TestRefCase(unittest.TestCase):
+    def test_recursive(self):
+        schema = CommentSchema(data=comment(3))
+        self.assertTrue(schema.is_valid())
+        self.assertEqual(schema.validated_data, comment(3))
+        self.assertEqual(schema.serialize(comment(3)), comment(3))
+        self.assertEqual(
+            json.loads(schema.serialize(comment(3), format=JSON)),
+            comment(3))
+
+        ref = schema.get_unit('replies.0')
+        self.assertIs(ref.resolve(), schema)
+        self.assertIs(schema.get_unit('replies.0.text'),
+                      schema.children['text'])
+        self.assertIs(schema.get_unit('replies.0.replies.3'), ref)
+        self.assertRaises(KeyError, schema.get_unit, 'replies.0.missing')
+
+    def test_max_depth(self):
+        schema = CommentSchema(data=comment(4))
+        self.assertFalse(schema.is_valid())
+        self.assertEqual(
+            schema.errors,
+            {'replies': {0: {'replies': {0: {'replies': {0: {'replies': {
+                0: ['Maximum depth 3 exceeded.']}}}}}}}})
+        self.assertRaises(ValueError, schema.serialize, comment(4))
+
+        # Depth is released after errors.
+        self.assertEqual(schema.serialize(comment(3)), comment(3))
+
+    def test_unit_options(self):
+        schema = PostSchema(data={'title': 'Post'})
+        self.assertTrue(schema.is_valid())
+
+        schema.bind(data={'title': 'Post', 'comment': comment(1, 'b')})
+        self.assertTrue(schema.is_valid())
+        self.assertEqual(schema.validated_data['comment'], comment(1, 'b'))
+
+        ref = schema.children['comment']
+        self.assertIsInstance(ref.resolve(), CommentSchema)
+        self.assertIs(schema.get_unit('comment.replies.0').resolve(),
+                      ref.resolve())
+        self.assertIs(ref.resolve().root, schema)
+        self.assertEqual(schema.get_unit('comment.text').depth, 2)
+
+        # The reference is resolved by the lookup.
+        schema = PostSchema()
+        text = schema.get_unit('comment.replies.0.text')
+        self.assertIs(text, schema.get_unit('comment.text'))
+        self.assertEqual(text.depth, 2)
+
+    def test_sync(self):
+        schema = CommentSchema(data=comment(2, 'b'))
+        self.assertTrue(schema.is_valid())
+        instance = comment(2)
+        self.assertIs(schema.sync(instance), instance)
+        self.assertEqual(instance['text'], 'b')
+        self.assertEqual(instance['replies'], [
+            {'text': 'a', 'replies': [{'text': 'a'}]}])
+
+    def test_metadata(self):
+        metadata = determine_metadata(CommentSchema())
+        item = metadata['fields']['replies']['fields']['item']
+        self.assertEqual(item['type'], 'ref')
+        self.assertEqual(item['ref'], 'CommentSchema')
+        self.assertEqual(item['max_depth'], 3)
+
+    def test_ambiguous_name(self):
+        self.addCleanup(gc.collect)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+
+            class CommentSchema(MappingSchema):
+                __module__ = 'tests.other_schemas'
+                text = SchemaUnit(String())
+
+        self.assertEqual(len(caught), 1)
+        self.assertRaises(KeyError, SchemaMeta.lookup, 'CommentSchema')
+        self.assertIs(
+            SchemaMeta.lookup('tests.other_schemas.CommentSchema'),
+            CommentSchema)
+        self.assertIs(
+            SchemaMeta.lookup(globals()['CommentSchema'].__module__ +
+                              '.CommentSchema'),
+            globals()['CommentSchema'])
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            classes = []
+            for i in range(2):
+                class LocalSchema(MappingSchema):
+                    text = SchemaUnit(String())
+                classes.append(LocalSchema)
+
+        # Redefinitions replace classes of the same full name.
+        self.assertEqual(caught, [])
+        self.assertIs(SchemaMeta.lookup('LocalSchema'), classes[1])
+
+    def test_ir(self):
+        schema = ir.loads(ir.dumps(CommentSchema))
+        schema.bind(data=comment(2))
+        self.assertTrue(schema.is_valid())
+
+
+class StockSchema(DictSchema):
+    sku = SchemaUnit(String())
+    quantity = SchemaUnit(Integer(), validator=Range(min=0))
+
+
+class PricesSchema(DictSchema):
+    sku = SchemaUnit(String())
+    price = SchemaUnit(Float())
+
+
+class WarehouseSchema(MappingSchema):
+    stock = StockSchema()
+
+
+class TestDictSchemaCase(unittest.TestCase):
+    def test_deserialize(self):
+        data = {'a': 1, 'b': 2}
+        schema = StockSchema(data=data)
+        self.assertTrue(schema.is_valid())
+        self.assertIs(schema.validated_data, data)
+
+        data = OrderedDict([('a', 1), ('b', '2'), ('c', 3)])
+        schema.bind(data=data)
+        self.assertTrue(schema.is_valid())
+        self.assertEqual(schema.validated_data, {'a': 1, 'b': 2, 'c': 3})
+        self.assertIsNot(schema.validated_data, data)
+
+    def test_deserialize_numbers(self):
+        data = {'a': 1000, 'b': 2 ** 70}
+        schema = StockSchema(data=data)
+        self.assertTrue(schema.is_valid())
+        self.assertIs(schema.validated_data, data)
+
+        data = {'a': 1.5, 'b': 1e100}
+        schema = PricesSchema(data=data)
+        self.assertTrue(schema.is_valid())
+        self.assertIs(schema.validated_data, data)
+        self.assertIs(schema.serialize(data), data)
+
+        data = {'a': 1.5, 'b': '2.5'}
+        schema.bind(data=data)
+        self.assertTrue(schema.is_valid())
+        self.assertEqual(schema.validated_data, {'a': 1.5, 'b': 2.5})
+        self.assertIsNot(schema.validated_data, data)
+
+    def test_errors(self):
+        schema = WarehouseSchema(data={'stock': {'a': -1, 'b': 'x'}})
+        self.assertFalse(schema.is_valid())
+        self.assertEqual(schema.errors, {'stock': {
+            'a': ["'-1' is less than minimum value 0."],
+            'b': ['Enter a whole number.']}})
+        self.assertIs(
+            schema.get_unit('stock.a'),
+            schema.get_unit('stock').children['quantity'])
+
+        schema.bind(data={'stock': ['a']})
+        self.assertFalse(schema.is_valid())
+        self.assertEqual(
+            schema.errors, {'stock': ["'['a']' is not a mapping."]})
+
+    def test_serialize(self):
+        schema = StockSchema()
+        value = OrderedDict([('a', 1), ('b', 2)])
+        self.assertIs(schema.serialize(value), value)
+        self.assertEqual(schema.serialize(value, format=TUPLE),
+                         (('a', 1), ('b', 2)))
+        self.assertEqual(schema.serialize(value, format=JSON),
+                         '{"a":1,"b":2}')
+
+        value['c'] = '3'
+        serialized = schema.serialize(value, format=DICT)
+        self.assertEqual(serialized, {'a': 1, 'b': 2, 'c': 3})
+        self.assertEqual(value['c'], '3')
+
+    def test_metadata(self):
+        metadata = determine_metadata(StockSchema())
+        self.assertEqual(metadata['type'], 'map')
+        self.assertEqual(metadata['keys']['type'], 'string')
+        self.assertEqual(metadata['values']['min'], 0)
+
+    def test_sync(self):
+        schema = WarehouseSchema(data={'stock': {'a': 1}})
+        self.assertTrue(schema.is_valid())
+        instance = {'stock': {'a': 2}}
+        schema.sync(instance)
+        self.assertEqual(instance, {'stock': {'a': 1}})
+        self.assertEqual(schema.changes, {'stock': ({'a': 2}, {'a': 1})})
+
+
+class TrustedObjectSchema(ObjectMappingSchema):
+    int_unit = SchemaUnit(Integer())
+    str_unit = SchemaUnit(String())
+    date_unit = SchemaUnit(Date())
+    str_seq_unit = StrSeqUnit()
+
+
+class TestTrustedCase(unittest.TestCase):
+    def setUp(self):
+        self.value = TestMappingObject(
+            int_unit=1, str_unit=u'a', date_unit=date(2014, 11, 24),
+            str_seq_unit=['b'])
+
+    def test_same_output(self):
+        schema = TrustedObjectSchema()
+        for format in (None, DICT, TUPLE, JSON):
+            self.assertEqual(
+                schema.serialize(self.value, format=format, trusted=True),
+                schema.serialize(self.value, format=format))
+        self.assertIsInstance(
+            schema.serialize(self.value, trusted=True), OrderedDict)
+
+    def test_values_are_not_converted(self):
+        self.value.int_unit = '1'
+        schema = TrustedObjectSchema(trusted=True)
+        if __debug__:
+            self.assertRaises(AssertionError, schema.serialize, self.value)
+        self.assertEqual(
+            schema.serialize(self.value, trusted=False)['int_unit'], 1)
+
+    def test_nested(self):
+        class Schema(ObjectMappingSchema):
+            nested = TrustedObjectSchema(trusted=True)
+            int_unit = SchemaUnit(Integer())
+
+        value = TestMappingObject(int_unit='2', nested=self.value)
+        self.value.int_unit = '1'
+        if __debug__:
+            self.assertRaises(AssertionError, Schema().serialize, value)
+        self.value.int_unit = 1
+        self.assertEqual(
+            Schema().serialize(value, format=DICT)['int_unit'], 2)
+
+
+class TestPreparersCase(unittest.TestCase):
+    def setUp(self):
+        self.chain = preparer_chain(
+            Strip(), NormalizeWhitespace(), Lower(), EmptyToNone())
+
+    def test_fused(self):
+        self.assertEqual(self.chain('  Hello \t  World '), 'hello world')
+        self.assertEqual(self.chain(u' \u0410 '), u'\u0430')
+        self.assertIsNone(self.chain('   '))
+        self.assertEqual(self.chain(5), 5)
+        self.assertTrue(self.chain.skip_empty)
+        self.assertIs(
+            self.chain.__class__,
+            preparer_chain(Strip(), NormalizeWhitespace(), Lower(),
+                           EmptyToNone()).__class__)
+        self.assertEqual(Strip('x')('xxaxx'), 'a')
+
+    def test_mixed(self):
+        calls = []
+
+        def custom(data):
+            calls.append(data)
+            return 'x' if data is empty else data + '!'
+
+        chain = preparer_chain(Strip(), custom, Lower())
+        self.assertEqual(chain(' A '), 'a!')
+        self.assertFalse(chain.skip_empty)
+
+        unit = SchemaUnit(String(), preparer=chain)
+        self.assertEqual(unit.run_validation(), 'x')
+        self.assertEqual(calls, ['A', empty])
+
+    def test_unit(self):
+        class Schema(MappingSchema):
+            name = SchemaUnit(String(), preparer=self.chain)
+            nickname = SchemaUnit(
+                String(), preparer=self.chain, required=False)
+
+        schema = Schema(data={'name': ' Bob  Smith '})
+        self.assertTrue(schema.is_valid())
+        self.assertEqual(schema.validated_data, {'name': 'bob smith'})
+
+        schema.bind(data={'name': ' ', 'nickname': ''})
+        self.assertFalse(schema.is_valid())
+        self.assertEqual(schema.errors, {
+            'name': ['None does not allow.'],
+            'nickname': ['None does not allow.']})
+
+    def test_metadata(self):
+        unit = SchemaUnit(String(), preparer=preparer_chain(Strip('-'), len))
+        self.assertEqual(determine_metadata(unit)['preparers'], [
+            {'name': 'strip', 'chars': '-'}, {'name': 'len'}])
+
+    def test_copy(self):
+        self.assertIs(copy.deepcopy(self.chain), self.chain)
+        chain = pickle.loads(pickle.dumps(self.chain))
+        self.assertEqual(chain(' A  B '), 'a b')
+
+
+class PersonSchema(ObjectMappingSchema):
+    id = SchemaUnit(Integer())
+    name = SchemaUnit(String())
+    born = SchemaUnit(Date(), required=False)
+
+
+class TestTabularCase(unittest.TestCase):
+    def test_columns(self):
+        self.assertEqual(tabular.columns(PersonSchema), ['id', 'name', 'born'])
+        self.assertRaises(TypeError, tabular.columns, TestObjectSchema)
+
+    def test_dump(self):
+        people = [
+            TestMappingObject(id=1, name=u'Ann \u0411', born=date(1990, 1, 2)),
+            TestMappingObject(id=2, name='Bob, Jr.', born=None),
+        ]
+        f = io.BytesIO()
+        tabular.dump(PersonSchema, people, f)
+        self.assertEqual(f.getvalue(), (
+            'id,name,born\r\n'
+            '1,Ann \xd0\x91,1990-01-02\r\n'
+            '2,"Bob, Jr.",\r\n'))
+
+        f = io.BytesIO()
+        tabular.dump(PersonSchema(), people[1:], f, dialect='excel-tab',
+                     header=False)
+        self.assertEqual(f.getvalue(), '2\tBob, Jr.\t\r\n')
+
+    def test_load(self):
+        f = io.BytesIO(
+            'name,id,extra\r\n'
+            'Ann \xd0\x91,1,x\r\n'
+            'Bob,broken\r\n'
+            ',3\r\n')
+        rows = list(tabular.load(PersonSchema, f))
+        self.assertEqual(rows, [
+            (2, (1, u'Ann \u0411', None), None),
+            (3, (None, 'Bob', None), {(3, 'id'): ['Enter a whole number.']}),
+            (4, (3, None, None), {(4, 'name'): ['This field is required.']}),
+        ])
+
+        f = io.BytesIO('1\tAnn\t2014-01-02\n')
+        rows = list(tabular.load(
+            PersonSchema, f, dialect='excel-tab', header=False))
+        self.assertEqual(rows, [(1, (1, 'Ann', date(2014, 1, 2)), None)])
+
+    def test_role(self):
+        staff = [TestMappingObject(name='Ann', salary=10, notes='n', bonus=1)]
+        expected = {
+            None: 'name\r\nAnn\r\n',
+            'staff': 'name,notes\r\nAnn,n\r\n',
+            'admin': 'name,salary,notes,bonus\r\nAnn,10,n,1\r\n',
+        }
+        for role, text in expected.items():
+            schema = StaffSchema(context={'role': role})
+            self.assertEqual(tabular.columns(schema),
+                             text.split('\r\n')[0].split(','))
+            f = io.BytesIO()
+            tabular.dump(schema, staff, f)
+            self.assertEqual(f.getvalue(), text)
+
+        f = io.BytesIO('name,salary,notes,bonus\r\nAnn,10,n,20\r\n')
+        rows = list(tabular.load(StaffSchema(context={'role': 'staff'}), f))
+        self.assertEqual(rows, [(2, ('Ann', 'n'), None)])
+        f.seek(0)
+        rows = list(tabular.load(StaffSchema(context={'role': 'admin'}), f))
+        self.assertEqual(rows[0][2].keys(), [(2, 'bonus')])
+
+    def test_constraints(self):
+        f = io.BytesIO(
+            'start,end,email,phone,notify\n'
+            '1,2,a@b.c,,1\n'
+            '2,1,,,\n')
+        rows = list(tabular.load(EventSchema, f))
+        self.assertEqual(rows[0], (2, (1, 2, 'a@b.c', None, 1), None))
+        self.assertEqual(rows[1][0], 3)
+        self.assertEqual(sorted(rows[1][2]), [(3, 'email'), (3, 'end')])
+
+
+class ScoreSchema(MappingSchema):
+    id = SchemaUnit(Integer())
+    score = SchemaUnit(Float(), allow_none=True)
+    passed = SchemaUnit(Boolean())
+    name = SchemaUnit(String())
+    at = SchemaUnit(DateTime())
+    day = SchemaUnit(Date())
+
+
+class ScoresSchema(SequenceSchema):
+    item = ScoreSchema()
+
+
+class TestColumnarCase(unittest.TestCase):
+    items = [
+        {'id': 1, 'score': 1.5, 'passed': True, 'name': u'\u0410',
+         'at': datetime(1970, 1, 2, 0, 0, 1, 5), 'day': date(1970, 1, 3)},
+        None,
+        {'id': '3', 'score': None, 'passed': 0, 'name': 7,
+         'at': datetime(1970, 1, 1, 3, tzinfo=tzoffset(None, 3600)),
+         'day': date(1969, 12, 31)},
+    ]
+    expected = OrderedDict([
+        ('id', ('int', [1, None, 3])),
+        ('score', ('float', [1.5, None, None])),
+        ('passed', ('bool', [1, None, 0])),
+        ('name', ('object', [u'\u0410', None, u'7'])),
+        ('at', ('datetime', [86401000005, None, 7200000000])),
+        ('day', ('date', [2, None, -1])),
+    ])
+
+    def check(self, columns):
+        self.assertEqual(list(columns), list(self.expected))
+        for name, (kind, values) in self.expected.iteritems():
+            self.assertEqual(columns[name].kind, kind)
+            self.assertEqual(columns[name].to_list(), values)
+            self.assertEqual(len(columns[name]), 3)
+
+    def test_serialize(self):
+        columns = ScoresSchema().serialize_columns(self.items)
+        self.check(columns)
+        self.assertEqual(
+            list(columns['id'].values),
+            [1, 0, 3] if columnar.INT64 else [1, None, 3])
+        self.assertEqual(columns['id'].nulls, bytearray([0, 1, 0]))
+
+    def test_mmap(self):
+        path = tempfile.mktemp()
+        self.addCleanup(os.remove, path)
+        columns = ScoresSchema().serialize_columns(self.items, path=path)
+        self.check(columns)
+        self.assertIsInstance(columns['score'].values, buffer)
+        self.check(columnar.open_columns(path))
+
+    @unittest.skipIf(columnar.INT64 is None, 'longs are not 64-bit')
+    def test_narrow_longs(self):
+        path = tempfile.mktemp()
+        self.addCleanup(os.remove, path)
+        ScoresSchema().serialize_columns(self.items, path=path)
+        # Opened where longs are narrower.
+        self.addCleanup(setattr, columnar, 'INT64', columnar.INT64)
+        columnar.INT64 = None
+        columns = columnar.open_columns(path)
+        self.check(columns)
+        self.assertIsNone(columns['id'].typecode)
+        self.assertEqual(columns['id'].values, [1, 0, 3])
+
+    def test_not_flat(self):
+        self.assertRaises(
+            TypeError, TestNestedSeqSchema().serialize_columns, [])
+        self.assertRaises(TypeError, StrSeqUnit().serialize_columns, [])
+
+
+class TestNestedSeqSchema(SequenceSchema):
+    item = TestMappingSchema()
+
+
+class TestValidateJSONCase(unittest.TestCase):
+    def check_same(self, schema_cls, data):
+        text = json.dumps(data, indent=2)
+        expected = schema_cls(data=data)
+        expected.is_valid()
+        schema = schema_cls()
+        self.assertEqual(schema.validate_json(text), not expected.errors)
+        self.assertEqual(schema.errors, expected.errors)
+        self.assertEqual(schema.validated_data, expected.validated_data)
+        return schema
+
+    def test_same_as_is_valid(self):
+        self.check_same(TestMappingSchema, {
+            'int_unit': 1, 'str_unit': 'a',
+            'str_seq_unit': ['a', 'b'], 'int_seq_unit': [1, 2]})
+        self.check_same(TestMappingSchema, {
+            'int_unit': 'x', 'extra': {'a': [1]},
+            'str_seq_unit': None, 'int_seq_unit': [1, 'y', 3]})
+        self.check_same(EventSchema, {'start': 2, 'end': 1})
+        self.check_same(PostSchema, {
+            'title': 'Post', 'comments': [
+                {'text': 'a', 'replies': [{'text': 'b', 'replies': []}]}]})
+        self.check_same(UserEventsSchema, [
+            {'type': 'created', 'id': 1}, {'type': 'deleted', 'id': 'x'}])
+        self.check_same(WarehouseSchema, {'stock': {'a': 1, 'b': 'x'}})
+
+    def test_positions(self):
+        schema = self.check_same(TestMappingSchema, {
+            'int_unit': 'x', 'str_unit': 'a',
+            'str_seq_unit': [], 'int_seq_unit': [1, 'y']})
+        self.assertEqual(schema.error_positions, OrderedDict([
+            (('int_seq_unit', 1), (4, 5)),
+            (('int_unit', ), (7, 15)),
+        ]))
+
+        schema = TestMappingSchema()
+        self.assertFalse(schema.validate_json('{"int_unit": 1}'))
+        self.assertEqual(
+            sorted(schema.errors),
+            ['int_seq_unit', 'str_seq_unit', 'str_unit'])
+        self.assertEqual(
+            set(schema.error_positions.values()), set([(1, 15)]))
+
+    def test_syntax_error(self):
+        schema = TestMappingSchema()
+        for text, position in [('{"int_unit": 1,\n "a" 2}', (2, 6)),
+                               ('[1, 2', (1, 5)), ('{} {}', (1, 4)),
+                               ('', (1, 1))]:
+            self.assertFalse(schema.validate_json(text))
+            self.assertEqual(schema.errors, [
+                'Invalid JSON at line %d column %d.' % position])
+            self.assertEqual(schema.error_positions, {(): position})
+
+    def test_wrong_shapes(self):
+        schema = TestMappingSchema()
+        for text in ['[1]', '"x"']:
+            self.assertFalse(schema.validate_json(text))
+            self.assertEqual(
+                schema.errors, ["'%s' is not a mapping." % json.loads(text)])
+            self.assertEqual(schema.error_positions, {(): (1, 1)})
+
+        self.assertFalse(schema.validate_json(
+            '{"int_unit": 1, "str_unit": "a", "int_seq_unit": [],\n'
+            ' "str_seq_unit": {"a": "b"}}'))
+        self.assertEqual(schema.errors, {
+            'str_seq_unit': ["'{u'a': u'b'}' is not a sequence."]})
+        self.assertEqual(
+            schema.error_positions, {('str_seq_unit',): (2, 18)})
+
+        schema = self.check_same(CommentSchema, {
+            'text': 'a', 'replies': [1, {'text': 'b'}]})
+        self.assertEqual(
+            schema.errors, {'replies': {0: ["'1' is not a mapping."]}})
+        self.assertEqual(schema.error_positions, {('replies', 0): (4, 5)})
+
+    def test_limits(self):
+        schema = TestMappingSchema()
+        source = io.BytesIO(json.dumps({
+            'int_unit': 1, 'str_unit': 'a' * 10, 'extra': 1,
+            'str_seq_unit': [], 'int_seq_unit': []}))
+        self.assertFalse(schema.validate_json(
+            source, reject_unknown=True, max_value_size=5))
+        self.assertEqual(schema.errors, {
+            'str_unit': ['Value is longer than 5 characters.'],
+            'extra': ['Unknown field.']})
+
+
+class ImportRowSchema(MappingSchema):
+    country = SchemaUnit(String(), validator=Choices(['de', 'fr']))
+    created = SchemaUnit(DateTime())
+    count = SchemaUnit(Integer(), validator=lambda unit, value: None)
+    score = SchemaUnit(
+        Integer(), validator=lambda unit, value: None, pure=True)
+
+
+class ImportRowsSchema(SequenceSchema):
+    row = ImportRowSchema()
+
+
+class TestValidationMemoCase(unittest.TestCase):
+    def test_pure(self):
+        units = ImportRowSchema().children
+        self.assertTrue(units['country'].is_pure())
+        self.assertTrue(units['created'].is_pure())
+        self.assertFalse(units['count'].is_pure())
+        self.assertTrue(units['score'].is_pure())
+        self.assertFalse(ImportRowsSchema().is_pure())
+        self.assertTrue(SchemaUnit(String(), preparer=preparer_chain(
+            Strip(), Lower())).is_pure())
+        self.assertFalse(SchemaUnit(String(), preparer=len).is_pure())
+
+    def test_memo(self):
+        data = [{'country': ['de', 'fr', 'uk'][i % 3],
+                 'created': '2014-11-24T21:46:10+00:00',
+                 'count': i, 'score': i % 2}
+                for i in range(30)]
+        expected = ImportRowsSchema(data=data)
+        self.assertFalse(expected.is_valid())
+
+        memo = ValidationMemo()
+        schema = ImportRowsSchema(data=data)
+        self.assertFalse(schema.is_valid(memo=memo))
+        self.assertEqual(schema.errors, expected.errors)
+        self.assertEqual(schema.validated_data, expected.validated_data)
+        self.assertIsNone(schema._memo)
+
+        self.assertEqual(memo.stats(), {
+            '*.country': (27, 3),
+            '*.created': (29, 1),
+            '*.score': (28, 2),
+        })
+        self.assertEqual(memo.hits, 84)
+        self.assertAlmostEqual(memo.hit_rate, 84 / 90.0)
+
+        memo = ValidationMemo(maxsize=2)
+        self.assertFalse(schema.is_valid(memo=memo))
+        self.assertEqual(schema.errors, expected.errors)
+        self.assertEqual(memo.size, 2)
+
+    def test_keys(self):
+        schema = IntSeqUnit(data=[1, True, 1, [1]])
+        self.assertFalse(schema.is_valid(memo=True))
+        self.assertEqual(schema.errors, {
+            1: ['Enter a whole number.'], 3: ['Enter a whole number.']})
+
+    def test_threads(self):
+        entered, release = threading.Event(), threading.Event()
+
+        def wait(unit, value):
+            entered.set()
+            release.wait(5)
+
+        class Schema(MappingSchema):
+            int_unit = SchemaUnit(Integer(), validator=wait)
+
+        thread = threading.Thread(
+            target=Schema(data={'int_unit': 1}).is_valid, args=(True,))
+        thread.start()
+        try:
+            self.assertTrue(entered.wait(5))
+            # Calls of other threads are not counted.
+            self.assertEqual(ValidationMemo.active.count, 0)
+        finally:
+            release.set()
+            thread.join()
+
+
+class StaffSchema(ObjectMappingSchema):
+    name = SchemaUnit(String())
+    salary = SchemaUnit(Integer(), visible=['admin'])
+    notes = SchemaUnit(
+        String(), required=False, visible=lambda role: role is not None)
+    bonus = SchemaUnit(Integer(), required=False, visible=['admin'])
+
+    bonus_under_salary = Compare('bonus', '<=', 'salary')
+
+
+class StaffListSchema(SequenceSchema):
+    staff = StaffSchema()
+
+
+class ForbiddenObject(TestMappingObject):
+    def __getattr__(self, name):
+        raise AssertionError('%s is accessed' % name)
+
+
+class TestVisibilityCase(unittest.TestCase):
+    def test_serialize(self):
+        staff = [ForbiddenObject(name='Ann', notes='n')]
+        schema = StaffListSchema(object=staff)
+        self.assertEqual(
+            schema.serialize(format=DICT), [{'name': 'Ann'}])
+        self.assertEqual(schema.serialize(format=JSON), '[{"name":"Ann"}]')
+
+        schema.bind(context={'role': 'user'})
+        self.assertEqual(
+            schema.serialize(), [OrderedDict([('name', 'Ann'), ('notes', 'n')])])
+
+        staff = [TestMappingObject(name='Ann', notes='n', salary=1, bonus=2)]
+        schema = StaffListSchema(object=staff, context={'role': 'admin'})
+        self.assertEqual(schema.serialize(format=TUPLE), [('Ann', 1, 'n', 2)])
+        plans = schema.children['staff'].type._role_plans
+        self.assertEqual(sorted(plans), ['admin'])
+
+    def test_validate(self):
+        data = {'name': 'Ann', 'salary': 'x', 'bonus': 2}
+        schema = StaffSchema(data=data)
+        self.assertTrue(schema.is_valid())
+        self.assertEqual(schema.validated_data, {'name': 'Ann'})
+
+        schema.bind(context={'role': 'admin'})
+        self.assertFalse(schema.is_valid())
+        self.assertEqual(schema.errors, {'salary': ['Enter a whole number.']})
+        schema.bind(data={'name': 'Ann', 'salary': 1, 'bonus': 2})
+        self.assertFalse(schema.is_valid())
+        self.assertIn('bonus', schema.errors)
+        self.assertFalse(schema.validate_json(json.dumps(data)))
+
+    def test_metadata(self):
+        schema = StaffSchema(context={'role': 'user'})
+        self.assertEqual(
+            list(determine_metadata(schema)['fields']), ['name', 'notes'])
+
+    def test_cache(self):
+        class CachedStaffSchema(StaffSchema):
+            cache_backend = LRUCache()
+
+        value = TestMappingObject(
+            id=1, version=1, name='Ann', salary=1, notes=None, bonus=None)
+        schema = CachedStaffSchema(object=value)
+        self.assertEqual(list(schema.serialize()), ['name'])
+        schema.bind(context={'role': 'admin'})
+        self.assertEqual(
+            list(schema.serialize()), ['name', 'salary', 'notes', 'bonus'])
+
+
+class LimitedTagsSchema(SequenceSchema):
+    tag = SchemaUnit(String(max_length=5))
+
+
+class LimitedStockSchema(DictSchema):
+    sku = SchemaUnit(String())
+    quantity = SchemaUnit(Integer())
+
+
+class LimitedSchema(MappingSchema):
+    tags = LimitedTagsSchema(Sequence(max_items=2))
+    stock = LimitedStockSchema(Dict(max_items=1), required=False)
+
+
+class TestPayloadLimitsCase(unittest.TestCase):
+    def test_max_items(self):
+        schema = LimitedSchema(data={'tags': ['a', 'b']})
+        self.assertTrue(schema.is_valid())
+
+        schema.bind(data={'tags': ['a', 'b', 'c'], 'stock': {'a': 1, 'b': 2}})
+        self.assertFalse(schema.is_valid())
+        self.assertEqual(schema.errors, {
+            'tags': ['Ensure this sequence has at most 2 items.'],
+            'stock': ['Ensure this mapping has at most 1 entries.']})
+
+    def test_iterator(self):
+        def tags():
+            for num in xrange(1000):
+                consumed.append(num)
+                yield 'a'
+
+        consumed = []
+        schema = LimitedSchema(data={'tags': tags()})
+        self.assertFalse(schema.is_valid())
+        self.assertEqual(consumed, [0, 1, 2])
+
+    def test_max_length(self):
+        schema = LimitedSchema(data={'tags': ['abcdef']})
+        self.assertFalse(schema.is_valid())
+        self.assertEqual(schema.errors, {
+            'tags': {0: ['Ensure this value has at most 5 characters.']}})
+
+    def test_max_nodes_and_nesting(self):
+        schema = LimitedSchema(max_nodes=5, data={'tags': ['a', 'b']})
+        self.assertTrue(schema.is_valid())
+        schema.bind(data={'tags': ['a', 'b'], 'stock': {'a': 1}})
+        self.assertFalse(schema.is_valid())
+        self.assertEqual(schema.errors, ['Data has more than 5 values.'])
+
+        schema = LimitedSchema(max_nesting=2, data={'tags': [['a']]})
+        self.assertFalse(schema.is_valid())
+        self.assertEqual(
+            schema.errors, ['Data is nested deeper than 2 levels.'])
+
+    def test_validate_json(self):
+        schema = LimitedSchema()
+        self.assertFalse(schema.validate_json(
+            '{"tags": ["a", "b", "c", {"d": [1]}]}'))
+        self.assertEqual(schema.errors, {
+            'tags': ['Ensure this sequence has at most 2 items.']})
+        self.assertEqual(schema.error_positions, {('tags',): (1, 10)})
+
+        # Arrays of objects are walked and stop validating at the limit.
+        schema = ScoresSchema(Sequence(max_items=1))
+        self.assertFalse(schema.validate_json(
+            '[{"name": "a", "score": 1}, {"name": 1}, [2]]'))
+        self.assertEqual(
+            schema.errors, ['Ensure this sequence has at most 1 items.'])
+        self.assertEqual(schema.error_positions, {(): (1, 29)})
+        self.assertFalse(schema.validate_json('[{}, {}'))
+
+        schema = LimitedSchema(max_nodes=3)
+        self.assertFalse(schema.validate_json('{"tags": ["a", "b"]}'))
+        self.assertEqual(schema.errors, ['Data has more than 3 values.'])
+
+    def test_metadata(self):
+        metadata = determine_metadata(LimitedSchema(max_nodes=100))
+        self.assertEqual(metadata['max_nodes'], 100)
+        self.assertEqual(metadata['fields']['tags']['max_items'], 2)
+        self.assertEqual(
+            metadata['fields']['tags']['fields']['tag']['max_length'], 5)
+        self.assertEqual(metadata['fields']['stock']['max_items'], 1)
+
+
+validated_units = []
+
+
+def record_validation(unit, value):
+    validated_units.append(unit.name or unit.__class__.__name__)
+
+
+class DraftAddressSchema(MappingSchema):
+    city = SchemaUnit(String())
+    zip = SchemaUnit(Integer())
+
+
+class DraftLineSchema(MappingSchema):
+    sku = SchemaUnit(String())
+    quantity = SchemaUnit(Integer(), validator=Range(min=1))
+
+
+class DraftLinesSchema(SequenceSchema):
+    line = DraftLineSchema(validator=record_validation)
+
+
+class DraftSchema(MappingSchema):
+    title = SchemaUnit(String())
+    address = DraftAddressSchema(validator=record_validation)
+    lines = DraftLinesSchema(validator=record_validation)
+
+
+class DraftTagsSchema(SequenceSchema):
+    tag = SchemaUnit(Integer(), validator=Range(min=1))
+
+
+class DraftEntrySchema(MappingSchema):
+    tags = DraftTagsSchema()
+
+
+class DraftEntriesSchema(DictSchema):
+    name = SchemaUnit(String())
+    entry = DraftEntrySchema()
+
+
+class DraftBookSchema(MappingSchema):
+    entries = DraftEntriesSchema()
+
+
+class DraftRepliesSchema(SequenceSchema):
+    item = Ref('DraftCommentSchema', max_depth=5)
+
+
+class DraftCommentSchema(MappingSchema):
+    text = SchemaUnit(String(), validator=Length(max=5))
+    replies = DraftRepliesSchema(required=False)
+
+
+class TestValidationSnapshotCase(unittest.TestCase):
+    def setUp(self):
+        del validated_units[:]
+        self.data = {
+            'title': 'Draft',
+            'address': {'city': 'Oslo', 'zip': 150},
+            'lines': [{'sku': 'a', 'quantity': 1},
+                      {'sku': 'b', 'quantity': 2}],
+        }
+
+    def validate(self, schema, data, **kwargs):
+        del validated_units[:]
+        schema.bind(data=data)
+        result = schema.is_valid(**kwargs)
+        if 'changed' in kwargs:
+            return result
+        validated = validated_units[:]
+        expected = DraftSchema(data=data)
+        self.assertEqual(result, expected.is_valid())
+        self.assertEqual(schema.errors, expected.errors)
+        self.assertEqual(schema.validated_data, expected.validated_data)
+        validated_units[:] = validated
+        return result
+
+    def test_reuse(self):
+        snapshot = ValidationSnapshot()
+        schema = DraftSchema()
+        self.assertTrue(self.validate(schema, self.data, snapshot=snapshot))
+        self.assertEqual(snapshot.validated, 5)
+
+        data = copy.deepcopy(self.data)
+        data['lines'][1]['quantity'] = 0
+        self.assertFalse(self.validate(schema, data, snapshot=snapshot))
+        self.assertEqual(schema.errors, {
+            'lines': {1: {'quantity': ["'0' is less than minimum value 1."]}}})
+        # The document, lines and the second line.
+        self.assertEqual((snapshot.reused, snapshot.validated), (2, 3))
+        self.assertEqual(validated_units, [])
+
+        data = copy.deepcopy(data)
+        data['lines'][1]['quantity'] = 3
+        data['title'] = 'Final'
+        self.assertTrue(self.validate(schema, data, snapshot=snapshot))
+        self.assertEqual(validated_units, ['line', 'lines'])
+
+        # Unchanged documents are reused at once.
+        self.assertTrue(self.validate(schema, data, snapshot=snapshot))
+        self.assertEqual((snapshot.reused, snapshot.validated), (1, 0))
+
+    def test_changed(self):
+        snapshot = ValidationSnapshot()
+        schema = DraftSchema()
+        self.validate(schema, self.data, snapshot=snapshot)
+
+        # Changed in place, so only paths tell what to validate.
+        self.data['address']['zip'] = 'x'
+        self.data['lines'][0]['quantity'] = 0
+        self.assertFalse(self.validate(
+            schema, self.data, snapshot=snapshot, changed=['address.zip']))
+        self.assertEqual(
+            schema.errors, {'address': {'zip': ['Enter a whole number.']}})
+        self.assertEqual(validated_units, [])
+        self.assertEqual((snapshot.reused, snapshot.validated), (1, 2))
+
+        self.assertFalse(self.validate(
+            schema, self.data, snapshot=snapshot,
+            changed=[('lines', 0), 'address']))
+        self.assertEqual(snapshot.validated, 4)
+        expected = DraftSchema(data=self.data)
+        self.assertFalse(expected.is_valid())
+        self.assertEqual(schema.errors, expected.errors)
+
+    def test_memo(self):
+        snapshot = ValidationSnapshot()
+        memo = ValidationMemo()
+        schema = DraftSchema()
+        self.validate(schema, self.data, snapshot=snapshot, memo=memo)
+        self.assertEqual(memo.stats()['lines.*.sku'], (0, 2))
+        self.assertIsNone(schema._memo)
+
+
+    def assertSameAsFresh(self, schema, snapshot, changes):
+        for path, change in changes:
+            change()
+            result = schema.is_valid(snapshot=snapshot, changed=[path])
+            expected = schema.__class__(data=schema._initial_data)
+            self.assertEqual(result, expected.is_valid())
+            self.assertEqual(schema.errors, expected.errors)
+            self.assertEqual(schema.validated_data, expected.validated_data)
+
+    def test_changed_dict_entries(self):
+        data = {'entries': {'a': {'tags': [1]}, 'b': {'tags': [2, 3]}}}
+        snapshot = ValidationSnapshot()
+        schema = DraftBookSchema(data=data)
+        self.assertTrue(schema.is_valid(snapshot=snapshot))
+
+        entries = data['entries']
+
+        def break_tag():
+            entries['b']['tags'][0] = 0
+
+        def fix_tag():
+            entries['b']['tags'][0] = 5
+
+        self.assertSameAsFresh(schema, snapshot, [
+            ('entries.b.tags.0', break_tag), ('entries.b.tags.0', fix_tag)])
+        self.assertEqual(schema.validated_data['entries']['a']['tags'], [1])
+
+    def test_changed_through_ref(self):
+        data = {'text': 'r', 'replies': [
+            {'text': 'a', 'replies': [{'text': 'x'}]},
+            {'text': 'b', 'replies': [{'text': 'y'}]}]}
+        snapshot = ValidationSnapshot()
+        schema = DraftCommentSchema(data=data)
+        self.assertTrue(schema.is_valid(snapshot=snapshot))
+
+        reply = data['replies'][1]['replies'][0]
+
+        def rename():
+            reply['text'] = 'z'
+
+        def make_long():
+            reply['text'] = 'too long'
+
+        self.assertSameAsFresh(schema, snapshot, [
+            ('replies.1.replies.0.text', rename),
+            ('replies.1.replies.0.text', make_long)])
+        self.assertEqual(schema.errors, {'replies': {1: {'replies': {0: {
+            'text': ['Longer than maximum length 5.']}}}}})
+
+class TagsSchema(SequenceSchema):
+    tag = SchemaUnit(String(), omit_if_none=True)
+
+
+class ArticleSchema(ObjectMappingSchema):
+    title = SchemaUnit(String())
+    views = SchemaUnit(Integer(), omit_if_none=True)
+    tags = TagsSchema(omit_if_empty=True)
+    related = TagsSchema(omit_if_none=True)
+    author = TestObjectSchemaNested1(allow_none=True)
+
+
+class ArticlesSchema(SequenceSchema):
+    article = ArticleSchema()
+
+
+class ArticleFeedSchema(ObjectMappingSchema):
+    title = SchemaUnit(String())
+    articles = ArticlesSchema(allow_none=True)
+    total = SchemaUnit(Integer(), omit_if_none=True)
+
+
+class TestETagCase(unittest.TestCase):
+    def article(self, **kwargs):
+        values = dict(
+            title=u'\u0410rticle', views=None, tags=[None, 'a'],
+            related=None, author=None)
+        values.update(kwargs)
+        return TestMappingObject(**values)
+
+    def assertETag(self, schema, value, trusted=None):
+        text = schema.serialize(value, format=JSON, trusted=trusted)
+        self.assertEqual(schema.etag(value, trusted=trusted),
+                         etags.digest(text))
+        self.assertEqual(
+            schema.serialize_with_etag(value, trusted=trusted),
+            (text, etags.digest(text)))
+
+    def test_etag(self):
+        schema = ArticlesSchema()
+        self.assertETag(schema, [])
+        self.assertETag(schema, [self.article(), None])
+        self.assertETag(schema, [self.article(
+            views=3, tags=[None], related=[],
+            author=TestMappingObject(
+                int_unit=1, nested_obj_schema=TestMappingObject(
+                    int_unit=2, str_unit='s', str_seq_unit=['a', 'b'],
+                    int_seq_unit=[])))])
+        self.assertNotEqual(
+            schema.etag([self.article()]),
+            schema.etag([self.article(views=1)]))
+        self.assertEqual(
+            schema.etag([self.article()], algorithm='md5'),
+            etags.digest(schema.serialize(
+                [self.article()], format=JSON), 'md5'))
+
+    def test_streamed(self):
+        schema = ArticleFeedSchema()
+        articles = [self.article(), self.article(views=1)]
+        for total in (None, 2):
+            for value in (articles, [], None):
+                self.assertETag(schema, TestMappingObject(
+                    title='Feed', articles=value, total=total))
+
+    def test_trusted(self):
+        schema = ArticleSchema()
+        self.assertETag(schema, self.article(views=3), trusted=True)
+
+    def test_cached(self):
+        class CachedArticleSchema(ArticleSchema):
+            cache_backend = LRUCache()
+
+        schema = CachedArticleSchema()
+        value = self.article(id=1, version=1)
+        self.assertETag(schema, value)
+        self.assertEqual(schema.etag(value), ArticleSchema().etag(value))
+        key = schema.get_cache_key(value, 'etag:sha1')
+        self.assertEqual(
+            CachedArticleSchema.cache_backend.get(key), schema.etag(value))
+
+    def test_source_object(self):
+        value = self.article()
+        self.assertEqual(ArticleSchema(object=value).etag(),
+                         ArticleSchema().etag(value))
+
+
+def validate_odd(unit, value):
+    if not value % 2:
+        raise ValidationError('Must be odd.')
+
+
+class SignupSchema(MappingSchema):
+    login = SchemaUnit(String(), validator=Length(min=3, max=8))
+    email = SchemaUnit(String(), validator=Email())
+    code = SchemaUnit(String(), validator=Regex(r'^[A-Z]{2}-\d{4}$'))
+    age = SchemaUnit(Integer(), validator=Range(min=18, max=30))
+    plan = SchemaUnit(String(), validator=Choices(['free', 'pro']))
+    tags = LimitedTagsSchema(Sequence(max_items=2), required=False)
+    odd = SchemaUnit(Integer(), required=False, validator=validate_odd)
+
+
+class TestPayloadGeneratorCase(unittest.TestCase):
+    def assertPayloads(self, schema_cls, count=20, **kwargs):
+        generator = PayloadGenerator(schema_cls, seed=1, **kwargs)
+        for payload, path in generator.payloads(count, invalid_rate=0.5):
+            schema = schema_cls(data=payload)
+            self.assertEqual(schema.is_valid(), path is None, payload)
+
+    def test_valid(self):
+        generator = PayloadGenerator(SignupSchema, seed=1)
+        for num in range(20):
+            payload = generator.valid(num)
+            self.assertTrue(SignupSchema(data=payload).is_valid())
+            self.assertTrue(3 <= len(payload['login']) <= 8)
+            self.assertTrue(18 <= payload['age'] <= 30)
+            self.assertIn(payload['plan'], ['free', 'pro'])
+            self.assertLessEqual(len(payload.get('tags', [])), 2)
+        self.assertEqual(generator.valid(3), generator.valid(3))
+        self.assertEqual(PayloadGenerator(SignupSchema, seed=1).valid(3),
+                         generator.valid(3))
+        self.assertNotEqual(PayloadGenerator(SignupSchema, seed=2).valid(3),
+                            generator.valid(3))
+
+    def test_invalid(self):
+        generator = PayloadGenerator(SignupSchema, seed=1)
+        payload, path = generator.invalid(5)
+        schema = SignupSchema(data=payload)
+        self.assertFalse(schema.is_valid())
+        self.assertEqual(list(schema.errors), [path[0]])
+        self.assertEqual(generator.invalid(5), (payload, path))
+        self.assertPayloads(SignupSchema)
+
+    def test_schemas(self):
+        self.assertPayloads(EventSchema)
+        self.assertPayloads(UserEventsSchema)
+        self.assertPayloads(PostSchema)
+        self.assertPayloads(WarehouseSchema)
+        self.assertPayloads(LimitedSchema, items=(1, 10))
+        self.assertPayloads(ScoresSchema)
+        self.assertPayloads(TestObjectSchema)
+
+    def test_lazy(self):
+        generator = PayloadGenerator(SignupSchema, seed=1)
+        payloads = generator.payloads(invalid_rate=0.3)
+        first = [next(payloads) for num in range(10)]
+        self.assertEqual(list(generator.payloads(10, 0.3)), first)
+        self.assertEqual(
+            list(generator.payloads(5, 0.3, start=5)), first[5:])
+
+    def test_recursive(self):
+        generator = PayloadGenerator(PostSchema, optional=1, max_depth=4)
+        payload = generator.valid()
+        depth = 0
+        comment = payload['comment']
+        while comment.get('replies'):
+            comment = comment['replies'][0]
+            depth += 1
+        self.assertLessEqual(depth, 2)
+
+    def test_generate_string(self):
+        rng = random.Random(0)
+        patterns = [
+            r'^[A-Z]{2}-\d{4}$', r'(ab|cd)+x?\1', r'[^a-z]{2,}',
+            r'\w+@\w+\.(com|org)', Email.pattern, re.compile(r'a.c')]
+        for pattern in patterns:
+            for num in range(20):
+                text = generate_string(pattern, rng)
+                self.assertTrue(re.match(pattern, text), (pattern, text))
+        self.assertIsNone(generate_string(r'a(?=b)'))
+        self.assertIsNone(generate_string(r'('))
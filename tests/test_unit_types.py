@@ -1,3 +1,8 @@
+import copy
+import hashlib
+import io
+import pickle
+import tempfile
 import unittest
 from datetime import datetime, date
 
@@ -5,7 +10,12 @@ import dateutil.tz
 
 from nativeview import (
     ValidationError, Integer, Float,
-    DateTime, Date, String)
+    DateTime, Date, String, TimeDeltaSeconds, FileFieldStorage, SchemaUnit,
+    set_default_translator)
+from nativeview.metadata import determine_metadata
+from nativeview.unit_types import get_datetime_formatter, get_arrow
+from nativeview.i18n import (
+    TranslationStringFactory as _, CachedTranslator, simple_translator)
 
 
 UTC = dateutil.tz.gettz('UTC')
@@ -71,6 +81,36 @@ class TestDateTime(unittest.TestCase):
         self.assertRaises(ValidationError, self.type.deserialize, 'Broken')
 
 
+class TestDateTimeFormatter(unittest.TestCase):
+    values = [
+        datetime(2014, 11, 24, 21, 46, 10, 20),
+        datetime(2014, 11, 24, 21, 46, 10, 999999, UTC),
+        datetime(1, 2, 3, 4, 5, 6, 7, dateutil.tz.tzoffset(None, -5430)),
+        datetime(2014, 1, 1, tzinfo=dateutil.tz.tzoffset(None, 19800)),
+        date(2014, 3, 4),
+    ]
+
+    def test_same_as_arrow(self):
+        arrow = get_arrow()
+        for format in [DateTime.format, Date.format,
+                       'D/M/YYYY H:m:s S SS SSSS SSSSS SSSSSS Z', '100% YYYY']:
+            formatter = get_datetime_formatter(format)
+            for value in self.values:
+                self.assertEqual(
+                    formatter(value), arrow.get(value).format(format))
+
+    def test_fallback(self):
+        self.assertIsNone(get_datetime_formatter('MMMM YYYY'))
+        # Tokens and escapes which differ between versions of arrow.
+        for format in ['YYYY-MM-DD ZZZ', 'YYYY [at] HH', 'YY', 'DDDD', 'Do',
+                       'W', 'hh a']:
+            self.assertIsNone(get_datetime_formatter(format))
+        self.assertEqual(
+            DateTime(format='MMMM YYYY').serialize(self.values[0]),
+            'November 2014')
+        self.assertIsNone(get_datetime_formatter(DateTime.format)('Broken'))
+
+
 class TestDate(unittest.TestCase):
     def setUp(self):
         self.type = Date()
@@ -114,3 +154,130 @@ class TestString(unittest.TestCase):
 
         self.assertEqual(
             self.type.deserialize(123), u'123')
+
+    def test_max_length(self):
+        type_ = String(max_length=3)
+        self.assertEqual(type_.deserialize(u'abc'), u'abc')
+        with self.assertRaises(ValidationError) as cm:
+            type_.deserialize(u'abcd')
+        self.assertEqual(
+            cm.exception.detail,
+            ['Ensure this value has at most 3 characters.'])
+        self.assertRaises(ValidationError, type_.deserialize, 1234)
+
+
+class TestErrorMessages(unittest.TestCase):
+    def test_shared_table(self):
+        self.assertIs(Integer().error_messages, Integer().error_messages)
+        self.assertIs(
+            copy.deepcopy(Integer()).error_messages, Integer().error_messages)
+        self.assertIn('overflow', TimeDeltaSeconds().error_messages)
+        self.assertIn('invalid', TimeDeltaSeconds().error_messages)
+
+    def test_read_only(self):
+        messages = Integer().error_messages
+        self.assertRaises(
+            TypeError, messages.__setitem__, 'invalid', 'Not a number.')
+        self.assertRaises(TypeError, messages.update, invalid='Not a number.')
+        self.assertRaises(TypeError, messages.pop, 'invalid')
+        self.assertEqual(messages['invalid'], 'Enter a whole number.')
+        self.assertEqual(pickle.loads(pickle.dumps(messages, 2)), messages)
+
+    def test_overrides(self):
+        type_ = Integer(error_messages={'invalid': 'Not a number.'})
+        self.assertEqual(type_.error_messages['invalid'], 'Not a number.')
+        self.assertNotEqual(
+            Integer().error_messages['invalid'], 'Not a number.')
+        with self.assertRaises(ValidationError) as cm:
+            type_.deserialize('Broken')
+        self.assertEqual(cm.exception.detail, ['Not a number.'])
+
+
+class TestCachedTranslator(unittest.TestCase):
+    def tearDown(self):
+        set_default_translator(CachedTranslator(simple_translator))
+
+    def test_cache(self):
+        calls = []
+
+        def translator(term):
+            calls.append(term)
+            return simple_translator(term).upper()
+
+        set_default_translator(CachedTranslator(translator))
+        type_ = DateTime(format='YYYY')
+        for i in range(3):
+            with self.assertRaises(ValidationError) as cm:
+                type_.deserialize('Broken')
+            self.assertEqual(
+                cm.exception.detail,
+                ["DATETIME HAS WRONG FORMAT. USE THIS FORMAT INSTEAD: 'YYYY'."])
+        self.assertEqual(len(calls), 1)
+
+        with self.assertRaises(ValidationError) as cm:
+            DateTime(format='YYYY-MM').deserialize('Broken')
+        cm.exception.detail
+        self.assertEqual(len(calls), 2)
+
+    def test_unhashable_mapping(self):
+        translator = CachedTranslator(simple_translator)
+        term = _('${value}') % {'value': [1]}
+        self.assertEqual(translator(term), '[1]')
+
+
+class Upload(object):
+    def __init__(self, file, type=None, filename='upload.bin'):
+        self.file = file
+        self.type = type
+        self.filename = filename
+
+
+class TestFileFieldStorage(unittest.TestCase):
+    PNG = '\x89PNG\r\n\x1a\n' + 'x' * 100
+
+    def uploads(self, content, type=None):
+        on_disk = tempfile.TemporaryFile()
+        on_disk.write(content)
+        on_disk.seek(0)
+        self.addCleanup(on_disk.close)
+        return [Upload(on_disk, type), Upload(io.BytesIO(content), type)]
+
+    def test_max_size(self):
+        type_ = FileFieldStorage(max_size=10)
+        for upload in self.uploads('x' * 10):
+            self.assertIs(type_.deserialize(upload), upload)
+        for upload in self.uploads('x' * 11):
+            with self.assertRaises(ValidationError) as cm:
+                type_.deserialize(upload)
+            self.assertEqual(
+                cm.exception.detail, ['File is larger than 10 bytes.'])
+
+    def test_checksum(self):
+        type_ = FileFieldStorage(checksum='sha1', chunk_size=7)
+        expected = hashlib.sha1(self.PNG).hexdigest()
+        for upload in self.uploads(self.PNG):
+            upload.file.read(3)
+            type_.deserialize(upload)
+            self.assertEqual(upload.checksum, expected)
+            self.assertEqual(upload.file.tell(), 3)
+
+    def test_content_types(self):
+        type_ = FileFieldStorage(content_types=['image/png'])
+        upload, = self.uploads('', type='image/png')[:1]
+        self.assertIs(type_.deserialize(upload), upload)
+        upload.type = 'text/plain'
+        self.assertRaises(ValidationError, type_.deserialize, upload)
+
+        type_ = FileFieldStorage(content_types=['image/png'], sniff=True)
+        for upload in self.uploads(self.PNG, type='text/plain'):
+            self.assertIs(type_.deserialize(upload), upload)
+        for upload in self.uploads('%PDF-1.4', type='image/png'):
+            self.assertRaises(ValidationError, type_.deserialize, upload)
+
+    def test_metadata(self):
+        unit = SchemaUnit(FileFieldStorage(max_size=10, checksum='md5'))
+        metadata = determine_metadata(unit)
+        self.assertEqual(metadata['type'], 'file')
+        self.assertEqual(metadata['max_size'], 10)
+        self.assertEqual(metadata['checksum'], 'md5')
+        self.assertNotIn('content_types', metadata)